@@ -1,35 +1,21 @@
-import sqlite3
 import json
 import random
 from functools import wraps
+from sqlalchemy import text
+from storage import AGENTS, agents_table, connect, ensure_tables, insert_or_ignore
 
 # Database connection decorator
 def with_db_connection(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('agents.db')
-        try:
-            result = func(conn, *args, **kwargs)
-            conn.commit()
-            return result
-        finally:
-            conn.close()
+        with connect(AGENTS) as conn:
+            return func(conn, *args, **kwargs)
     return wrapper
 
 # Initialize database with proper schema
 @with_db_connection
 def init_agent_db(conn):
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS agents (
-            agent_id TEXT PRIMARY KEY NOT NULL,
-            name TEXT NOT NULL,
-            background_info TEXT NOT NULL,
-            personality_traits TEXT NOT NULL,
-            knowledge_base_links TEXT NOT NULL,
-            communication_style TEXT NOT NULL
-        )
-    ''')
+    ensure_tables(conn, agents_table)
     
     # 插入测试数据
     test_agents = [
@@ -60,17 +46,14 @@ def init_agent_db(conn):
     ]
     
     for agent_data in test_agents:
-        cursor.execute('''
-            INSERT OR IGNORE INTO agents 
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            agent_data["agent_id"],
-            agent_data["name"],
-            json.dumps(agent_data["background_info"]),
-            json.dumps(agent_data["personality_traits"]),
-            json.dumps(agent_data["knowledge_base_links"]),
-            json.dumps(agent_data["communication_style"])
-        ))
+        insert_or_ignore(conn, agents_table, {
+            "agent_id": agent_data["agent_id"],
+            "name": agent_data["name"],
+            "background_info": json.dumps(agent_data["background_info"]),
+            "personality_traits": json.dumps(agent_data["personality_traits"]),
+            "knowledge_base_links": json.dumps(agent_data["knowledge_base_links"]),
+            "communication_style": json.dumps(agent_data["communication_style"])
+        })
     
     print("Agent database initialized with test data")
 
@@ -98,8 +81,6 @@ class Agent:
 # Function to add an agent to the database
 @with_db_connection
 def create_agent(conn, agent_data):
-    cursor = conn.cursor()
-
     # Check if the agent already exists
     if get_agent(agent_data["agent_id"]):
         print(f"Agent with ID {agent_data['agent_id']} already exists!")
@@ -114,27 +95,24 @@ def create_agent(conn, agent_data):
         agent_data["communication_style"]
     )
 
-    cursor.execute('''
+    conn.execute(text('''
         INSERT INTO agents (agent_id, name, background_info, personality_traits, knowledge_base_links, communication_style)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        agent.agent_id,
-        agent.name,
-        json.dumps(agent.background_info),
-        json.dumps(agent.personality_traits),
-        json.dumps(agent.knowledge_base_links),
-        json.dumps(agent.communication_style)
-    ))
+        VALUES (:agent_id, :name, :background_info, :personality_traits, :knowledge_base_links, :communication_style)
+    '''), {
+        "agent_id": agent.agent_id,
+        "name": agent.name,
+        "background_info": json.dumps(agent.background_info),
+        "personality_traits": json.dumps(agent.personality_traits),
+        "knowledge_base_links": json.dumps(agent.knowledge_base_links),
+        "communication_style": json.dumps(agent.communication_style)
+    })
 
     print(f"Agent {agent.name} added successfully!")
 
 # Function to retrieve an agent from the database by ID 
 @with_db_connection
 def get_agent(conn, agent_id):
-    cursor = conn.cursor()
-
-    cursor.execute('SELECT * FROM agents WHERE agent_id = ?', (agent_id,))
-    row = cursor.fetchone()
+    row = conn.execute(text('SELECT * FROM agents WHERE agent_id = :agent_id'), {"agent_id": agent_id}).fetchone()
 
     if row:
         agent = Agent(
@@ -151,25 +129,23 @@ def get_agent(conn, agent_id):
 # Improved Function to list all agents with better filters 
 @with_db_connection
 def list_agents(conn, filters=None):
-    cursor = conn.cursor()
-
     query = 'SELECT * FROM agents'
+    params = {}
     if filters:
         conditions = []
         if "skills" in filters:
-            skill = filters["skills"]
-            conditions.append(f"background_info LIKE '%{skill}%'")
+            conditions.append("background_info LIKE :skill")
+            params["skill"] = f"%{filters['skills']}%"
         if "mbti" in filters:
-            mbti = filters["mbti"]
-            conditions.append(f"personality_traits LIKE '%{mbti}%'")
+            conditions.append("personality_traits LIKE :mbti")
+            params["mbti"] = f"%{filters['mbti']}%"
         if "mood" in filters:
-            mood = filters["mood"]
-            conditions.append(f"personality_traits LIKE '%{mood}%'")
+            conditions.append("personality_traits LIKE :mood")
+            params["mood"] = f"%{filters['mood']}%"
         if conditions:
             query += " WHERE " + " AND ".join(conditions)
 
-    cursor.execute(query)
-    rows = cursor.fetchall()
+    rows = conn.execute(text(query), params).fetchall()
 
     agents = []
     for row in rows:
@@ -187,28 +163,26 @@ def list_agents(conn, filters=None):
 # Function to update an existing agent's data
 @with_db_connection
 def update_agent(conn, agent_id, agent_data):
-    cursor = conn.cursor()
-
     if not get_agent(agent_id):
         print(f"No agent found with ID {agent_id}!")
         return False
 
-    cursor.execute('''
+    conn.execute(text('''
         UPDATE agents SET
-            name = ?,
-            background_info = ?,
-            personality_traits = ?,
-            knowledge_base_links = ?,
-            communication_style = ?
-        WHERE agent_id = ?
-    ''', (
-        agent_data["name"],
-        json.dumps(agent_data["background_info"]),
-        json.dumps(agent_data["personality_traits"]),
-        json.dumps(agent_data["knowledge_base_links"]),
-        json.dumps(agent_data["communication_style"]),
-        agent_id
-    ))
+            name = :name,
+            background_info = :background_info,
+            personality_traits = :personality_traits,
+            knowledge_base_links = :knowledge_base_links,
+            communication_style = :communication_style
+        WHERE agent_id = :agent_id
+    '''), {
+        "name": agent_data["name"],
+        "background_info": json.dumps(agent_data["background_info"]),
+        "personality_traits": json.dumps(agent_data["personality_traits"]),
+        "knowledge_base_links": json.dumps(agent_data["knowledge_base_links"]),
+        "communication_style": json.dumps(agent_data["communication_style"]),
+        "agent_id": agent_id
+    })
 
     print(f"Agent {agent_id} updated successfully!")
     return True
@@ -220,17 +194,14 @@ def delete_agent(conn, agent_id):
         print(f"No agent found with ID {agent_id}!")
         return False
 
-    cursor = conn.cursor()
-    cursor.execute('DELETE FROM agents WHERE agent_id = ?', (agent_id,))
+    conn.execute(text('DELETE FROM agents WHERE agent_id = :agent_id'), {"agent_id": agent_id})
     print(f"Agent {agent_id} deleted successfully!")
     return True
 
 # Improved Function to get a random set of agents with diversity
 @with_db_connection
 def get_random_agents(conn, num_agents, diversity_parameters=None):
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM agents')
-    rows = cursor.fetchall()
+    rows = conn.execute(text('SELECT * FROM agents')).fetchall()
 
     agents = [Agent(
         row[0],  # agent_id
@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+会议分析归档
+把已结束（end_conference 写入了 end_time）的会议导出为按月份和会议类型分区的 Parquet 列式文件，
+分析报表只读取归档文件，不再逐行扫描线上的 conversations 库
+
+归档目录结构（Hive 分区，pandas.read_parquet 读取目录时自动还原 month / conference_type 列）:
+    {ANALYTICS_DIR}/conferences/month=2025-03/conference_type=战略讨论/{会议ID}.parquet
+    {ANALYTICS_DIR}/speeches/...     每条发言一行：代理、发言长度、所用提供商和模型
+    {ANALYTICS_DIR}/llm_calls/...    每次 LLM 调用一行：提供商、模型、耗时、token 用量、结束原因、是否超出字数上限
+
+示例:
+    python analytics_archive.py archive            # 归档所有尚未归档的已结束会议
+    python analytics_archive.py report --month 2025-03
+"""
+
+import os
+import json
+import argparse
+import importlib
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from storage import CONFERENCES, CONVERSATIONS, connect
+
+ANALYTICS_DIR = os.getenv("ANALYTICS_DIR", "analytics")
+
+# 不属于专家代理的发言者，统计发言量时排除
+NON_AGENT_IDS = ("系统", "用户")
+
+def check_parquet_engine():
+    """Parquet 读写需要 pyarrow，未安装时抛出带安装提示的异常"""
+    try:
+        # 使用条件导入，因为可能没有安装 pyarrow 库
+        importlib.import_module("pyarrow")
+    except (ImportError, ModuleNotFoundError):
+        raise RuntimeError("分析归档需要 pyarrow 库，请运行 pip install pyarrow（见 requirements.txt）")
+
+def partition_dir(dataset, month, conference_type):
+    """分区目录；分区值中的路径分隔符替换为下划线"""
+    conference_type = (conference_type or "未分类").replace("/", "_").replace(os.sep, "_")
+    return os.path.join(ANALYTICS_DIR, dataset, f"month={month}", f"conference_type={conference_type}")
+
+def archived_conference_ids():
+    """已归档的会议ID（以 conferences 数据集中的文件为准，该文件在每个会议归档的最后写入）"""
+    root = os.path.join(ANALYTICS_DIR, "conferences")
+    archived = set()
+    for current_dir, _, files in os.walk(root):
+        archived.update(os.path.splitext(name)[0] for name in files if name.endswith(".parquet"))
+    return archived
+
+def read_ended_conferences():
+    """读取所有已结束会议的表头字段"""
+    with connect(CONFERENCES) as conn:
+        return pd.read_sql(
+            text("SELECT conference_id, title, conference_type, start_time, end_time, agenda, participant_agent_ids "
+                 "FROM conferences WHERE end_time IS NOT NULL AND end_time != ''"),
+            conn
+        )
+
+def build_frames(conference, agent_names):
+    """为单个会议构建 conferences / speeches / llm_calls 三个数据帧"""
+    params = {"conference_id": conference["conference_id"]}
+    with connect(CONVERSATIONS) as conn:
+        speeches = pd.read_sql(
+            text("SELECT id, phase_id, agent_id, speech, timestamp FROM conversations "
+                 "WHERE conference_id = :conference_id ORDER BY phase_id, id"),
+            conn, params=params
+        )
+        calls = pd.read_sql(
+            text("SELECT id, phase_id, agent_id, provider, model, latency_ms, prompt_tokens, completion_tokens, "
+                 "success, finish_reason, overshoot, created_at FROM llm_calls "
+                 "WHERE conference_id = :conference_id ORDER BY id"),
+            conn, params=params
+        )
+
+    calls["created_at"] = pd.to_datetime(calls["created_at"], errors="coerce")
+    calls["success"] = calls["success"].astype(bool)
+    calls.insert(0, "conference_id", conference["conference_id"])
+
+    # 每个代理在本次会议中最常用的提供商和模型
+    agent_models = (
+        calls.dropna(subset=["agent_id"])
+        .groupby(["agent_id", "provider", "model"]).size().rename("count").reset_index()
+        .sort_values("count", ascending=False)
+        .drop_duplicates("agent_id")
+        .drop(columns="count")
+    )
+
+    speeches["speech_length"] = speeches["speech"].fillna("").str.len()
+    speeches["timestamp"] = pd.to_datetime(speeches["timestamp"], errors="coerce")
+    speeches["agent_name"] = speeches["agent_id"].map(agent_names).fillna(speeches["agent_id"])
+    speeches = speeches.drop(columns="speech").merge(agent_models, on="agent_id", how="left")
+    speeches.insert(0, "conference_id", conference["conference_id"])
+
+    start_time = pd.to_datetime(conference["start_time"], errors="coerce")
+    end_time = pd.to_datetime(conference["end_time"], errors="coerce")
+    summary = pd.DataFrame([{
+        "conference_id": conference["conference_id"],
+        "title": conference["title"],
+        "start_time": start_time,
+        "end_time": end_time,
+        "duration_minutes": (end_time - start_time).total_seconds() / 60 if pd.notna(start_time) and pd.notna(end_time) else np.nan,
+        "phase_count": len(json.loads(conference["agenda"] or "[]")),
+        "participant_count": len(json.loads(conference["participant_agent_ids"] or "[]")),
+        "speech_count": len(speeches),
+        "total_speech_length": int(speeches["speech_length"].sum()),
+        "llm_calls": len(calls),
+        "total_tokens": int(calls[["prompt_tokens", "completion_tokens"]].sum().sum()),
+    }])
+    return {"conferences": summary, "speeches": speeches, "llm_calls": calls}
+
+def archive_conference(conference, agent_names=None):
+    """归档单个已结束会议（read_ended_conferences 返回的一行），返回写入的发言条数"""
+    check_parquet_engine()
+    if agent_names is None:
+        agent_names = load_agent_names()
+
+    month = str(conference["start_time"] or conference["end_time"])[:7] or "unknown"
+    frames = build_frames(conference, agent_names)
+    # conferences 最后写入，作为该会议归档完成的标记
+    for dataset in ("speeches", "llm_calls", "conferences"):
+        directory = partition_dir(dataset, month, conference["conference_type"])
+        os.makedirs(directory, exist_ok=True)
+        frames[dataset].to_parquet(os.path.join(directory, f"{conference['conference_id']}.parquet"), index=False)
+    return len(frames["speeches"])
+
+def archive_conference_by_id(conference_id):
+    """按会议ID归档（会议未结束时跳过），供结束会议后自动归档使用"""
+    conferences = read_ended_conferences()
+    matched = conferences[conferences["conference_id"] == conference_id]
+    if matched.empty:
+        return 0
+    return archive_conference(matched.iloc[0])
+
+def load_agent_names():
+    from agent_db import list_agents
+    return {agent.agent_id: agent.name for agent in list_agents()}
+
+def archive_ended_conferences(limit=None):
+    """归档所有尚未归档的已结束会议，返回归档的会议数"""
+    check_parquet_engine()
+    conferences = read_ended_conferences()
+    pending = conferences[~conferences["conference_id"].isin(archived_conference_ids())]
+    if limit:
+        pending = pending.head(limit)
+
+    agent_names = load_agent_names()
+    for _, conference in pending.iterrows():
+        try:
+            count = archive_conference(conference, agent_names)
+            print(f"已归档会议 {conference['conference_id']}（{conference['title']}），发言 {count} 条")
+        except Exception as e:
+            print(f"归档会议 {conference['conference_id']} 时出错: {str(e)}")
+    return len(pending)
+
+# 报表
+
+def load_dataset(dataset, months=None, conference_types=None):
+    """读取归档数据集，可按月份（YYYY-MM）和会议类型过滤分区，没有归档时返回空数据帧"""
+    check_parquet_engine()
+    root = os.path.join(ANALYTICS_DIR, dataset)
+    if not os.path.isdir(root) or not archived_conference_ids():
+        return pd.DataFrame()
+
+    filters = []
+    if months:
+        filters.append(("month", "in", list(months)))
+    if conference_types:
+        filters.append(("conference_type", "in", list(conference_types)))
+    frame = pd.read_parquet(root, filters=filters or None)
+    for column in ("month", "conference_type"):
+        if column in frame:
+            frame[column] = frame[column].astype(str)
+    return frame
+
+def agent_verbosity(speeches):
+    """各代理的发言次数和发言长度统计，按平均长度倒序"""
+    if speeches.empty:
+        return pd.DataFrame()
+    speeches = speeches[~speeches["agent_id"].isin(NON_AGENT_IDS)]
+    return (
+        speeches.groupby("agent_id")
+        .agg(
+            agent_name=("agent_name", "last"),
+            speeches=("speech_length", "size"),
+            conferences=("conference_id", "nunique"),
+            mean_length=("speech_length", "mean"),
+            median_length=("speech_length", "median"),
+            p90_length=("speech_length", lambda lengths: lengths.quantile(0.9)),
+            total_length=("speech_length", "sum"),
+        )
+        .sort_values("mean_length", ascending=False)
+    )
+
+def provider_latency(calls):
+    """各提供商/模型的调用次数、成功率、延迟分位数（仅统计成功调用）、平均 token 用量和超出字数上限的比例"""
+    if calls.empty:
+        return pd.DataFrame()
+    keys = ["provider", "model"]
+    if "overshoot" not in calls.columns:
+        # 升级前归档的数据没有超长标记
+        calls = calls.assign(overshoot=np.nan)
+    grouped = calls.groupby(keys)
+    result = grouped.agg(
+        calls=("latency_ms", "size"),
+        success_rate=("success", "mean"),
+        mean_prompt_tokens=("prompt_tokens", "mean"),
+        mean_completion_tokens=("completion_tokens", "mean"),
+        overshoot_rate=("overshoot", "mean"),
+    )
+    latency = (
+        calls[calls["success"]].groupby(keys)["latency_ms"]
+        .quantile([0.5, 0.9, 0.99]).unstack()
+        .rename(columns={0.5: "p50_ms", 0.9: "p90_ms", 0.99: "p99_ms"})
+    )
+    return result.join(latency).sort_values("calls", ascending=False)
+
+def conference_durations(conferences):
+    """按会议类型统计会议时长（分钟）和发言量"""
+    if conferences.empty:
+        return pd.DataFrame()
+    return (
+        conferences.groupby("conference_type")
+        .agg(
+            conferences=("conference_id", "size"),
+            mean_minutes=("duration_minutes", "mean"),
+            median_minutes=("duration_minutes", "median"),
+            max_minutes=("duration_minutes", "max"),
+            mean_speeches=("speech_count", "mean"),
+            total_tokens=("total_tokens", "sum"),
+        )
+        .sort_values("conferences", ascending=False)
+    )
+
+def print_report(months=None, conference_types=None):
+    """打印全部报表"""
+    reports = [
+        ("代理发言量", agent_verbosity, "speeches"),
+        ("提供商延迟", provider_latency, "llm_calls"),
+        ("会议时长", conference_durations, "conferences"),
+    ]
+    with pd.option_context("display.width", 200, "display.max_columns", None, "display.float_format", "{:.1f}".format):
+        for title, report, dataset in reports:
+            result = report(load_dataset(dataset, months, conference_types))
+            print(f"\n== {title} ==")
+            print(result.to_string() if not result.empty else "没有数据")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="RoundTable会议分析归档")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    archive_parser = subparsers.add_parser("archive", help="归档尚未归档的已结束会议")
+    archive_parser.add_argument("--limit", type=int, help="本次最多归档的会议数")
+
+    report_parser = subparsers.add_parser("report", help="基于归档数据输出统计报表")
+    report_parser.add_argument("--month", action="append", help="只统计指定月份（YYYY-MM），可重复")
+    report_parser.add_argument("--type", action="append", dest="conference_type", help="只统计指定会议类型，可重复")
+
+    args = parser.parse_args()
+    if args.command == "archive":
+        count = archive_ended_conferences(args.limit)
+        print(f"本次归档 {count} 个会议，归档目录: {ANALYTICS_DIR}")
+    else:
+        print_report(args.month, args.conference_type)
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,8 @@
 from fastapi import FastAPI, Request, Form, File, UploadFile, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, JSONResponse, RedirectResponse, StreamingResponse
 
-import sqlite3
 import json
 import logging
 from round_table import start_phase_discussion, user_intervene, get_agent_name_by_id
@@ -18,13 +17,30 @@ import asyncio
 import concurrent.futures
 from typing import List, Dict, Any
 from starlette.websockets import WebSocketState
+import signal
 import threading
+import time
 from version import get_version, get_version_info
-from db_migrations import run_migrations
+from db_migrations import run_migrations, sync_indexes
+from storage import (
+    CONVERSATIONS, CONFERENCES, HISTORY_DIR, conversations_table, conferences_table,
+    conference_events_table, discussion_checkpoints_table, rolling_summaries_table, connect, ensure_tables, get_storage_backend
+)
+import async_db
+from llm_usage import ensure_llm_calls_table
+from broadcast import BroadcastBackplaneFactory
+from history_index import (
+    init_history_index, sync_history_index, remove_history_index, compress_ended_histories
+)
+from ws_codec import FrameCodec, FrameCodecFactory
+from transcript_search import init_search_index, search_conversations
+from discussion_checkpoint import begin_drain, active_discussions, is_draining, list_interrupted_discussions, release_checkpoint
+from event_log import DIALOGUE_EVENT_TYPES, add_listener as add_event_listener, backfill_events
+from transcript_export import TranscriptExporterFactory, stream_archive
+from retention import RETENTION_INTERVAL_HOURS, prepare_auto_vacuum, purge_conference_data, run_retention
 import os
 import random
 import uuid
-import shutil
 
 # 初始化日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -67,59 +83,392 @@ def generate_agenda(topic):
     ]
     return agenda
 
+# 单个WebSocket客户端：独立的有界发送队列和写协程
+# 慢客户端只会堆积自己的队列，不会拖慢同一会议的其他观众
+# 队列中保存的是已按客户端编码（json / orjson / msgpack）编码好的帧
+class ClientConnection:
+    def __init__(self, websocket: WebSocket, conference_id: str, queue_size: int, codec: FrameCodec = None):
+        self.websocket = websocket
+        self.conference_id = conference_id
+        self.codec = codec or FrameCodecFactory.get_codec()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer_task = None
+        self.connected_at = time.time()
+        self.sent_count = 0
+        self.bytes_sent = 0
+        self.overflow_count = 0
+        self.last_lag = 0.0  # 最近一条消息从入队到发出的延迟（秒）
+        self.max_lag = 0.0
+        self.acked_id = None  # 客户端确认已收到的最新对话记录ID
+        self.action_task = None  # 正在执行的用户操作（continue / question）
+
+    def start(self, on_error):
+        self.writer_task = asyncio.create_task(self._writer(on_error))
+
+    def enqueue(self, message: Any, encoded=None) -> bool:
+        """非阻塞入队，队列已满时返回False；encoded 为广播时预先编码好的帧"""
+        data = encoded if encoded is not None else self.codec.encode(message)
+        try:
+            self.queue.put_nowait((time.monotonic(), data))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def put(self, message: Dict[str, Any]):
+        """阻塞入队，用于只发给当前客户端的消息（如历史回放）"""
+        await self.queue.put((time.monotonic(), self.codec.encode(message)))
+
+    def reset_queue(self):
+        """丢弃所有未发送的消息"""
+        while not self.queue.empty():
+            self.queue.get_nowait()
+
+    async def _writer(self, on_error):
+        try:
+            while True:
+                enqueued_at, data = await self.queue.get()
+                if self.websocket.client_state != WebSocketState.CONNECTED:
+                    break
+                await self.codec.send(self.websocket, data)
+                self.sent_count += 1
+                # 文本帧按 UTF-8 编码后的字节数统计（中文每字 3 字节）
+                self.bytes_sent += len(data.encode("utf-8")) if isinstance(data, str) else len(data)
+                self.last_lag = time.monotonic() - enqueued_at
+                self.max_lag = max(self.max_lag, self.last_lag)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            pass
+        on_error(self)
+
+    def stop(self):
+        if self.writer_task and not self.writer_task.done():
+            self.writer_task.cancel()
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "client": f"{self.websocket.client.host}:{self.websocket.client.port}" if self.websocket.client else None,
+            "connected_seconds": round(time.time() - self.connected_at, 1),
+            "queue_size": self.queue.qsize(),
+            "encoding": self.codec.name,
+            "sent": self.sent_count,
+            "bytes_sent": self.bytes_sent,
+            "overflows": self.overflow_count,
+            "last_lag_ms": round(self.last_lag * 1000, 1),
+            "max_lag_ms": round(self.max_lag * 1000, 1),
+            "acked_id": self.acked_id
+        }
+
 # 管理WebSocket连接
+# 消息先发布到广播后端，再由每个进程投递给自己持有的连接，支持多 worker 部署
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {}
+    def __init__(self, backplane=None):
+        self.active_connections: Dict[str, Dict[WebSocket, ClientConnection]] = {}
+        self.backplane = backplane or BroadcastBackplaneFactory.get_backplane()
+        # 每个连接的发送队列长度，以及队列溢出时的处理方式：
+        # resync 清空队列并通知客户端重新加载，disconnect 直接断开慢客户端
+        self.queue_size = int(os.getenv("WS_SEND_QUEUE_SIZE", "100"))
+        self.overflow_policy = os.getenv("WS_OVERFLOW_POLICY", "resync")
+        self.evicted_count = 0
+        self.resync_count = 0
+        # 合并窗口（毫秒）：窗口内到达同一会议的多条消息合并为一个数组帧发送，0 表示不合并
+        self.coalesce_window = float(os.getenv("WS_COALESCE_WINDOW_MS", "20")) / 1000
+        self.coalesce_max = int(os.getenv("WS_COALESCE_MAX_MESSAGES", "50"))
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._flush_tasks: Dict[str, asyncio.Task] = {}
+        self.messages_in = 0
+        self.frames_out = 0
+        # 只读观众的 SSE 订阅队列（每条消息单独作为一个事件发送，便于用记录ID续传）
+        self.event_subscribers: Dict[str, set] = {}
+        self.sse_dropped_count = 0
+
+    async def start(self):
+        await self.backplane.start(self.deliver_local)
+        logger.info(f"WebSocket广播后端: {self.backplane.name}")
 
-    async def connect(self, websocket: WebSocket, conference_id: str):
+    async def stop(self):
+        await self.backplane.stop()
+        # 发出尚在合并窗口中的消息
+        for task in list(self._flush_tasks.values()):
+            task.cancel()
+        for conference_id in list(self._pending):
+            await self._flush(conference_id)
+
+    async def close_for_restart(self, client: ClientConnection, retry_after_ms: int):
+        """发送重连提示并以 1012（服务重启）关闭连接，客户端按提示的延迟后带 since_id 重连"""
+        client.enqueue({"type": "reconnect", "retry_after_ms": retry_after_ms})
+        # 等待发送队列清空（最多1秒），提示和尚未发出的发言不会随连接关闭丢失
+        deadline = time.monotonic() + 1
+        while not client.queue.empty() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self.disconnect(client.websocket, client.conference_id)
+        try:
+            await client.websocket.close(code=1012, reason="服务重启")
+        except Exception:
+            pass
+
+    async def drain(self, retry_after_ms: int):
+        """服务关闭前通知所有观众稍后重连：WebSocket 发送提示后关闭，SSE 事件流发送重连间隔后结束"""
+        # 先发出尚在合并窗口中的消息
+        for task in list(self._flush_tasks.values()):
+            task.cancel()
+        self._flush_tasks.clear()
+        for conference_id in list(self._pending):
+            await self._flush(conference_id)
+
+        for conference_id, queues in list(self.event_subscribers.items()):
+            for queue in list(queues):
+                self.unsubscribe_events(conference_id, queue)
+                try:
+                    queue.put_nowait({"type": "reconnect", "retry_after_ms": retry_after_ms})
+                except asyncio.QueueFull:
+                    while not queue.empty():
+                        queue.get_nowait()
+                    queue.put_nowait(None)
+
+        clients = [client for connections in self.active_connections.values() for client in connections.values()]
+        await asyncio.gather(*(self.close_for_restart(client, retry_after_ms) for client in clients))
+        return len(clients)
+
+    async def connect(self, websocket: WebSocket, conference_id: str) -> ClientConnection:
         await websocket.accept()
-        if conference_id not in self.active_connections:
-            self.active_connections[conference_id] = []
-        self.active_connections[conference_id].append(websocket)
+        codec = FrameCodecFactory.get_codec(websocket.query_params.get("encoding"))
+        client = ClientConnection(websocket, conference_id, self.queue_size, codec)
+        client.start(lambda c: self.disconnect(c.websocket, c.conference_id))
+        self.active_connections.setdefault(conference_id, {})[websocket] = client
+        return client
 
     def disconnect(self, websocket: WebSocket, conference_id: str):
         if conference_id in self.active_connections:
-            if websocket in self.active_connections[conference_id]:
-                self.active_connections[conference_id].remove(websocket)
+            client = self.active_connections[conference_id].pop(websocket, None)
+            if client:
+                client.stop()
             if not self.active_connections[conference_id]:
                 del self.active_connections[conference_id]
 
     async def send_dialogue(self, message: Dict[str, Any], conference_id: str):
-        if conference_id in self.active_connections:
-            dead_connections = []
-            for connection in self.active_connections[conference_id]:
-                try:
-                    if connection.client_state == WebSocketState.CONNECTED:
-                        await connection.send_json(message)
-                except Exception:
-                    dead_connections.append(connection)
-            
-            # 清理断开的连接
-            for dead in dead_connections:
-                self.disconnect(dead, conference_id)
+        """通过广播后端发布消息，所有进程（包括本进程）都会收到"""
+        await self.backplane.publish(message, conference_id)
+
+    def subscribe_events(self, conference_id: str) -> asyncio.Queue:
+        """为SSE观众注册一个消息队列"""
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self.event_subscribers.setdefault(conference_id, set()).add(queue)
+        return queue
+
+    def unsubscribe_events(self, conference_id: str, queue: asyncio.Queue):
+        subscribers = self.event_subscribers.get(conference_id)
+        if subscribers is not None:
+            subscribers.discard(queue)
+            if not subscribers:
+                del self.event_subscribers[conference_id]
+
+    def _deliver_events(self, message: Dict[str, Any], conference_id: str):
+        """把消息放入SSE观众的队列；队列已满时放入结束标记，观众重连后用 Last-Event-ID 补齐"""
+        for queue in list(self.event_subscribers.get(conference_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                self.sse_dropped_count += 1
+                self.unsubscribe_events(conference_id, queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    async def deliver_local(self, message: Dict[str, Any], conference_id: str):
+        """收集广播消息，合并窗口结束后统一放入本进程中该会议每个连接的发送队列"""
+        self._deliver_events(message, conference_id)
+        if conference_id not in self.active_connections:
+            return
+        self.messages_in += 1
+        pending = self._pending.setdefault(conference_id, [])
+        pending.append(message)
+        if self.coalesce_window <= 0 or len(pending) >= self.coalesce_max:
+            task = self._flush_tasks.pop(conference_id, None)
+            if task:
+                task.cancel()
+            await self._flush(conference_id)
+        elif conference_id not in self._flush_tasks:
+            self._flush_tasks[conference_id] = asyncio.create_task(self._flush_later(conference_id))
+
+    async def _flush_later(self, conference_id: str):
+        await asyncio.sleep(self.coalesce_window)
+        self._flush_tasks.pop(conference_id, None)
+        await self._flush(conference_id)
+
+    async def _flush(self, conference_id: str):
+        """把待发消息编成一帧（多条时为数组帧），每种编码只编码一次后分发给所有连接"""
+        pending = self._pending.pop(conference_id, None)
+        if not pending:
+            return
+        frame = pending[0] if len(pending) == 1 else pending
+        encoded = {}
+        for client in list(self.active_connections.get(conference_id, {}).values()):
+            codec_name = client.codec.name
+            if codec_name not in encoded:
+                encoded[codec_name] = client.codec.encode(frame)
+            self.frames_out += 1
+            if not client.enqueue(frame, encoded[codec_name]):
+                await self._handle_overflow(client)
+
+    async def _handle_overflow(self, client: ClientConnection):
+        """处理发送队列溢出的慢客户端"""
+        client.overflow_count += 1
+        if self.overflow_policy == "disconnect":
+            self.evicted_count += 1
+            logger.warning(f"WebSocket客户端发送队列已满，断开连接 (会议 {client.conference_id})")
+            self.disconnect(client.websocket, client.conference_id)
+            try:
+                await client.websocket.close(code=1013, reason="客户端接收过慢")
+            except Exception:
+                pass
+        else:
+            # 丢弃积压的消息，只发送一条重新同步通知
+            self.resync_count += 1
+            logger.warning(f"WebSocket客户端发送队列已满，要求重新同步 (会议 {client.conference_id})")
+            client.reset_queue()
+            client.enqueue({"type": "resync"})
+
+    def metrics(self) -> Dict[str, Any]:
+        """每个连接的队列长度和发送延迟"""
+        return {
+            "backplane": self.backplane.name,
+            "queue_size_limit": self.queue_size,
+            "overflow_policy": self.overflow_policy,
+            "evicted": self.evicted_count,
+            "resyncs": self.resync_count,
+            "coalesce_window_ms": self.coalesce_window * 1000,
+            "messages_in": self.messages_in,
+            "frames_out": self.frames_out,
+            "sse_viewers": {conference_id: len(queues) for conference_id, queues in self.event_subscribers.items()},
+            "sse_dropped": self.sse_dropped_count,
+            "conferences": {
+                conference_id: [client.metrics() for client in clients.values()]
+                for conference_id, clients in self.active_connections.items()
+            }
+        }
 
 manager = ConnectionManager()
 
-# 设置对话流监听器
-dialogue_listeners = {}
+# 连接或打开会议页面时回放的最近发言条数，更早的发言按需懒加载
+REPLAY_WINDOW = int(os.getenv("WS_REPLAY_WINDOW", "50"))
+
+async def build_dialogue_entries(rows):
+    """把 (id, agent_id, speech, timestamp) 记录转换为前端使用的对话条目，代理名称取自缓存"""
+    names = await async_db.get_agent_names()
+    return [
+        {
+            "id": row[0],
+            "agent_id": row[1],
+            "agent_name": names.get(row[1], row[1]),
+            "speech": row[2],
+            "timestamp": row[3]
+        } for row in rows
+    ]
+
+def parse_cursor(value):
+    """解析客户端传来的ID游标，无效时返回None"""
+    try:
+        return int(value) if value not in (None, "") else None
+    except (TypeError, ValueError):
+        return None
 
 # 初始化对话历史数据库
 def init_conversation_db():
-    conn = sqlite3.connect('conversations.db')
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS conversations (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            conference_id TEXT,
-            phase_id INTEGER,
-            agent_id TEXT,
-            speech TEXT,
-            timestamp TEXT
+    with connect(CONVERSATIONS) as conn:
+        ensure_tables(
+            conn, conversations_table, conference_events_table, discussion_checkpoints_table, rolling_summaries_table
         )
-    ''')
-    conn.commit()
-    conn.close()
+        ensure_llm_calls_table(conn)
+
+# 定时执行数据保留策略（清理过期会议、增量 VACUUM）并压缩已结束会议的对话历史文件
+retention_task = None
+
+async def run_retention_periodically(interval_seconds):
+    # 启动一分钟后执行第一轮，避免与启动时的索引同步争用数据库
+    await asyncio.sleep(min(60, interval_seconds))
+    while True:
+        try:
+            await asyncio.to_thread(run_retention)
+        except Exception as e:
+            logger.warning(f"执行数据保留策略时出错: {str(e)}")
+        try:
+            await asyncio.to_thread(compress_ended_histories)
+        except Exception as e:
+            logger.warning(f"压缩对话历史文件时出错: {str(e)}")
+        await asyncio.sleep(interval_seconds)
+
+async def resume_interrupted_discussions():
+    """从检查点继续上次进程退出时中断的讨论（已结束的会议跳过）"""
+    try:
+        interrupted = await asyncio.to_thread(list_interrupted_discussions)
+    except Exception as e:
+        logger.warning(f"读取讨论检查点时出错: {str(e)}")
+        return
+    for conference_id, phase_id in interrupted:
+        if is_draining():
+            return
+        conference = await async_db.get_conference(conference_id)
+        if not conference or conference.end_time:
+            continue
+        logger.info(f"恢复会议 {conference_id} 阶段 {phase_id} 的讨论")
+        result = await run_with_timeout(start_phase_discussion, conference_id, phase_id)
+        if not result["success"]:
+            logger.warning(f"恢复会议 {conference_id} 的讨论失败: {result.get('error', '未知错误')}")
+
+# 关闭时的排空：最多等待 DRAIN_TIMEOUT 秒让进行中的发言完成，观众按 WS_RECONNECT_DELAY_MS 的提示重连
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
+WS_RECONNECT_DELAY_MS = int(os.getenv("WS_RECONNECT_DELAY_MS", "3000"))
+
+drain_task = None
+
+async def drain_app():
+    """
+    排空本进程：不再启动新的讨论，等待进行中的讨论完成当前发言（之后在发言之间停止）和提问完成，
+    超时仍未结束的讨论保留最后完成发言的检查点；然后释放检查点、通知观众重连
+    """
+    global drain_task
+    if drain_task is None:
+        drain_task = asyncio.ensure_future(_drain())
+    await asyncio.shield(drain_task)
+
+async def _drain():
+    started = time.monotonic()
+    begin_drain()
+    logger.info(f"开始排空：进行中的讨论 {len(active_discussions())} 个，调用 {len(inflight_calls)} 个")
+
+    pending = list(inflight_calls)
+    if pending:
+        _, not_done = await asyncio.to_thread(concurrent.futures.wait, pending, timeout=DRAIN_TIMEOUT)
+        if not_done:
+            logger.warning(f"排空超时，{len(not_done)} 个调用仍在进行，讨论将从最后完成的发言继续")
+
+    # 超时未停止的讨论同样释放写入者，重启后的进程可立即接管
+    released = await asyncio.to_thread(release_checkpoint)
+    clients = await manager.drain(WS_RECONNECT_DELAY_MS)
+    logger.info(f"排空完成，耗时 {time.monotonic() - started:.1f}秒：释放检查点 {released} 个，通知重连 {clients} 个连接")
+
+async def drain_and_exit():
+    """收到 SIGTERM 时先排空再退出：重复收到时不再等待"""
+    if drain_task is None:
+        try:
+            await drain_app()
+        except Exception as e:
+            logger.warning(f"排空时出错: {str(e)}")
+    # 交给 uvicorn 的 SIGINT 处理函数完成正常关闭（停止接收连接、执行 shutdown 事件）
+    os.kill(os.getpid(), signal.SIGINT)
+
+def install_drain_signal_handler(loop):
+    """
+    接管 SIGTERM（docker stop、restart.py）。uvicorn 收到信号后会立即断开全部 WebSocket，
+    因此在交给 uvicorn 之前先排空；只能在主线程的事件循环中注册，否则保持默认处理
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return
+    try:
+        loop.add_signal_handler(signal.SIGTERM, lambda: asyncio.ensure_future(drain_and_exit()))
+    except (NotImplementedError, RuntimeError, ValueError):
+        pass
 
 def create_app():
     app = FastAPI(title="RoundTable对话系统", version=get_version())
@@ -131,22 +480,55 @@ def create_app():
         print(f"正在启动 {VERSION_INFO['name']} v{VERSION_INFO['version']} (构建 {VERSION_INFO['build']})")
         
         # 确保对话历史目录存在
-        history_dir = "dialogue_histories"
+        history_dir = HISTORY_DIR
         if not os.path.exists(history_dir):
             os.makedirs(history_dir)
             print(f"创建对话历史目录: {history_dir}")
         
-        print("正在运行数据库迁移...")
-        run_migrations()
+        # 先按 storage 模块的表结构建表，迁移脚本中的建表语句随后成为空操作
         print("正在初始化数据库...")
+        # 新建的 SQLite 库需要在建表之前启用增量 VACUUM
+        prepare_auto_vacuum()
         init_conversation_db()
         init_conference_db()
         init_agent_db()
+        print("正在运行数据库迁移...")
+        run_migrations()
+        sync_indexes()
+        sync_indexes(CONFERENCES, tables=(conferences_table,))
+        init_search_index()
+        await asyncio.to_thread(backfill_events)
+        init_history_index()
+        await asyncio.to_thread(sync_history_index)
         print("数据库初始化完成")
         
         # 设置版本信息
         global APP_VERSION
         APP_VERSION = os.getenv("APP_VERSION", "1.0.0")
+        
+        # 启动WebSocket广播后端
+        await manager.start()
+        register_event_broadcaster(asyncio.get_running_loop())
+
+        # 在后台恢复上次进程退出时中断的讨论
+        asyncio.create_task(resume_interrupted_discussions())
+        install_drain_signal_handler(asyncio.get_running_loop())
+
+        # 启动定时数据保留任务
+        global retention_task
+        if RETENTION_INTERVAL_HOURS > 0:
+            retention_task = asyncio.create_task(run_retention_periodically(RETENTION_INTERVAL_HOURS * 3600))
+    
+    # 释放数据库连接池
+    @app.on_event("shutdown")
+    async def shutdown_db_client():
+        # 未经 SIGTERM 排空（如 Ctrl+C）时在此排空
+        await drain_app()
+        if retention_task:
+            retention_task.cancel()
+        await manager.stop()
+        await get_storage_backend().dispose_async()
+        get_storage_backend().dispose()
     
     return app
 
@@ -164,92 +546,39 @@ async def get_api_version():
 
 # 获取所有对话历史文件列表
 @app.get("/api/dialogue_histories")
-async def get_dialogue_histories():
-    # 首先检查旧位置的文件
-    old_files = []
-    if os.path.exists("."):
-        old_files = [f for f in os.listdir(".") if f.startswith("dialogue_history_") and f.endswith(".json")]
-    
-    # 确保新目录存在
-    histories_dir = "dialogue_histories"
-    if not os.path.exists(histories_dir):
-        os.makedirs(histories_dir)
-    
-    # 获取新目录中的文件
-    new_files = []
-    if os.path.exists(histories_dir):
-        new_files = [f for f in os.listdir(histories_dir) if f.startswith("dialogue_history_") and f.endswith(".json")]
-    
-    # 合并文件列表，并移动旧文件到新目录
-    files = []
-    for filename in old_files:
-        # 如果文件不在新目录中，移动它
-        if filename not in new_files:
-            try:
-                shutil.move(filename, os.path.join(histories_dir, filename))
-                files.append(filename)
-            except Exception as e:
-                print(f"移动文件 {filename} 时出错: {str(e)}")
-        else:
-            files.append(filename)
-    
-    # 添加新目录中的文件
-    for filename in new_files:
-        if filename not in files:
-            files.append(filename)
-    
-    histories = []
-    
-    for filename in files:
-        # 确定文件的完整路径
-        if os.path.exists(os.path.join(histories_dir, filename)):
-            file_path = os.path.join(histories_dir, filename)
-        else:
-            file_path = filename  # 以防文件仍然在旧位置
-        
-        if not os.path.exists(file_path):
-            continue  # 跳过不存在的文件
-            
-        file_stats = os.stat(file_path)
-        modified_time = datetime.fromtimestamp(file_stats.st_mtime).strftime("%Y-%m-%d %H:%M:%S")
-        
-        # 从文件名中提取会议ID和阶段ID
-        # 文件名格式: dialogue_history_[会议ID]_[阶段ID].json
-        parts = filename.replace("dialogue_history_", "").replace(".json", "").split("_")
-        if len(parts) >= 2:
-            conference_id = parts[0]
-            phase_id = parts[1]
-            
-            # 尝试获取会议标题和会议类型
-            conference_title = "未知会议"
-            conference_type = "未分类"
-            try:
-                conference = get_conference(conference_id)
-                if conference:
-                    conference_title = conference.title
-                    conference_type = getattr(conference, 'conference_type', '未分类')
-            except Exception as e:
-                print(f"获取会议 {conference_id} 时出错: {str(e)}")
-            
-            histories.append({
-                "filename": filename,
-                "conference_id": conference_id,
-                "phase_id": phase_id,
-                "size_kb": round(file_stats.st_size / 1024, 2),
-                "modified": modified_time,
-                "conference_title": conference_title,
-                "conference_type": conference_type
-            })
-    
-    # 按修改时间降序排序
-    histories.sort(key=lambda x: x["modified"], reverse=True)
-    
-    return histories
+async def get_dialogue_histories(conference_type: str = None, conference_id: str = None, q: str = None,
+                                 page: int = 1, page_size: int = 50):
+    """分页查询对话历史文件索引，可按会议类型、会议ID和关键字过滤"""
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 200)
+    rows, total = await async_db.list_dialogue_histories(
+        conference_type=conference_type, conference_id=conference_id, query=q,
+        limit=page_size, offset=(page - 1) * page_size
+    )
+    histories = [
+        {
+            "filename": row[0],
+            "conference_id": row[1],
+            "phase_id": row[2],
+            "size_kb": round(row[5] / 1024, 2),
+            "entry_count": row[6],
+            "modified": datetime.fromtimestamp(row[7]).strftime("%Y-%m-%d %H:%M:%S"),
+            "conference_title": row[3],
+            "conference_type": row[4]
+        } for row in rows
+    ]
+    return {
+        "items": histories,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "conference_types": await async_db.list_dialogue_history_types()
+    }
 
 # 删除对话历史文件
 @app.delete("/api/dialogue_histories/{filename}")
 async def delete_dialogue_history(filename: str):
-    histories_dir = "dialogue_histories"
+    histories_dir = HISTORY_DIR
     
     # 检查文件是否在新位置
     new_path = os.path.join(histories_dir, filename)
@@ -260,6 +589,7 @@ async def delete_dialogue_history(filename: str):
     if os.path.exists(new_path):
         try:
             os.remove(new_path)
+            await asyncio.to_thread(remove_history_index, filename)
             return {"message": f"文件 {filename} 已成功删除"}
         except Exception as e:
             return JSONResponse(
@@ -269,6 +599,7 @@ async def delete_dialogue_history(filename: str):
     elif os.path.exists(old_path):
         try:
             os.remove(old_path)
+            await asyncio.to_thread(remove_history_index, filename)
             return {"message": f"文件 {filename} 已成功删除"}
         except Exception as e:
             return JSONResponse(
@@ -276,55 +607,198 @@ async def delete_dialogue_history(filename: str):
                 content={"error": f"删除文件失败: {str(e)}"}
             )
     else:
+        # 清理指向已不存在文件的索引记录
+        await asyncio.to_thread(remove_history_index, filename)
         return JSONResponse(
             status_code=404,
             content={"error": f"文件 {filename} 不存在"}
         )
 
 # WebSocket路由
+# WebSocket上客户端可以发起的会议操作
+WS_ACTIONS = ("continue", "interrupt", "question")
+
+# 保存正在执行的操作任务的引用，避免任务被垃圾回收；连接断开后操作仍会执行完成
+client_action_tasks = set()
+
+async def run_client_action(client: ClientConnection, request: Dict[str, Any]):
+    """执行客户端通过WebSocket发起的操作，完成后在同一连接上返回结果帧"""
+    action = request.get("type")
+    status_code, payload = await handle_conference_action(
+        client.conference_id, action, request.get("agent_id"), request.get("question")
+    )
+    result = {"type": "result", "request_id": request.get("request_id"), "action": action, "status": status_code}
+    result.update(payload)
+    # 连接可能已经断开，结果不阻塞等待发送
+    client.enqueue(result)
+
+async def handle_client_message(client: ClientConnection, request: Dict[str, Any], current_phase):
+    """
+    处理客户端发来的类型化消息
+
+    - history: 懒加载 before_id 之前的发言
+    - ack: 客户端确认已收到的最新记录ID（兼作心跳）
+    - continue / interrupt / question: 会议操作，立即回复 ack，完成后回复 result
+    """
+    message_type = request.get("type")
+    request_id = request.get("request_id")
+
+    if message_type == "history":
+        if current_phase is None:
+            return
+        rows, has_more = await async_db.get_dialogue_window(
+            client.conference_id, current_phase,
+            before_id=parse_cursor(request.get("before_id")),
+            limit=min(parse_cursor(request.get("limit")) or REPLAY_WINDOW, REPLAY_WINDOW)
+        )
+        await client.put({
+            "type": "history",
+            "phase_id": current_phase,
+            "entries": await build_dialogue_entries(rows),
+            "has_more": has_more
+        })
+    elif message_type == "ack":
+        last_id = parse_cursor(request.get("last_id"))
+        if last_id is not None:
+            client.acked_id = max(client.acked_id or 0, last_id)
+    elif message_type in WS_ACTIONS:
+        # 中断用于停止正在执行的操作，不受限制；其余操作同一连接一次只执行一个
+        if message_type != "interrupt" and client.action_task and not client.action_task.done():
+            await client.put({"type": "error", "request_id": request_id, "message": "上一个操作仍在处理中，请稍候"})
+            return
+        await client.put({"type": "ack", "request_id": request_id, "action": message_type})
+        task = asyncio.create_task(run_client_action(client, request))
+        client_action_tasks.add(task)
+        task.add_done_callback(client_action_tasks.discard)
+        if message_type != "interrupt":
+            client.action_task = task
+    else:
+        await client.put({"type": "error", "request_id": request_id, "message": f"未知的消息类型: {message_type}"})
+
 @app.websocket("/ws/{conference_id}")
 async def websocket_endpoint(websocket: WebSocket, conference_id: str):
-    await manager.connect(websocket, conference_id)
+    client = await manager.connect(websocket, conference_id)
+    if is_draining():
+        # 服务正在关闭，提示客户端稍后连接到重启后的进程
+        await manager.close_for_restart(client, WS_RECONNECT_DELAY_MS)
+        return
     try:
-        # 发送当前对话历史
-        conn = sqlite3.connect('conversations.db')
-        cursor = conn.cursor()
-        conference = get_conference(conference_id)
+        # 以单个快照帧发送对话历史：带 since_id 重连时只补发缺失的发言，否则发送最近 REPLAY_WINDOW 条
+        conference = await async_db.get_conference(conference_id)
+        current_phase = conference.current_phase_index if conference else None
         if conference:
-            current_phase = conference.current_phase_index
-            cursor.execute('SELECT agent_id, speech, timestamp FROM conversations WHERE conference_id = ? AND phase_id = ? ORDER BY id',
-                    (conference_id, current_phase))
-            for row in cursor.fetchall():
-                agent_id = row[0]
-                agent_name = get_agent_name_by_id(agent_id) or agent_id
-                await websocket.send_json({
-                    "agent_id": agent_id,
-                    "agent_name": agent_name,
-                    "speech": row[1],
-                    "timestamp": row[2]
-                })
-        conn.close()
+            since_id = parse_cursor(websocket.query_params.get("since_id"))
+            rows, has_more = await async_db.get_dialogue_window(
+                conference_id, current_phase, since_id=since_id, limit=REPLAY_WINDOW
+            )
+            await client.put({
+                "type": "snapshot",
+                "phase_id": current_phase,
+                "since_id": since_id,
+                "entries": await build_dialogue_entries(rows),
+                "has_more": has_more
+            })
         
-        # 保持连接打开
+        # 保持连接打开，处理客户端发来的类型化消息
         while True:
-            # 只是为了保持连接而等待
             data = await websocket.receive_text()
+            try:
+                request = json.loads(data)
+            except ValueError:
+                # 旧版客户端的纯文本心跳消息
+                continue
+            if isinstance(request, dict):
+                await handle_client_message(client, request, current_phase)
             
-    except WebSocketDisconnect:
+    except (WebSocketDisconnect, RuntimeError):
+        # RuntimeError: 连接已被服务端关闭（如慢客户端被断开）
+        pass
+    finally:
         manager.disconnect(websocket, conference_id)
 
+# WebSocket连接指标
+@app.get("/api/ws/metrics")
+async def get_websocket_metrics():
+    """返回本进程WebSocket连接的发送队列和延迟指标"""
+    return manager.metrics()
+
+# SSE 保持连接注释的发送间隔（秒），防止代理因空闲断开连接
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+
+def format_sse(data: Dict[str, Any], event: str = "dialogue", event_id=None) -> str:
+    """格式化一条SSE事件"""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, ensure_ascii=False)}")
+    return "\n".join(lines) + "\n\n"
+
+# 只读观众的SSE事件流
+@app.get("/conference/{conference_id}/events")
+async def conference_events(request: Request, conference_id: str):
+    """
+    以 Server-Sent Events 推送会议发言，与WebSocket使用同一个广播来源
+
+    事件ID即 conversations.id，浏览器重连时通过 Last-Event-ID 只补发缺失的发言
+    """
+    conference = await async_db.get_conference(conference_id)
+    if not conference:
+        return JSONResponse({"message": "错误：会议不存在", "success": False}, status_code=404)
+    current_phase = conference.current_phase_index
+    last_event_id = parse_cursor(request.headers.get("last-event-id") or request.query_params.get("last_event_id"))
+
+    async def event_stream():
+        # 先订阅再回放，避免回放期间产生的发言丢失
+        queue = manager.subscribe_events(conference_id)
+        try:
+            yield "retry: 3000\n\n"
+            rows, has_more = await async_db.get_dialogue_window(
+                conference_id, current_phase, since_id=last_event_id, limit=REPLAY_WINDOW
+            )
+            if last_event_id is not None and has_more:
+                # 断线期间错过的发言超过回放窗口
+                yield format_sse({"phase_id": current_phase}, event="resync")
+            sent_id = last_event_id or 0
+            for entry in await build_dialogue_entries(rows):
+                sent_id = max(sent_id, entry["id"])
+                yield format_sse(entry, event_id=entry["id"])
+
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), timeout=SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                if message is None:
+                    # 发送队列溢出，结束本次连接，由浏览器带 Last-Event-ID 重连
+                    break
+                if message.get("type") == "reconnect":
+                    # 服务重启：更新浏览器的重连间隔后结束本次连接
+                    yield f"retry: {message['retry_after_ms']}\n\n"
+                    yield format_sse(message, event="reconnect")
+                    break
+                entry_id = message.get("id")
+                if isinstance(entry_id, int):
+                    if entry_id <= sent_id:
+                        continue
+                    sent_id = entry_id
+                yield format_sse(message, event_id=entry_id)
+        finally:
+            manager.unsubscribe_events(conference_id, queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no"  # 关闭 nginx 缓冲
+    })
+
 # 主页
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
-    conferences = list_conferences()
-    # 按开始时间倒序排序，最近的会议排在前面
-    # 未开始的会议（start_time为None）排在最后
-    conferences = sorted(
-        conferences, 
-        key=lambda x: datetime.fromisoformat(x.start_time) if x.start_time else datetime.min, 
-        reverse=True
-    )
-    agents = list_agents()
+    # 统计数据由聚合查询得到，并在进程内短时间缓存
+    stats = await async_db.get_dashboard_stats()
     
     # 为日历准备数据
     today = datetime.now()
@@ -332,58 +806,45 @@ async def home(request: Request):
     current_year = today.year
     current_day = today.day
     
-    # 生成活动统计数据
-    # 假设过去30天的活动数据
-    activity_data = []
-    for i in range(30, 0, -1):
-        date = today - timedelta(days=i)
-        # 统计每天的会议数量
-        day_conferences = [c for c in conferences if c.start_time and 
-                          datetime.fromisoformat(c.start_time).date() == date.date()]
-        activity_data.append({
-            "date": date.strftime("%m-%d"),
-            "value": len(day_conferences)
-        })
-    
-    # 为日历准备会议日期
-    conference_dates = []
-    for conf in conferences:
-        if conf.start_time:
-            conf_date = datetime.fromisoformat(conf.start_time).date()
-            conference_dates.append(conf_date.day)
-    
     return templates.TemplateResponse("index.html", {
         "request": request, 
-        "conferences": conferences, 
-        "agents": agents,
+        "stats": stats,
+        "recent_conferences": stats["recent_conferences"],
         "version": VERSION_INFO,
         "current_month": current_month,
         "current_year": current_year,
         "current_day": current_day,
-        "activity_data": json.dumps(activity_data),
-        "conference_dates": conference_dates,
+        "activity_data": json.dumps(stats["activity_data"]),
+        "conference_dates": stats["conference_dates"],
         "now": today
     })
 
 # 会议管理页面
 @app.get("/conferences", response_class=HTMLResponse)
-async def conferences_page(request: Request):
-    conferences = list_conferences()
-    # 按开始时间倒序排序，最近的会议排在前面
-    # 未开始的会议（start_time为None）排在最后
-    conferences = sorted(
-        conferences, 
-        key=lambda x: datetime.fromisoformat(x.start_time) if x.start_time else datetime.min, 
-        reverse=True
-    )
-    agents = list_agents()
+async def conferences_page(request: Request, page: int = 1, page_size: int = 20):
+    # 按开始时间倒序分页，未开始的会议排在最后（排序和分页在数据库中完成）
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    conferences, total = await async_db.list_conference_headers(limit=page_size, offset=(page - 1) * page_size)
     return templates.TemplateResponse("conferences.html", {
         "request": request, 
         "conferences": conferences, 
-        "agents": agents,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "total_pages": max(1, (total + page_size - 1) // page_size),
         "version": VERSION_INFO
     })
 
+# 分页获取会议列表
+@app.get("/api/conferences")
+async def get_conferences(page: int = 1, page_size: int = 20):
+    """按开始时间倒序分页返回会议表头（不含议程和参与者详情）"""
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    items, total = await async_db.list_conference_headers(limit=page_size, offset=(page - 1) * page_size)
+    return {"items": items, "total": total, "page": page, "page_size": page_size}
+
 # 对话历史管理页面
 @app.get("/dialogue_histories", response_class=HTMLResponse)
 async def dialogue_histories_page(request: Request):
@@ -395,7 +856,7 @@ async def dialogue_histories_page(request: Request):
 # 专家管理页面
 @app.get("/agent", response_class=HTMLResponse)
 async def agent_management_page(request: Request):
-    agents = list_agents()
+    agents = await async_db.list_agents()
     return templates.TemplateResponse("agent_management.html", {
         "request": request,
         "agents": agents,
@@ -421,7 +882,7 @@ async def start_new_conference(request: Request):
         agenda = generate_agenda(topic)
         
         # 检查是否有足够的 agent 可用
-        available_agents = list_agents()
+        available_agents = await async_db.list_agents()
         if len(available_agents) < num_agents:
             error_html = templates.get_template("error.html").render(
                 request=request,
@@ -440,7 +901,8 @@ async def start_new_conference(request: Request):
             conference_title = f"{today}会议：{topic[:20]}{'...' if len(topic) > 20 else ''}"
         
         # 创建会议
-        conference = create_conference(
+        conference = await asyncio.to_thread(
+            create_conference,
             conference_id=conference_id,
             title=conference_title,
             topic=topic,
@@ -449,7 +911,7 @@ async def start_new_conference(request: Request):
         )
         
         # 启动会议
-        start_conference(conference_id)
+        await asyncio.to_thread(start_conference, conference_id)
         
         # 重定向到会议页面
         return RedirectResponse(url=f"/conference/{conference_id}", status_code=303)
@@ -467,335 +929,350 @@ async def start_new_conference(request: Request):
 @app.get("/conference/{conference_id}", response_class=HTMLResponse)
 async def manage_conference(request: Request, conference_id: str):
     try:
-        conference = get_conference(conference_id)
+        conference = await async_db.get_conference(conference_id)
         if not conference:
             return RedirectResponse(url="/conferences?error=会议不存在")
         
-        # 如果会议尚未开始，则启动会议
+        # 如果会议尚未开始，则启动会议（同步写操作放到线程中执行）
         if conference.current_phase_index == -1:
-            start_conference(conference_id)
-            conference = get_conference(conference_id)
+            await asyncio.to_thread(start_conference, conference_id)
+            conference = await async_db.get_conference(conference_id)
         
-        # 获取对话历史
+        # 获取最近的对话历史，更早的发言由页面通过WebSocket懒加载
         dialogue = []
+        has_more_dialogue = False
         try:
-            conn = sqlite3.connect('conversations.db')
-            cursor = conn.cursor()
-            cursor.execute('SELECT agent_id, speech, timestamp FROM conversations WHERE conference_id = ? AND phase_id = ? ORDER BY id',
-                          (conference_id, conference.current_phase_index))
-            
-            for row in cursor.fetchall():
-                agent_id, speech, timestamp = row
-                agent_name = get_agent_name_by_id(agent_id) if agent_id not in ["用户", "系统"] else agent_id
-                dialogue.append({
-                    "agent_id": agent_id,
-                    "agent_name": agent_name,
-                    "speech": speech,
-                    "timestamp": timestamp
-                })
-            conn.close()
+            rows, has_more_dialogue = await async_db.get_dialogue_window(
+                conference_id, conference.current_phase_index, limit=REPLAY_WINDOW
+            )
+            dialogue = await build_dialogue_entries(rows)
         except Exception as e:
             print(f"获取对话历史时出错: {str(e)}")
         
         # 获取所有代理
-        agents = list_agents()
+        agents = await async_db.list_agents()
         
         # 渲染会议管理页面
         return templates.TemplateResponse("conference.html", {
             "request": request,
             "conference": conference,
             "dialogue": dialogue,
+            "has_more_dialogue": has_more_dialogue,
             "agents": agents
         })
     except Exception as e:
         return HTMLResponse(f"错误：{str(e)}", status_code=500)
 
-# 对话记录保存和通知
-async def save_dialogue_to_db(dialogue_entry, conference_id, phase_id):
-    # 保存到数据库
-    conn = sqlite3.connect('conversations.db')
-    cursor = conn.cursor()
-    try:
-        cursor.execute('INSERT INTO conversations (conference_id, phase_id, agent_id, speech, timestamp) VALUES (?, ?, ?, ?, ?)',
-                    (conference_id, phase_id, dialogue_entry["agent_id"], dialogue_entry["speech"], dialogue_entry["timestamp"]))
-        conn.commit()
-    finally:
-        conn.close()
-    
+# 会议事件广播：发言类事件提交后推送给 WebSocket / SSE 观众
+async def broadcast_dialogue_event(event):
     # 获取代理名称
-    agent_name = get_agent_name_by_id(dialogue_entry["agent_id"]) or dialogue_entry["agent_id"]
+    agent_name = await async_db.get_agent_name(event["agent_id"]) or event["agent_id"]
     
-    # 通过WebSocket发送通知
+    # 附带记录ID（即事件 seq）供客户端断线重连时作为 since_id
     await manager.send_dialogue({
-        "agent_id": dialogue_entry["agent_id"],
+        "id": event["seq"],
+        "agent_id": event["agent_id"],
         "agent_name": agent_name,
-        "speech": dialogue_entry["speech"],
-        "timestamp": dialogue_entry["timestamp"]
-    }, conference_id)
-
-# 对话监控线程
-async def monitor_dialogue_file(conference_id, phase_id):
-    history_dir = "dialogue_histories"
-    dialogue_file = os.path.join(history_dir, f"dialogue_history_{conference_id}_{phase_id}.json")
-    last_size = 0
-    last_count = 0
-    
-    while True:
-        try:
-            dialogue_history = []
-            try:
-                with open(dialogue_file, "r", encoding='utf-8') as f:
-                    dialogue_history = json.load(f)
-            except (FileNotFoundError, json.JSONDecodeError):
-                # 文件可能还不存在或格式不正确，继续等待
-                await asyncio.sleep(1)
-                continue
-                
-            # 如果有新的对话
-            if len(dialogue_history) > last_count:
-                # 只处理新增的对话
-                for entry in dialogue_history[last_count:]:
-                    # 确保entry包含必要的字段
-                    if "agent_id" not in entry or "speech" not in entry:
-                        print(f"警告：对话记录缺少必要字段: {entry}")
-                        continue
-                    
-                    # 如果没有timestamp，添加当前时间
-                    if "timestamp" not in entry:
-                        entry["timestamp"] = datetime.now().isoformat()
-                        print(f"警告：对话记录缺少timestamp字段，已自动添加")
-                    
-                    await save_dialogue_to_db(entry, conference_id, phase_id)
-                last_count = len(dialogue_history)
-        except Exception as e:
-            print(f"监控对话文件时出错: {str(e)}")
-        
-        await asyncio.sleep(0.5)  # 每半秒检查一次
+        "speech": event["payload"].get("speech"),
+        "timestamp": event["payload"].get("timestamp")
+    }, event["conference_id"])
+
+def register_event_broadcaster(loop):
+    """注册事件监听器；事件在讨论线程中写入，广播切换到应用的事件循环执行"""
+    def on_event(event):
+        if event["event_type"] in DIALOGUE_EVENT_TYPES:
+            asyncio.run_coroutine_threadsafe(broadcast_dialogue_event(event), loop)
+    add_event_listener(on_event)
+
+# 线程池中进行中的讨论和提问调用
+inflight_calls = set()
 
 # 处理用户操作（提问或继续讨论）
-@app.post("/conference/{conference_id}/end_phase")
-async def end_conference_phase(request: Request, conference_id: str, action: str = Form(None), 
-                              agent_id: str = Form(None), question: str = Form(None)):
+# 使用超时执行任务 - 防止 API 调用卡住
+async def run_with_timeout(func, *args, timeout=60):  # 增加默认超时时间到60秒
+    # 为特定函数设置更长的超时时间
+    if func.__name__ == "start_phase_discussion":
+        timeout = int(os.getenv("DISCUSSION_TIMEOUT", "180"))  # 讨论过程使用更长的超时时间，默认3分钟
+        logger.info(f"检测到讨论函数，使用更长的超时时间: {timeout}秒")
+        
     try:
-        conference = get_conference(conference_id)
+        # 使用线程池执行阻塞操作
+        logger.info(f"开始执行函数 {func.__name__} 超时设置为 {timeout}秒")
+        with concurrent.futures.ThreadPoolExecutor() as pool:
+            future = pool.submit(func, *args)
+            # 登记进行中的调用，服务关闭排空时等待其完成当前发言
+            inflight_calls.add(future)
+            future.add_done_callback(inflight_calls.discard)
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout=timeout)
+            
+        # 处理不同类型的结果
+        if isinstance(result, bool):
+            # 布尔值结果
+            logger.info(f"函数 {func.__name__} 执行完成，返回布尔值: {result}")
+            return {"success": result, "result": None}
+        elif isinstance(result, str) and (result.startswith("错误:") or result.startswith("讨论过程出错") or "失败" in result or "API" in result):
+            # 字符串形式的错误信息
+            logger.error(f"函数 {func.__name__} 执行出错: {result}")
+            return {"success": False, "error": result}
+        else:
+            # 其他结果都视为成功
+            logger.info(f"函数 {func.__name__} 执行成功")
+            return {"success": True, "result": result}
+            
+    except asyncio.TimeoutError:
+        logger.error(f"函数 {func.__name__} 执行超时 (超过 {timeout}秒)")
+        return {"success": False, "error": f"操作超时 (超过 {timeout}秒)，API 可能暂时不可用"}
+    except Exception as e:
+        logger.error(f"函数 {func.__name__} 执行异常: {str(e)}", exc_info=True)
+        return {"success": False, "error": str(e)}
+
+async def handle_conference_action(conference_id, action, agent_id=None, question=None):
+    """
+    执行用户的会议操作（continue / interrupt / question），供表单接口和WebSocket共用
+
+    返回 (status_code, payload)
+    """
+    try:
+        conference = await async_db.get_conference(conference_id)
         if not conference:
-            return JSONResponse({"message": "错误：会议不存在", "success": False}, status_code=404)
+            return 404, {"message": "错误：会议不存在", "success": False}
             
         phase_id = conference.current_phase_index
 
-        # 创建一个 dialogue_response 变量存储响应
-        dialogue_response = None
-        message = "处理失败，请重试"
-
-        # 使用超时执行任务 - 防止 API 调用卡住
-        async def run_with_timeout(func, *args, timeout=60):  # 增加默认超时时间到60秒
-            # 为特定函数设置更长的超时时间
-            if func.__name__ == "start_phase_discussion":
-                timeout = int(os.getenv("DISCUSSION_TIMEOUT", "180"))  # 讨论过程使用更长的超时时间，默认3分钟
-                logger.info(f"检测到讨论函数，使用更长的超时时间: {timeout}秒")
-                
-            try:
-                # 使用线程池执行阻塞操作
-                logger.info(f"开始执行函数 {func.__name__} 超时设置为 {timeout}秒")
-                with concurrent.futures.ThreadPoolExecutor() as pool:
-                    result = await asyncio.wait_for(
-                        asyncio.get_event_loop().run_in_executor(pool, func, *args),
-                        timeout=timeout
-                    )
-                    
-                # 处理不同类型的结果
-                if isinstance(result, bool):
-                    # 布尔值结果
-                    logger.info(f"函数 {func.__name__} 执行完成，返回布尔值: {result}")
-                    return {"success": result, "result": None}
-                elif isinstance(result, str) and (result.startswith("错误:") or result.startswith("讨论过程出错") or "失败" in result or "API" in result):
-                    # 字符串形式的错误信息
-                    logger.error(f"函数 {func.__name__} 执行出错: {result}")
-                    return {"success": False, "error": result}
-                else:
-                    # 其他结果都视为成功
-                    logger.info(f"函数 {func.__name__} 执行成功")
-                    return {"success": True, "result": result}
-                    
-            except asyncio.TimeoutError:
-                logger.error(f"函数 {func.__name__} 执行超时 (超过 {timeout}秒)")
-                return {"success": False, "error": f"操作超时 (超过 {timeout}秒)，API 可能暂时不可用"}
-            except Exception as e:
-                logger.error(f"函数 {func.__name__} 执行异常: {str(e)}", exc_info=True)
-                return {"success": False, "error": str(e)}
+        # 服务正在关闭时不再接受新的讨论和提问
+        if is_draining() and action in ("continue", "question"):
+            return 503, {
+                "message": "服务正在重启，请稍后重试",
+                "success": False,
+                "retry_after_ms": WS_RECONNECT_DELAY_MS
+            }
 
         # 根据不同的操作处理请求
         if action == "continue":
-            message = "继续讨论"
-            
-            # 确保对话历史文件存在并包含最新的用户提问和代理回答
-            history_dir = "dialogue_histories"
-            if not os.path.exists(history_dir):
-                os.makedirs(history_dir)
-            dialogue_file = os.path.join(history_dir, f"dialogue_history_{conference_id}_{phase_id}.json")
-            try:
-                # 首先从数据库获取所有对话记录
-                conn = sqlite3.connect('conversations.db')
-                cursor = conn.cursor()
-                cursor.execute('SELECT agent_id, speech, timestamp FROM conversations WHERE conference_id = ? AND phase_id = ? ORDER BY timestamp',
-                              (conference_id, phase_id))
-                
-                db_dialogue = []
-                for row in cursor.fetchall():
-                    agent_id, speech, timestamp = row
-                    db_dialogue.append({
-                        "agent_id": agent_id,
-                        "speech": speech,
-                        "timestamp": timestamp
-                    })
-                conn.close()
-                
-                # 保存到JSON文件，确保文件包含最新的对话记录
-                if db_dialogue:
-                    with open(dialogue_file, "w", encoding='utf-8') as f:
-                        json.dump(db_dialogue, f, indent=4)
-                    print(f"已将 {len(db_dialogue)} 条对话记录写入文件 {dialogue_file}")
-            except Exception as e:
-                print(f"更新对话历史文件时出错: {str(e)}")
-            
-            # 创建或获取监听器任务
-            listener_key = f"{conference_id}_{phase_id}"
-            if listener_key in dialogue_listeners:
-                # 如果已有监听器，检查是否仍在运行
-                monitor_task = dialogue_listeners[listener_key]
-                if monitor_task.done():
-                    # 如果任务已完成，创建新的监听器
-                    monitor_task = asyncio.create_task(monitor_dialogue_file(conference_id, phase_id))
-                    dialogue_listeners[listener_key] = monitor_task
-            else:
-                # 创建新的监听器
-                monitor_task = asyncio.create_task(monitor_dialogue_file(conference_id, phase_id))
-                dialogue_listeners[listener_key] = monitor_task
-            
-            # 中断当前讨论
-            interrupt_result = await run_with_timeout(user_intervene, conference_id, phase_id, "interrupt")
-            if not interrupt_result["success"]:
-                return JSONResponse({
-                    "message": f"中断讨论失败: {interrupt_result.get('error', '未知错误')}",
-                    "success": False
-                }, status_code=500)
-            
-            # 启动讨论
+            # 启动讨论（用户中断过的讨论从检查点接着发言）
             discussion_result = await run_with_timeout(start_phase_discussion, conference_id, phase_id)
             if not discussion_result["success"]:
                 error_msg = discussion_result.get('error', '未知错误')
-                return JSONResponse({
+                return 500, {
                     "message": f"启动讨论失败: {error_msg}",
                     "success": False,
                     "fallback_response": "AI服务暂时不可用，请稍后再试。"
-                }, status_code=500)
+                }
             
-            return JSONResponse({
+            return 200, {
                 "message": "讨论已继续",
                 "success": True
-            })
+            }
             
-        elif action == "question" and agent_id and question:
-            message = f"向 {agent_id} 提问"
-            
-            # 记录用户提问到数据库
-            try:
-                conn = sqlite3.connect('conversations.db')
-                cursor = conn.cursor()
-                timestamp = datetime.now().isoformat()
-                user_question = f"提问给 {get_agent_name_by_id(agent_id)}: {question}"
-                
-                # 插入用户提问
-                cursor.execute('INSERT INTO conversations (conference_id, phase_id, agent_id, speech, timestamp) VALUES (?, ?, ?, ?, ?)',
-                              (conference_id, phase_id, "用户", user_question, timestamp))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"记录用户提问时出错: {str(e)}")
-            
-            # 创建或获取监听器任务
-            listener_key = f"{conference_id}_{phase_id}"
-            if listener_key in dialogue_listeners:
-                # 如果已有监听器，检查是否仍在运行
-                monitor_task = dialogue_listeners[listener_key]
-                if monitor_task.done():
-                    # 如果任务已完成，创建新的监听器
-                    monitor_task = asyncio.create_task(monitor_dialogue_file(conference_id, phase_id))
-                    dialogue_listeners[listener_key] = monitor_task
-            else:
-                # 创建新的监听器
-                monitor_task = asyncio.create_task(monitor_dialogue_file(conference_id, phase_id))
-                dialogue_listeners[listener_key] = monitor_task
+        elif action == "interrupt":
+            # 讨论在当前发言完成后停止，检查点保留，继续时从中断处接着发言
+            interrupt_result = await run_with_timeout(user_intervene, conference_id, phase_id, "interrupt")
+            if not interrupt_result["success"]:
+                return 409, {
+                    "message": "当前没有进行中的讨论，无需中断",
+                    "success": False
+                }
+            return 200, {
+                "message": "已请求中断，讨论将在当前发言完成后停止",
+                "success": True
+            }
             
-            # 处理用户提问
+        elif action == "question" and agent_id and question:
+            # 处理用户提问（提问和回答由讨论流程写入会议事件日志）
             question_result = await run_with_timeout(
                 user_intervene, conference_id, phase_id, "question", agent_id, question
             )
             
             if not question_result["success"]:
                 error_msg = question_result.get('error', '未知错误')
-                return JSONResponse({
+                return 500, {
                     "message": f"提问失败: {error_msg}",
                     "success": False,
                     "fallback_response": "AI服务暂时不可用，请稍后再试。"
-                }, status_code=500)
+                }
             
             # 获取代理回答
             dialogue_response = question_result["result"]
             
-            # 记录代理回答到数据库
-            try:
-                conn = sqlite3.connect('conversations.db')
-                cursor = conn.cursor()
-                timestamp = datetime.now().isoformat()
-                
-                # 插入代理回答
-                cursor.execute('INSERT INTO conversations (conference_id, phase_id, agent_id, speech, timestamp) VALUES (?, ?, ?, ?, ?)',
-                              (conference_id, phase_id, agent_id, dialogue_response, timestamp))
-                conn.commit()
-                conn.close()
-            except Exception as e:
-                print(f"记录代理回答时出错: {str(e)}")
-            
-            return JSONResponse({
+            return 200, {
                 "message": "提问已处理",
                 "success": True,
                 "dialogue": dialogue_response
-            })
+            }
             
         else:
-            return JSONResponse({
+            return 400, {
                 "message": f"无效的操作: {action}",
                 "success": False
-            }, status_code=400)
+            }
             
     except Exception as e:
         logger.error(f"处理请求时出错: {str(e)}", exc_info=True)
-        return JSONResponse({
+        return 500, {
             "message": f"处理请求时出错: {str(e)}",
             "success": False
-        }, status_code=500)
+        }
+
+@app.post("/conference/{conference_id}/end_phase")
+async def end_conference_phase(request: Request, conference_id: str, action: str = Form(None), 
+                              agent_id: str = Form(None), question: str = Form(None)):
+    status_code, payload = await handle_conference_action(conference_id, action, agent_id, question)
+    return JSONResponse(payload, status_code=status_code)
+
+# 会议结束后在后台压缩其对话历史文件
+async def compress_conference_histories(conference_id):
+    try:
+        await asyncio.to_thread(compress_ended_histories, conference_id=conference_id)
+    except Exception as e:
+        logger.warning(f"压缩会议 {conference_id} 的对话历史文件失败: {str(e)}")
+
+# 会议结束后自动写入分析归档（需要 pandas 和 pyarrow）
+ANALYTICS_AUTO_ARCHIVE = os.getenv("ANALYTICS_AUTO_ARCHIVE", "false").lower() == "true"
+
+async def archive_ended_conference(conference_id):
+    try:
+        from analytics_archive import archive_conference_by_id
+        count = await asyncio.to_thread(archive_conference_by_id, conference_id)
+        logger.info(f"会议 {conference_id} 已写入分析归档，发言 {count} 条")
+    except Exception as e:
+        logger.warning(f"会议 {conference_id} 写入分析归档失败: {str(e)}")
 
 # 结束整个会议
 @app.post("/conference/{conference_id}/end", response_class=HTMLResponse)
 async def end_entire_conference(request: Request, conference_id: str):
     try:
-        end_conference(conference_id)
+        await asyncio.to_thread(end_conference, conference_id)
+        asyncio.create_task(compress_conference_histories(conference_id))
+        if ANALYTICS_AUTO_ARCHIVE:
+            asyncio.create_task(archive_ended_conference(conference_id))
         return await home(request)
     except Exception as e:
         return HTMLResponse(f"错误：{str(e)}", status_code=500)
 
+# 分页获取会议对话记录
+@app.get("/api/conferences/{conference_id}/dialogue")
+async def get_conference_dialogue(conference_id: str, phase_id: int = None, after_id: int = None,
+                                  before_id: int = None, limit: int = 50):
+    """
+    按 (conference_id, phase_id, id) 键集分页获取对话记录，结果始终按ID升序排列
+
+    - after_id: 返回该ID之后的一页，next_after_id 用于继续向后翻页（顺序读取、导出）
+    - 未提供 after_id 时返回 before_id 之前（默认为最新）的一页，next_before_id 用于继续向前翻页
+    - phase_id 默认为会议当前阶段
+    """
+    conference = await async_db.get_conference(conference_id)
+    if not conference:
+        return JSONResponse(status_code=404, content={"error": f"找不到会议 ID: {conference_id}"})
+    if phase_id is None:
+        phase_id = conference.current_phase_index
+    limit = min(max(limit, 1), 200)
+
+    if after_id is not None:
+        rows, has_more = await async_db.get_dialogue_after(conference_id, phase_id, after_id=after_id, limit=limit)
+    else:
+        rows, has_more = await async_db.get_dialogue_window(conference_id, phase_id, before_id=before_id, limit=limit)
+    items = await build_dialogue_entries(rows)
+
+    result = {
+        "conference_id": conference_id,
+        "phase_id": phase_id,
+        "items": items,
+        "has_more": has_more
+    }
+    if after_id is not None:
+        result["next_after_id"] = items[-1]["id"] if items and has_more else None
+    else:
+        result["next_before_id"] = items[0]["id"] if items and has_more else None
+    return result
+
+@app.get("/api/conferences/{conference_id}/events")
+async def get_conference_events(conference_id: str, after_seq: int = None, limit: int = 100):
+    """
+    按 seq 升序获取会议事件日志（创建、开始、阶段切换、发言、提问、结束），
+    next_after_seq 用于继续向后读取；客户端保存最后的 seq 即可增量重放
+    """
+    conference = await async_db.get_conference(conference_id)
+    if not conference:
+        return JSONResponse(status_code=404, content={"error": f"找不到会议 ID: {conference_id}"})
+    limit = min(max(limit, 1), 500)
+
+    events, has_more = await async_db.list_conference_events(conference_id, after_seq=after_seq, limit=limit)
+    return {
+        "conference_id": conference_id,
+        "events": events,
+        "has_more": has_more,
+        "next_after_seq": events[-1]["seq"] if events and has_more else None
+    }
+
+# 会议记录导出
+@app.get("/api/conferences/export")
+async def export_conferences_archive(ids: str = None, format: str = "ndjson"):
+    """把多个会议（ids 以逗号分隔，省略时为全部会议）的记录流式打包为一个 ZIP 归档"""
+    try:
+        TranscriptExporterFactory.get_exporter(format)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    if ids:
+        conference_ids = list(dict.fromkeys(i.strip() for i in ids.split(",") if i.strip()))
+    else:
+        conference_ids = await async_db.list_conference_ids()
+    filename = f"transcripts_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+    return StreamingResponse(stream_archive(conference_ids, format), media_type="application/zip", headers={
+        "Content-Disposition": f'attachment; filename="{filename}"'
+    })
+
+@app.get("/api/conferences/{conference_id}/export")
+async def export_conference(conference_id: str, format: str = "ndjson"):
+    """按 ndjson / csv / markdown 格式流式导出会议全部阶段的发言"""
+    try:
+        exporter = TranscriptExporterFactory.get_exporter(format)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+    conference = await async_db.get_conference(conference_id)
+    if not conference:
+        return JSONResponse(status_code=404, content={"error": f"找不到会议 ID: {conference_id}"})
+    return StreamingResponse(exporter.stream(conference), media_type=exporter.media_type, headers={
+        "Content-Disposition": f'attachment; filename="{exporter.filename(conference)}"'
+    })
+
+# 对话记录全文检索
+@app.get("/api/search/conversations")
+async def search_conversations_endpoint(q: str, conference_id: str = None, agent_id: str = None,
+                                        date_from: str = None, date_to: str = None, order: str = "relevance",
+                                        page: int = 1, page_size: int = 20):
+    """按关键词检索所有会议的发言，返回带 <mark> 高亮的片段"""
+    q = q.strip()
+    if not q:
+        return JSONResponse(status_code=400, content={"error": "搜索关键词不能为空"})
+    page = max(page, 1)
+    page_size = min(max(page_size, 1), 100)
+    try:
+        items, mode = await search_conversations(
+            q, conference_id=conference_id, agent_id=agent_id, date_from=date_from, date_to=date_to,
+            order=order, limit=page_size, offset=(page - 1) * page_size
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": f"无效的查询参数: {str(e)}"})
+
+    names = await async_db.get_agent_names()
+    for item in items:
+        item["agent_name"] = names.get(item["agent_id"], item["agent_id"])
+    return {"query": q, "mode": mode, "items": items, "page": page, "page_size": page_size}
+
 @app.delete("/api/conferences/{conference_id}")
 async def delete_conference_endpoint(conference_id: str):
     try:
         # 检查会议是否存在
-        conference = get_conference(conference_id)
+        conference = await async_db.get_conference(conference_id)
         if not conference:
             return JSONResponse(status_code=404, 
                               content={"error": f"找不到会议 ID: {conference_id}"})
         
-        # 删除会议
-        delete_conference(conference_id)
+        # 先按批清理对话记录和历史文件，再删除会议；清理中途失败时会议仍在，可以重试删除
+        await asyncio.to_thread(purge_conference_data, conference_id)
+        await asyncio.to_thread(delete_conference, conference_id)
         
         return {"message": f"会议 '{conference.title}' 已成功删除"}
     except Exception as e:
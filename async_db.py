@@ -0,0 +1,336 @@
+"""
+异步数据访问层
+通过 storage 模块的异步引擎（SQLite 下为 aiosqlite，PostgreSQL 下为 asyncpg）
+为 FastAPI 异步处理函数提供代理、会议和对话记录的读写，避免阻塞事件循环
+"""
+
+import os
+import json
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from agent_db import Agent
+from conference_organizer import (
+    conference_from_row, cache_conference, get_cached_conference, conferences_version
+)
+from event_log import row_to_event
+from storage import AGENTS, CONFERENCES, CONVERSATIONS, connect_async
+
+# 代理名称缓存的有效期（秒），过期后重新从数据库加载，以便感知 update_experts 等脚本的修改
+AGENT_NAME_CACHE_TTL = float(os.getenv("AGENT_NAME_CACHE_TTL", "300"))
+
+_agent_name_cache = {}
+_agent_name_cache_loaded_at = 0.0
+
+# 首页统计缓存的有效期（秒）；本进程内创建、启动或删除会议时立即失效
+DASHBOARD_CACHE_TTL = float(os.getenv("DASHBOARD_CACHE_TTL", "30"))
+
+_dashboard_cache = None
+_dashboard_cache_key = None
+
+# 代理相关
+
+async def list_agents():
+    """异步获取所有代理"""
+    async with connect_async(AGENTS) as conn:
+        rows = (await conn.execute(text('SELECT * FROM agents'))).fetchall()
+    return [
+        Agent(
+            row[0],  # agent_id
+            row[1],  # name
+            json.loads(row[2]),  # background_info
+            json.loads(row[3]),  # personality_traits
+            json.loads(row[4]),  # knowledge_base_links
+            json.loads(row[5])   # communication_style
+        ) for row in rows
+    ]
+
+async def get_agent_names(refresh=False):
+    """异步获取 agent_id -> name 映射，结果在进程内缓存 AGENT_NAME_CACHE_TTL 秒"""
+    global _agent_name_cache, _agent_name_cache_loaded_at
+    if refresh or time.monotonic() - _agent_name_cache_loaded_at > AGENT_NAME_CACHE_TTL:
+        async with connect_async(AGENTS) as conn:
+            rows = (await conn.execute(text('SELECT agent_id, name FROM agents'))).fetchall()
+        _agent_name_cache = {row[0]: row[1] for row in rows}
+        _agent_name_cache_loaded_at = time.monotonic()
+    return _agent_name_cache
+
+def invalidate_agent_name_cache():
+    """使代理名称缓存失效，下次访问时重新加载"""
+    global _agent_name_cache_loaded_at
+    _agent_name_cache_loaded_at = 0.0
+
+async def get_agent_name(agent_id):
+    """异步获取代理名称，不存在时返回None"""
+    names = await get_agent_names()
+    if agent_id not in names and time.monotonic() - _agent_name_cache_loaded_at > 1:
+        # 可能是缓存加载后新增的代理，刷新一次
+        names = await get_agent_names(refresh=True)
+    return names.get(agent_id)
+
+# 会议相关
+
+async def get_conference(conference_id):
+    """异步获取会议，启用缓存时优先读取进程内缓存"""
+    cached = get_cached_conference(conference_id)
+    if cached is not None:
+        return cached
+
+    async with connect_async(CONFERENCES) as conn:
+        result = await conn.execute(text('SELECT * FROM conferences WHERE conference_id = :conference_id'),
+                                    {"conference_id": conference_id})
+        row = result.fetchone()
+    if not row:
+        return None
+
+    conference = conference_from_row(row)
+    cache_conference(conference)
+    return conference
+
+async def list_conferences():
+    """异步获取所有会议"""
+    async with connect_async(CONFERENCES) as conn:
+        rows = (await conn.execute(text('SELECT * FROM conferences'))).fetchall()
+    return [conference_from_row(row) for row in rows]
+
+async def list_conference_ids():
+    """按开始时间倒序获取全部会议ID"""
+    async with connect_async(CONFERENCES) as conn:
+        rows = (await conn.execute(
+            text('SELECT conference_id FROM conferences ORDER BY start_time DESC, conference_id')
+        )).fetchall()
+    return [row[0] for row in rows]
+
+def json_length_sql(conn, column):
+    """JSON 数组长度的 SQL 表达式（兼容 SQLite 与 PostgreSQL）"""
+    if conn.dialect.name == "postgresql":
+        return f"json_array_length({column}::json)"
+    return f"json_array_length({column})"
+
+# 会议列表只读取表头字段，议程和参与者只取数量，不解析JSON
+CONFERENCE_HEADER_COLUMNS = ("conference_id", "title", "conference_type", "start_time", "end_time",
+                             "current_phase_index", "participant_count", "phase_count")
+
+async def list_conference_headers(limit=20, offset=0):
+    """
+    按开始时间倒序分页获取会议表头，未开始的会议排在最后，返回 (items, total)
+
+    已开始和未开始的会议分两段查询，两段都能直接使用 start_time 索引排序
+    """
+    async with connect_async(CONFERENCES) as conn:
+        columns = ("conference_id, title, conference_type, start_time, end_time, current_phase_index, "
+                   f"{json_length_sql(conn, 'participant_agent_ids')}, {json_length_sql(conn, 'agenda')}")
+        started_total, unstarted_total = (await conn.execute(text(
+            'SELECT COUNT(start_time), COUNT(*) - COUNT(start_time) FROM conferences'
+        ))).fetchone()
+
+        rows = []
+        if offset < started_total:
+            rows = (await conn.execute(
+                text(f'SELECT {columns} FROM conferences WHERE start_time IS NOT NULL '
+                     'ORDER BY start_time DESC LIMIT :limit OFFSET :offset'),
+                {"limit": limit, "offset": offset}
+            )).fetchall()
+        if len(rows) < limit:
+            rows += (await conn.execute(
+                text(f'SELECT {columns} FROM conferences WHERE start_time IS NULL '
+                     'ORDER BY conference_id LIMIT :limit OFFSET :offset'),
+                {"limit": limit - len(rows), "offset": max(0, offset - started_total)}
+            )).fetchall()
+
+    items = [dict(zip(CONFERENCE_HEADER_COLUMNS, row)) for row in rows]
+    return items, started_total + unstarted_total
+
+async def get_dashboard_stats(days=30, recent_limit=3):
+    """
+    首页统计：会议数、阶段总数、专家数、最近会议、近 days 天每日会议数和本月有会议的日期
+
+    全部通过聚合查询完成（日期按 ISO 字符串前缀分组，走 start_time 索引），结果缓存 DASHBOARD_CACHE_TTL 秒
+    """
+    global _dashboard_cache, _dashboard_cache_key
+    today = datetime.now()
+    cache_key = (conferences_version(), today.date())
+    if (_dashboard_cache is not None and _dashboard_cache_key == cache_key
+            and time.monotonic() - _dashboard_cache["computed_at"] < DASHBOARD_CACHE_TTL):
+        return _dashboard_cache
+
+    since = (today - timedelta(days=days)).date().isoformat()
+    until = today.date().isoformat()
+    month_start = today.replace(day=1).date().isoformat()
+    next_month_start = (today.replace(day=28) + timedelta(days=4)).replace(day=1).date().isoformat()
+
+    async with connect_async(CONFERENCES) as conn:
+        conference_count, phase_count = (await conn.execute(
+            text(f'SELECT COUNT(*), COALESCE(SUM({json_length_sql(conn, "agenda")}), 0) FROM conferences')
+        )).fetchone()
+
+        # 日期范围内按天分组
+        day_sql = ('SELECT substr(start_time, 1, 10) AS day, COUNT(*) FROM conferences '
+                   'WHERE start_time >= :start AND start_time < :end GROUP BY substr(start_time, 1, 10)')
+        daily_counts = dict((await conn.execute(text(day_sql), {"start": since, "end": until})).fetchall())
+        month_days = (await conn.execute(text(day_sql), {"start": month_start, "end": next_month_start})).fetchall()
+
+        # 最近开始的会议，不足时用尚未开始的会议补齐
+        rows = (await conn.execute(
+            text('SELECT * FROM conferences WHERE start_time IS NOT NULL ORDER BY start_time DESC LIMIT :limit'),
+            {"limit": recent_limit}
+        )).fetchall()
+        if len(rows) < recent_limit:
+            rows += (await conn.execute(
+                text('SELECT * FROM conferences WHERE start_time IS NULL LIMIT :limit'),
+                {"limit": recent_limit - len(rows)}
+            )).fetchall()
+
+    async with connect_async(AGENTS) as conn:
+        agent_count = (await conn.execute(text('SELECT COUNT(*) FROM agents'))).scalar()
+
+    activity_data = []
+    for i in range(days, 0, -1):
+        date = today - timedelta(days=i)
+        activity_data.append({
+            "date": date.strftime("%m-%d"),
+            "value": daily_counts.get(date.date().isoformat(), 0)
+        })
+
+    _dashboard_cache = {
+        "conference_count": conference_count,
+        "phase_count": int(phase_count or 0),
+        "agent_count": agent_count,
+        "recent_conferences": [conference_from_row(row) for row in rows],
+        "activity_data": activity_data,
+        "conference_dates": sorted(int(row[0][8:10]) for row in month_days),
+        "computed_at": time.monotonic()
+    }
+    _dashboard_cache_key = cache_key
+    return _dashboard_cache
+
+# 对话记录相关
+
+async def get_phase_dialogue(conference_id, phase_id):
+    """异步获取某个阶段的全部对话记录，返回 (agent_id, speech, timestamp) 列表"""
+    async with connect_async(CONVERSATIONS) as conn:
+        result = await conn.execute(
+            text('SELECT agent_id, speech, timestamp FROM conversations '
+                 'WHERE conference_id = :conference_id AND phase_id = :phase_id ORDER BY id'),
+            {"conference_id": conference_id, "phase_id": phase_id}
+        )
+        return result.fetchall()
+
+async def get_dialogue_window(conference_id, phase_id, since_id=None, before_id=None, limit=50):
+    """
+    按ID游标获取某个阶段的一段对话记录
+
+    - since_id: 只返回ID大于该值的记录（断线重连后补齐）
+    - before_id: 只返回ID小于该值的记录（向前懒加载更早的发言）
+    - limit: 最多返回的条数，取满足条件的最新 limit 条
+
+    返回 (rows, has_more)，rows 为按ID升序排列的 (id, agent_id, speech, timestamp)，
+    has_more 表示窗口之前还有未返回的记录
+    """
+    sql = ('SELECT id, agent_id, speech, timestamp FROM conversations '
+           'WHERE conference_id = :conference_id AND phase_id = :phase_id')
+    params = {"conference_id": conference_id, "phase_id": phase_id, "limit": limit + 1}
+    if since_id is not None:
+        sql += ' AND id > :since_id'
+        params["since_id"] = since_id
+    if before_id is not None:
+        sql += ' AND id < :before_id'
+        params["before_id"] = before_id
+    sql += ' ORDER BY id DESC LIMIT :limit'
+
+    async with connect_async(CONVERSATIONS) as conn:
+        rows = (await conn.execute(text(sql), params)).fetchall()
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
+
+# 对话历史文件索引
+
+async def list_dialogue_histories(conference_type=None, conference_id=None, query=None, limit=50, offset=0):
+    """按修改时间倒序分页查询对话历史索引，返回 (rows, total)"""
+    conditions = []
+    params = {"limit": limit, "offset": offset}
+    if conference_type:
+        conditions.append("conference_type = :conference_type")
+        params["conference_type"] = conference_type
+    if conference_id:
+        conditions.append("conference_id = :conference_id")
+        params["conference_id"] = conference_id
+    if query:
+        conditions.append("(conference_title LIKE :query OR conference_id LIKE :query OR filename LIKE :query)")
+        params["query"] = f"%{query}%"
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    async with connect_async(CONVERSATIONS) as conn:
+        total = (await conn.execute(text(f"SELECT COUNT(*) FROM dialogue_history_index{where}"), params)).scalar()
+        rows = (await conn.execute(
+            text("SELECT filename, conference_id, phase_id, conference_title, conference_type, "
+                 f"size_bytes, entry_count, modified FROM dialogue_history_index{where} "
+                 "ORDER BY modified DESC LIMIT :limit OFFSET :offset"),
+            params
+        )).fetchall()
+    return rows, total
+
+async def list_dialogue_history_types():
+    """获取对话历史中出现过的会议类型"""
+    async with connect_async(CONVERSATIONS) as conn:
+        rows = (await conn.execute(
+            text("SELECT DISTINCT conference_type FROM dialogue_history_index ORDER BY conference_type")
+        )).fetchall()
+    return [row[0] or "未分类" for row in rows]
+
+async def get_dialogue_after(conference_id, phase_id, after_id=None, limit=50):
+    """
+    按ID升序获取 after_id 之后的一页对话记录（用于顺序读取和导出）
+
+    返回 (rows, has_more)，rows 为 (id, agent_id, speech, timestamp)，has_more 表示之后还有记录
+    """
+    sql = ('SELECT id, agent_id, speech, timestamp FROM conversations '
+           'WHERE conference_id = :conference_id AND phase_id = :phase_id')
+    params = {"conference_id": conference_id, "phase_id": phase_id, "limit": limit + 1}
+    if after_id is not None:
+        sql += ' AND id > :after_id'
+        params["after_id"] = after_id
+    sql += ' ORDER BY id LIMIT :limit'
+
+    async with connect_async(CONVERSATIONS) as conn:
+        rows = (await conn.execute(text(sql), params)).fetchall()
+    return rows[:limit], len(rows) > limit
+
+async def list_conference_events(conference_id, after_seq=None, limit=100):
+    """按 seq 升序读取会议事件，返回 (事件列表, 是否还有更多)"""
+    sql = ('SELECT seq, conference_id, phase_id, event_type, agent_id, payload, created_at '
+           'FROM conference_events WHERE conference_id = :conference_id')
+    params = {"conference_id": conference_id, "limit": limit + 1}
+    if after_seq is not None:
+        sql += ' AND seq > :after_seq'
+        params["after_seq"] = after_seq
+    sql += ' ORDER BY seq LIMIT :limit'
+
+    async with connect_async(CONVERSATIONS) as conn:
+        rows = (await conn.execute(text(sql), params)).fetchall()
+    return [row_to_event(row) for row in rows[:limit]], len(rows) > limit
+
+async def iter_conference_dialogue(conference_id, batch_size=500):
+    """
+    按 (phase_id, id) 顺序分批读取会议全部阶段的对话记录（用于导出）
+
+    每批使用独立的短查询和 (phase_id, id) 键集游标，内存占用与记录总数无关；
+    逐批产出 (id, phase_id, agent_id, speech, timestamp) 列表
+    """
+    cursor = None
+    while True:
+        sql = 'SELECT id, phase_id, agent_id, speech, timestamp FROM conversations WHERE conference_id = :conference_id'
+        params = {"conference_id": conference_id, "limit": batch_size}
+        if cursor is not None:
+            sql += ' AND (phase_id > :last_phase OR (phase_id = :last_phase AND id > :last_id))'
+            params["last_phase"], params["last_id"] = cursor
+        sql += ' ORDER BY phase_id, id LIMIT :limit'
+
+        async with connect_async(CONVERSATIONS) as conn:
+            rows = (await conn.execute(text(sql), params)).fetchall()
+        if not rows:
+            return
+        yield rows
+        if len(rows) < batch_size:
+            return
+        cursor = (rows[-1][1], rows[-1][0])
@@ -18,6 +18,8 @@ import configparser
 from pathlib import Path
 from io import BytesIO
 from dotenv import load_dotenv
+from history_files import parse_history_filename
+from storage import HISTORY_DIR, SQLITE_DATA_DIR, get_storage_backend
 
 # 加载环境变量
 load_dotenv()
@@ -132,13 +134,33 @@ def load_config():
     config.read(CONFIG_FILE, encoding='utf-8')
     return config
 
+# 对话历史文件在归档中的固定目录，与 DIALOGUE_HISTORY_DIR 的实际位置（可能是绝对路径）无关
+HISTORY_ARCHIVE_DIR = "dialogue_histories"
+
 def get_db_files():
-    """获取所有数据库文件"""
-    return [f for f in os.listdir() if f.endswith('.db')]
+    """获取 SQLite 数据目录中的所有数据库文件；使用 PostgreSQL 时数据库不在本地，需用 pg_dump 另行备份"""
+    if get_storage_backend().shared:
+        logger.warning("当前使用 PostgreSQL 存储后端，备份不包含数据库，请使用 pg_dump 另行备份")
+        return []
+    if not os.path.isdir(SQLITE_DATA_DIR):
+        return []
+    return [os.path.join(SQLITE_DATA_DIR, f) for f in os.listdir(SQLITE_DATA_DIR) if f.endswith('.db')]
 
 def get_dialogue_files():
-    """获取所有对话历史文件"""
-    return [f for f in os.listdir() if f.startswith('dialogue_history_') and f.endswith('.json')]
+    """获取所有对话历史文件（对话历史目录中的文件，以及旧版本遗留在当前目录的文件；包括已压缩的 .jsonz）"""
+    files = [f for f in os.listdir() if parse_history_filename(f)]
+    if os.path.isdir(HISTORY_DIR):
+        files += [os.path.join(HISTORY_DIR, f) for f in os.listdir(HISTORY_DIR) if parse_history_filename(f)]
+    return files
+
+def archive_name(path):
+    """文件在备份归档中的名称：对话历史文件统一放在 HISTORY_ARCHIVE_DIR 下，数据库文件放在归档根目录，其余文件保持原相对路径"""
+    filename = os.path.basename(path)
+    if parse_history_filename(filename):
+        return f"{HISTORY_ARCHIVE_DIR}/{filename}"
+    if filename.endswith('.db'):
+        return filename
+    return path
 
 def create_backup_name():
     """创建备份文件名"""
@@ -181,14 +203,14 @@ def create_backup_archive(config):
         with tarfile.open(archive_path, "w:gz") as tar:
             for file in all_files:
                 logger.info(f"添加文件到备份: {file}")
-                tar.add(file)
+                tar.add(file, arcname=archive_name(file))
     else:
         # 创建zip归档
         archive_path = os.path.join(backup_dir, f"{backup_name}.zip")
         with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
             for file in all_files:
                 logger.info(f"添加文件到备份: {file}")
-                zipf.write(file)
+                zipf.write(file, arcname=archive_name(file))
     
     logger.info(f"备份归档已创建: {archive_path}")
     return archive_path
@@ -436,23 +458,36 @@ def restore_backup(backup_file):
         # 停止应用程序 (实际部署时可能需要)
         logger.info("准备恢复数据...")
         
-        # 恢复数据库文件
-        for db_file in [f for f in os.listdir(tmp_dir) if f.endswith('.db')]:
+        # 恢复数据库文件到 SQLite 数据目录（使用 PostgreSQL 时跳过）
+        restored_dbs = [f for f in os.listdir(tmp_dir) if f.endswith('.db')]
+        if restored_dbs and get_storage_backend().shared:
+            logger.warning("当前使用 PostgreSQL 存储后端，跳过备份中的 SQLite 数据库文件")
+            restored_dbs = []
+        if restored_dbs:
+            os.makedirs(SQLITE_DATA_DIR, exist_ok=True)
+        for db_file in restored_dbs:
             src = os.path.join(tmp_dir, db_file)
-            # 如果当前目录中存在此数据库，先备份
-            if os.path.exists(db_file):
-                backup_name = f"{db_file}.bak.{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
-                shutil.copy2(db_file, backup_name)
+            target = os.path.join(SQLITE_DATA_DIR, db_file)
+            # 如果数据目录中存在此数据库，先备份
+            if os.path.exists(target):
+                backup_name = f"{target}.bak.{datetime.datetime.now().strftime('%Y%m%d%H%M%S')}"
+                shutil.copy2(target, backup_name)
                 logger.info(f"已备份现有数据库: {backup_name}")
             # 复制恢复的数据库
-            shutil.copy2(src, db_file)
-            logger.info(f"已恢复数据库: {db_file}")
-        
-        # 恢复对话历史文件
-        for dialogue_file in [f for f in os.listdir(tmp_dir) if f.startswith('dialogue_history_') and f.endswith('.json')]:
-            src = os.path.join(tmp_dir, dialogue_file)
-            shutil.copy2(src, dialogue_file)
-            logger.info(f"已恢复对话历史: {dialogue_file}")
+            shutil.copy2(src, target)
+            logger.info(f"已恢复数据库: {target}")
+        
+        # 恢复对话历史文件（归档中 dialogue_histories 目录下的文件，以及旧版本归档根目录或相对对话历史目录中的文件）
+        os.makedirs(HISTORY_DIR, exist_ok=True)
+        source_dirs = [tmp_dir, os.path.join(tmp_dir, HISTORY_ARCHIVE_DIR)]
+        if not os.path.isabs(HISTORY_DIR) and os.path.join(tmp_dir, HISTORY_DIR) not in source_dirs:
+            source_dirs.append(os.path.join(tmp_dir, HISTORY_DIR))
+        for source_dir in source_dirs:
+            if not os.path.isdir(source_dir):
+                continue
+            for dialogue_file in [f for f in os.listdir(source_dir) if parse_history_filename(f)]:
+                shutil.copy2(os.path.join(source_dir, dialogue_file), os.path.join(HISTORY_DIR, dialogue_file))
+                logger.info(f"已恢复对话历史: {dialogue_file}")
         
         # 恢复配置文件 (如果存在)
         if os.path.exists(os.path.join(tmp_dir, '.env')):
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+观众并发压测脚本
+对正在运行的服务同时打开 N 个只读观众连接（SSE 或 WebSocket），
+统计建立连接、收到首个事件的耗时以及保持期间收到的事件数，
+用于估算单个 worker 能承载的观众数量
+
+示例:
+    python benchmark_viewers.py C1 --viewers 500 --duration 30
+    python benchmark_viewers.py C1 --viewers 500 --transport ws
+"""
+
+import time
+import json
+import asyncio
+import argparse
+import statistics
+import httpx
+import websockets
+
+async def sse_viewer(client, url, duration, stats):
+    """单个SSE观众：读取事件流直到保持时间结束"""
+    started = time.monotonic()
+    try:
+        async with client.stream("GET", url, headers={"Accept": "text/event-stream"}) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line.startswith("data:"):
+                    if "first" not in stats:
+                        stats["first"] = time.monotonic() - started
+                    stats["events"] = stats.get("events", 0) + 1
+                if time.monotonic() - started > duration:
+                    break
+    except Exception as e:
+        stats["error"] = str(e)
+
+async def ws_viewer(url, duration, stats):
+    """单个WebSocket观众：接收消息直到保持时间结束"""
+    started = time.monotonic()
+    try:
+        async with websockets.connect(url) as ws:
+            while True:
+                remaining = duration - (time.monotonic() - started)
+                if remaining <= 0:
+                    break
+                try:
+                    frame = json.loads(await asyncio.wait_for(ws.recv(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+                if "first" not in stats:
+                    stats["first"] = time.monotonic() - started
+                stats["events"] = stats.get("events", 0) + (len(frame) if isinstance(frame, list) else 1)
+    except Exception as e:
+        stats["error"] = str(e)
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+async def run(args):
+    base = args.base_url.rstrip("/")
+    results = [{} for _ in range(args.viewers)]
+    started = time.monotonic()
+
+    if args.transport == "sse":
+        url = f"{base}/conference/{args.conference_id}/events"
+        limits = httpx.Limits(max_connections=args.viewers, max_keepalive_connections=0)
+        async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+            await asyncio.gather(*(sse_viewer(client, url, args.duration, stats) for stats in results))
+    else:
+        url = base.replace("http", "ws", 1) + f"/ws/{args.conference_id}"
+        await asyncio.gather(*(ws_viewer(url, args.duration, stats) for stats in results))
+
+    elapsed = time.monotonic() - started
+    errors = [stats["error"] for stats in results if "error" in stats]
+    first = [stats["first"] * 1000 for stats in results if "first" in stats]
+    events = sum(stats.get("events", 0) for stats in results)
+
+    print(f"\n传输方式: {args.transport}, 观众数: {args.viewers}, 保持时间: {args.duration}秒, 总耗时: {elapsed:.1f}秒")
+    print(f"成功连接: {args.viewers - len(errors)}, 失败: {len(errors)}")
+    if first:
+        print(f"首个事件耗时(ms): 平均 {statistics.mean(first):.1f}, "
+              f"P50 {percentile(first, 0.5):.1f}, P95 {percentile(first, 0.95):.1f}, 最大 {max(first):.1f}")
+    print(f"共收到事件: {events}")
+    if errors:
+        print(f"错误示例: {errors[0]}")
+
+    # 读取服务端连接指标
+    try:
+        metrics = httpx.get(f"{base}/api/ws/metrics", timeout=5).json()
+        print(f"服务端指标: SSE观众 {metrics.get('sse_viewers')}, SSE丢弃 {metrics.get('sse_dropped')}, "
+              f"WebSocket消息 {metrics.get('messages_in')} / 帧 {metrics.get('frames_out')}")
+    except Exception as e:
+        print(f"获取服务端指标失败: {str(e)}")
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="RoundTable观众并发压测")
+    parser.add_argument("conference_id", help="要观看的会议ID")
+    parser.add_argument("--base-url", default="http://localhost:8000", help="服务地址")
+    parser.add_argument("--viewers", type=int, default=100, help="并发观众数")
+    parser.add_argument("--duration", type=float, default=10, help="每个观众保持连接的秒数")
+    parser.add_argument("--transport", choices=["sse", "ws"], default="sse", help="观众使用的连接方式")
+    asyncio.run(run(parser.parse_args()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+广播后端模块
+ConnectionManager 通过广播后端发布对话消息，再由每个工作进程把收到的消息
+推送给本进程的 WebSocket 连接，使多个 uvicorn worker 或多台节点上的观众
+都能看到任意进程中产生的发言
+
+- memory: 单进程内直接投递（默认）
+- redis:  通过 Redis 发布/订阅在进程和节点之间转发
+"""
+
+import os
+import json
+import asyncio
+import importlib
+import logging
+from dotenv import load_dotenv
+
+# 加载环境变量
+load_dotenv()
+
+logger = logging.getLogger("roundtable.broadcast")
+
+BROADCAST_BACKEND = os.getenv("BROADCAST_BACKEND", "memory")
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+REDIS_CHANNEL_PREFIX = os.getenv("BROADCAST_CHANNEL_PREFIX", "roundtable:conference:")
+
+# 广播后端基类
+class BroadcastBackplane:
+    def __init__(self):
+        self.name = "Base Broadcast Backplane"
+        self._deliver = None
+
+    async def start(self, deliver):
+        """启动后端，deliver(message, conference_id) 为本进程的投递回调"""
+        self._deliver = deliver
+
+    async def publish(self, message, conference_id):
+        """发布一条会议消息"""
+        raise NotImplementedError("子类必须实现publish方法")
+
+    async def stop(self):
+        """停止后端并释放资源"""
+        self._deliver = None
+
+# 进程内广播（单 worker）
+class InMemoryBackplane(BroadcastBackplane):
+    def __init__(self):
+        super().__init__()
+        self.name = "memory"
+
+    async def publish(self, message, conference_id):
+        if self._deliver:
+            await self._deliver(message, conference_id)
+
+# Redis 发布/订阅广播（多 worker / 多节点）
+class RedisBackplane(BroadcastBackplane):
+    def __init__(self, url=REDIS_URL, channel_prefix=REDIS_CHANNEL_PREFIX):
+        super().__init__()
+        self.name = "redis"
+        self.url = url
+        self.channel_prefix = channel_prefix
+        self._redis = None
+        self._listener_task = None
+
+    async def start(self, deliver):
+        await super().start(deliver)
+        try:
+            # 使用条件导入，因为可能没有安装 redis 库
+            redis_asyncio = importlib.import_module("redis.asyncio")
+        except (ImportError, ModuleNotFoundError):
+            raise RuntimeError("Redis 广播后端需要 redis 库，请使用 pip install redis 安装")
+        self._redis = redis_asyncio.from_url(self.url, decode_responses=True)
+        self._listener_task = asyncio.create_task(self._listen())
+        logger.info(f"Redis 广播后端已连接: {self.url}")
+
+    async def publish(self, message, conference_id):
+        payload = json.dumps(message, ensure_ascii=False)
+        await self._redis.publish(f"{self.channel_prefix}{conference_id}", payload)
+
+    async def _listen(self):
+        """订阅所有会议频道，把消息投递给本进程的连接；断线后自动重连"""
+        while True:
+            pubsub = self._redis.pubsub()
+            try:
+                await pubsub.psubscribe(f"{self.channel_prefix}*")
+                async for item in pubsub.listen():
+                    if item.get("type") != "pmessage":
+                        continue
+                    conference_id = item["channel"][len(self.channel_prefix):]
+                    try:
+                        message = json.loads(item["data"])
+                    except (TypeError, ValueError):
+                        logger.warning(f"忽略无法解析的广播消息: {item['data']!r}")
+                        continue
+                    if self._deliver:
+                        await self._deliver(message, conference_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis 订阅出错，2秒后重连: {str(e)}")
+                await asyncio.sleep(2)
+            finally:
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+
+    async def stop(self):
+        if self._listener_task:
+            self._listener_task.cancel()
+            try:
+                await self._listener_task
+            except asyncio.CancelledError:
+                pass
+            self._listener_task = None
+        if self._redis:
+            await self._redis.close()
+            self._redis = None
+        await super().stop()
+
+# 广播后端工厂
+class BroadcastBackplaneFactory:
+    @staticmethod
+    def get_backplane(backend_name=None):
+        """根据名称返回广播后端实例"""
+        backend_name = (backend_name or BROADCAST_BACKEND).lower()
+
+        if backend_name == "memory":
+            return InMemoryBackplane()
+        elif backend_name == "redis":
+            return RedisBackplane()
+        else:
+            logger.warning(f"不支持的广播后端 {backend_name}，使用进程内广播")
+            return InMemoryBackplane()
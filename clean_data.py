@@ -7,42 +7,38 @@
 """
 
 import os
-import sqlite3
 import shutil
 import glob
+from sqlalchemy import text
+from storage import (
+    AGENTS, CONFERENCES, CONVERSATIONS, HISTORY_DIR,
+    SQLiteBackend, connect, get_storage_backend, table_names
+)
 
-def clean_database(db_path, keep_structure=True):
+def clean_database(db_name, keep_structure=True):
     """清理数据库，保留结构但删除所有数据"""
-    if not os.path.exists(db_path):
-        print(f"数据库 {db_path} 不存在，跳过")
+    backend = get_storage_backend()
+    is_sqlite = isinstance(backend, SQLiteBackend)
+    if is_sqlite and not os.path.exists(backend.db_path(db_name)):
+        print(f"数据库 {db_name} 不存在，跳过")
         return
     
-    if keep_structure:
+    if keep_structure or not is_sqlite:
         # 保留结构但删除所有数据
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        
-        # 获取所有表名
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
-        
-        # 删除每个表中的所有数据
-        for table in tables:
-            table_name = table[0]
-            if table_name != "sqlite_sequence":  # 跳过 sqlite 内部表
-                cursor.execute(f"DELETE FROM {table_name};")
-        
-        conn.commit()
-        conn.close()
-        print(f"已清空数据库 {db_path} 中的所有数据")
+        with connect(db_name) as conn:
+            # 删除每个表中的所有数据（table_names 不包含 sqlite 内部表）
+            for table_name in table_names(conn):
+                conn.execute(text(f"DELETE FROM {table_name}"))
+        print(f"已清空数据库 {db_name} 中的所有数据")
     else:
         # 直接删除数据库文件
-        os.remove(db_path)
-        print(f"已删除数据库 {db_path}")
+        backend.dispose()
+        os.remove(backend.db_path(db_name))
+        print(f"已删除数据库 {db_name}")
 
 def clean_dialogue_histories():
     """清理对话历史目录"""
-    history_dir = "dialogue_histories"
+    history_dir = HISTORY_DIR
     if os.path.exists(history_dir):
         # 删除目录中的所有文件
         for file in glob.glob(os.path.join(history_dir, "*")):
@@ -66,9 +62,9 @@ def main():
     print("开始清理数据...")
     
     # 清理数据库
-    clean_database("agents.db", keep_structure=True)
-    clean_database("conferences.db", keep_structure=True)
-    clean_database("conversations.db", keep_structure=True)
+    clean_database(AGENTS, keep_structure=True)
+    clean_database(CONFERENCES, keep_structure=True)
+    clean_database(CONVERSATIONS, keep_structure=True)
     
     # 清理对话历史
     clean_dialogue_histories()
@@ -1,7 +1,13 @@
-import sqlite3
+import os
 import json
+import copy
+import time
+import threading
 from datetime import datetime
+from sqlalchemy import text
 from agent_db import get_agent, list_agents, get_random_agents
+from event_log import CONFERENCE_CREATED, CONFERENCE_ENDED, CONFERENCE_STARTED, PHASE_CHANGED, append_event
+from storage import CONFERENCES, conferences_table, connect, ensure_tables, get_storage_backend, table_exists, table_columns
 
 # 定义 Conference 类
 class Conference:
@@ -16,25 +22,93 @@ class Conference:
         self.current_phase_index = current_phase_index  # 现在保存到数据库
         self.conference_type = conference_type  # 会议类型
 
+# 进程内会议缓存：conference_id -> (Conference, 写入时间)
+# 写操作（save_conference 及基于它的 advance_phase/end_conference、delete_conference）同步更新本进程的缓存，
+# 讨论热路径上的 get_conference 因此无需访问 conferences.db。
+# 其他 worker 的写操作不会通知本进程，缓存条目超过 CONFERENCE_CACHE_TTL 秒后重新从数据库读取；设为 0 关闭缓存。
+# 多节点共享的存储后端（PostgreSQL）上始终关闭缓存，每次都读数据库
+CONFERENCE_CACHE_TTL = float(os.getenv("CONFERENCE_CACHE_TTL", "5"))
+
+_conference_cache = {}
+_conference_cache_lock = threading.Lock()
+
+def conference_cache_enabled():
+    """是否启用会议缓存：TTL 大于 0 且存储后端不被多个节点共享"""
+    return CONFERENCE_CACHE_TTL > 0 and not get_storage_backend().shared
+
+def cache_conference(conference):
+    """将会议对象的副本写入缓存"""
+    if not conference_cache_enabled():
+        return
+    # 深拷贝：agenda、participant_agent_ids 为可变对象，调用方修改后不应影响缓存
+    with _conference_cache_lock:
+        _conference_cache[conference.conference_id] = (copy.deepcopy(conference), time.monotonic())
+
+def get_cached_conference(conference_id):
+    """从缓存读取会议，未命中或已过期返回None"""
+    if not conference_cache_enabled():
+        return None
+    with _conference_cache_lock:
+        entry = _conference_cache.get(conference_id)
+        if entry is not None and time.monotonic() - entry[1] > CONFERENCE_CACHE_TTL:
+            del _conference_cache[conference_id]
+            entry = None
+    return copy.deepcopy(entry[0]) if entry is not None else None
+
+def invalidate_conference_cache(conference_id=None):
+    """使缓存失效；不指定ID时清空整个缓存"""
+    with _conference_cache_lock:
+        if conference_id is None:
+            _conference_cache.clear()
+        else:
+            _conference_cache.pop(conference_id, None)
+
+# 会议数据版本号：创建、更新、删除会议时递增，首页统计等派生缓存据此判断是否失效
+_conferences_version = 0
+
+def mark_conferences_changed():
+    """记录会议数据发生了变化"""
+    global _conferences_version
+    with _conference_cache_lock:
+        _conferences_version += 1
+
+def conferences_version():
+    """当前会议数据版本号"""
+    return _conferences_version
+
+def conference_from_row(row):
+    """将 conferences 表的一行转换为 Conference 对象"""
+    # 检查是否有会议类型字段
+    conference_type = row[8] if len(row) > 8 else "战略讨论"
+    current_phase_index = row[7] if len(row) > 7 else -1
+    
+    conference = Conference(
+        row[0],  # conference_id
+        row[1],  # title
+        json.loads(row[2]),  # agenda
+        json.loads(row[3]),  # participant_agent_ids
+        current_phase_index,  # current_phase_index (默认 -1 如果缺失)
+        conference_type  # conference_type
+    )
+    conference.start_time = row[4]
+    conference.end_time = row[5]
+    conference.summary = row[6]
+    return conference
+
 def with_db_connection(func):
     """数据库连接装饰器，自动管理连接和事务"""
     def wrapper(*args, **kwargs):
-        conn = sqlite3.connect('conferences.db')
-        try:
-            conn.row_factory = sqlite3.Row  # 启用行工厂
-            result = func(conn=conn, *args, **kwargs)
-            conn.commit()
-            return result
-        except Exception as e:
-            conn.rollback()
-            raise e
-        finally:
-            conn.close()
+        # connect 在正常退出时提交，出现异常时回滚
+        with connect(CONFERENCES) as conn:
+            return func(conn=conn, *args, **kwargs)
     return wrapper
 
 def save_conference(conference):
-    """保存会议更新到数据库的公共接口"""
-    return _save_conference(conference)
+    """保存会议更新到数据库的公共接口（同时写入缓存）"""
+    result = _save_conference(conference)
+    cache_conference(conference)
+    mark_conferences_changed()
+    return result
 
 @with_db_connection
 def _save_conference(conference, conn=None):
@@ -44,66 +118,60 @@ def _save_conference(conference, conn=None):
         conference: 会议对象
         conn: 数据库连接, 由装饰器提供
     """
-    cursor = conn.cursor()
-    cursor.execute('''
+    conn.execute(text('''
         UPDATE conferences SET
-            title = ?,
-            agenda = ?,
-            participant_agent_ids = ?,
-            start_time = ?,
-            end_time = ?,
-            summary = ?,
-            current_phase_index = ?,
-            conference_type = ?
-        WHERE conference_id = ?
-    ''', (
-        conference.title,
-        json.dumps(conference.agenda),
-        json.dumps(conference.participant_agent_ids),
-        conference.start_time,
-        conference.end_time,
-        conference.summary,
-        conference.current_phase_index,
-        conference.conference_type,
-        conference.conference_id
-    ))
+            title = :title,
+            agenda = :agenda,
+            participant_agent_ids = :participant_agent_ids,
+            start_time = :start_time,
+            end_time = :end_time,
+            summary = :summary,
+            current_phase_index = :current_phase_index,
+            conference_type = :conference_type
+        WHERE conference_id = :conference_id
+    '''), {
+        "title": conference.title,
+        "agenda": json.dumps(conference.agenda),
+        "participant_agent_ids": json.dumps(conference.participant_agent_ids),
+        "start_time": conference.start_time,
+        "end_time": conference.end_time,
+        "summary": conference.summary,
+        "current_phase_index": conference.current_phase_index,
+        "conference_type": conference.conference_type,
+        "conference_id": conference.conference_id
+    })
 
 # 创建会议的函数
 @with_db_connection
 def init_conference_db(conn):
     """初始化会议数据库表结构"""
-    cursor = conn.cursor()
-    
-    # 检查是否需要添加conference_type列
-    cursor.execute("PRAGMA table_info(conferences)")
-    columns = [row[1] for row in cursor.fetchall()]
-    
     # 创建会议表（带NOT NULL约束）
-    if not 'conferences' in [table[0] for table in cursor.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()]:
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS conferences (
-                conference_id TEXT PRIMARY KEY NOT NULL,
-                title TEXT NOT NULL,
-                agenda TEXT NOT NULL,
-                participant_agent_ids TEXT NOT NULL,
-                start_time TEXT,
-                end_time TEXT,
-                summary TEXT,
-                current_phase_index INTEGER DEFAULT -1 NOT NULL,
-                conference_type TEXT DEFAULT '战略讨论' NOT NULL
-            )
-        ''')
-    elif 'conference_type' not in columns:
+    if not table_exists(conn, 'conferences'):
+        ensure_tables(conn, conferences_table)
+    elif 'conference_type' not in table_columns(conn, 'conferences'):
         # 如果表已存在但缺少conference_type列，添加它
-        cursor.execute('ALTER TABLE conferences ADD COLUMN conference_type TEXT DEFAULT "战略讨论" NOT NULL')
+        conn.execute(text("ALTER TABLE conferences ADD COLUMN conference_type TEXT DEFAULT '战略讨论' NOT NULL"))
+
+def create_conference(conference_id, title, topic, num_agents, conference_type="战略讨论"):
+    """创建会议的公共接口：事务提交后再更新数据版本号并追加创建事件"""
+    conference = _create_conference(conference_id, title, topic, num_agents, conference_type)
+    # 在事务提交后递增版本号：提交前递增时，并发的首页统计可能以新版本号缓存提交前的数据
+    mark_conferences_changed()
+    append_event(conference.conference_id, CONFERENCE_CREATED, payload={
+        "title": conference.title,
+        "conference_type": conference.conference_type,
+        "agenda": conference.agenda,
+        "participant_agent_ids": conference.participant_agent_ids
+    })
+
+    print(f"会议 '{conference.title}' 创建成功！")
+    return conference
 
 @with_db_connection
-def create_conference(conference_id, title, topic, num_agents, conference_type="战略讨论", conn=None):
-    cursor = conn.cursor()
-    
+def _create_conference(conference_id, title, topic, num_agents, conference_type="战略讨论", conn=None):
     # 检查会议是否已存在
-    cursor.execute('SELECT conference_id FROM conferences WHERE conference_id = ?', (conference_id,))
-    if cursor.fetchone():
+    if conn.execute(text('SELECT conference_id FROM conferences WHERE conference_id = :conference_id'),
+                    {"conference_id": conference_id}).fetchone():
         raise ValueError(f"会议ID {conference_id} 已存在")
 
     # 简化议程 - 只有一个阶段
@@ -122,26 +190,22 @@ def create_conference(conference_id, title, topic, num_agents, conference_type="
     conference = Conference(conference_id, title, agenda, agent_ids, -1, conference_type)
     
     # 确保表中有conference_type列
-    cursor.execute("PRAGMA table_info(conferences)")
-    columns = [row[1] for row in cursor.fetchall()]
-    if 'conference_type' not in columns:
-        cursor.execute('ALTER TABLE conferences ADD COLUMN conference_type TEXT DEFAULT "战略讨论" NOT NULL')
+    if 'conference_type' not in table_columns(conn, 'conferences'):
+        conn.execute(text("ALTER TABLE conferences ADD COLUMN conference_type TEXT DEFAULT '战略讨论' NOT NULL"))
     
     # 插入会议数据
-    cursor.execute('''
+    conn.execute(text('''
         INSERT INTO conferences 
         (conference_id, title, agenda, participant_agent_ids, current_phase_index, conference_type)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        conference.conference_id,
-        conference.title,
-        json.dumps(conference.agenda),
-        json.dumps(conference.participant_agent_ids),
-        conference.current_phase_index,
-        conference.conference_type
-    ))
-
-    print(f"会议 '{conference.title}' 创建成功！")
+        VALUES (:conference_id, :title, :agenda, :participant_agent_ids, :current_phase_index, :conference_type)
+    '''), {
+        "conference_id": conference.conference_id,
+        "title": conference.title,
+        "agenda": json.dumps(conference.agenda),
+        "participant_agent_ids": json.dumps(conference.participant_agent_ids),
+        "current_phase_index": conference.current_phase_index,
+        "conference_type": conference.conference_type
+    })
     return conference
 
 def start_conference(conference_id):
@@ -156,48 +220,36 @@ def start_conference(conference_id):
     conference.current_phase_index = 0
     
     save_conference(conference)
+    append_event(conference_id, CONFERENCE_STARTED, phase_id=0, payload={"start_time": conference.start_time})
     
     print(f"Conference '{conference.title}' has started!")
     return True
 
-@with_db_connection
-def get_conference(conference_id, conn):
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM conferences WHERE conference_id = ?', (conference_id,))
-    row = cursor.fetchone()
+def get_conference(conference_id):
+    """获取会议，优先从进程内缓存读取
+
+    返回缓存对象的深拷贝，调用方修改属性后需通过 save_conference 写回
+    """
+    cached = get_cached_conference(conference_id)
+    if cached is not None:
+        return cached
 
-    if row:
-        # 检查是否有会议类型字段
-        conference_type = row[8] if len(row) > 8 else "战略讨论"
-        current_phase_index = row[7] if len(row) > 7 else -1
-        
-        conference = Conference(
-            row[0],  # conference_id
-            row[1],  # title
-            json.loads(row[2]),  # agenda
-            json.loads(row[3]),  # participant_agent_ids
-            current_phase_index,  # current_phase_index (默认 -1 如果缺失)
-            conference_type  # conference_type
-        )
-        conference.start_time = row[4]
-        conference.end_time = row[5]
-        conference.summary = row[6]
-        return conference
-    return None
+    conference = _load_conference(conference_id)
+    if conference:
+        cache_conference(conference)
+    return conference
+
+@with_db_connection
+def _load_conference(conference_id, conn):
+    """从数据库读取会议"""
+    row = conn.execute(text('SELECT * FROM conferences WHERE conference_id = :conference_id'),
+                       {"conference_id": conference_id}).fetchone()
+    return conference_from_row(row) if row else None
 
 @with_db_connection
 def list_conferences(conn):
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM conferences')
-    return [
-        Conference(
-            row['conference_id'],
-            row['title'],
-            json.loads(row['agenda']),
-            json.loads(row['participant_agent_ids']),
-            row['current_phase_index']
-        ) for row in cursor.fetchall()
-    ]
+    rows = conn.execute(text('SELECT * FROM conferences')).fetchall()
+    return [conference_from_row(row) for row in rows]
 
 def advance_phase(conference_id):
     conference = get_conference(conference_id)
@@ -208,6 +260,7 @@ def advance_phase(conference_id):
     conference.current_phase_index += 1
     
     save_conference(conference)
+    append_event(conference_id, PHASE_CHANGED, phase_id=conference.current_phase_index)
     
     return conference
 
@@ -229,33 +282,40 @@ def end_conference(conference_id):
     # 可以在这里生成会议总结
     
     save_conference(conference)
+    append_event(conference_id, CONFERENCE_ENDED, phase_id=conference.current_phase_index,
+                 payload={"end_time": conference.end_time})
     
     return conference
 
-@with_db_connection
-def delete_conference(conference_id, conn=None):
+def delete_conference(conference_id):
     """
     从数据库中删除指定ID的会议
     
     参数:
         conference_id: 要删除的会议ID
-        conn: 数据库连接(由装饰器提供)
     
     返回:
         布尔值，表示是否成功删除
     """
-    cursor = conn.cursor()
-    
+    deleted = _delete_conference(conference_id)
+    # 事务提交后再使缓存失效并递增版本号，避免并发读取在提交前重新缓存旧数据
+    invalidate_conference_cache(conference_id)
+    mark_conferences_changed()
+    return deleted
+
+@with_db_connection
+def _delete_conference(conference_id, conn=None):
+    """在事务中删除会议记录，返回是否删除成功"""
     # 检查会议是否存在
-    cursor.execute('SELECT conference_id FROM conferences WHERE conference_id = ?', (conference_id,))
-    if not cursor.fetchone():
+    params = {"conference_id": conference_id}
+    if not conn.execute(text('SELECT conference_id FROM conferences WHERE conference_id = :conference_id'), params).fetchone():
         raise ValueError(f"会议ID {conference_id} 不存在")
     
     # 执行删除操作
-    cursor.execute('DELETE FROM conferences WHERE conference_id = ?', (conference_id,))
+    result = conn.execute(text('DELETE FROM conferences WHERE conference_id = :conference_id'), params)
     
     # 检查删除是否成功
-    if cursor.rowcount > 0:
+    if result.rowcount > 0:
         print(f"会议 {conference_id} 已成功删除")
         return True
     else:
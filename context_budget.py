@@ -0,0 +1,175 @@
+"""
+提示词上下文预算
+按模型的上下文上限（扣除输出 token 和安全余量）为提示词中的可变部分（搜索信息、上一位发言、对话历史等）分配 token 预算，
+超出时按段落裁剪，不再把完整的搜索结果和历史原样塞进提示词。
+
+token 数用本地规则估算，无需分词器：汉字及全角标点约 1 个 token，英文和数字约每 4 个字符 1 个 token，
+其余符号约 0.5 个 token。对中英文混合文本的估算略偏高，留出余量。
+
+用法：
+    budget = PromptBudget(model_name, reserve_tokens=max_tokens)
+    info = budget.section("search", latest_info, weight=3)
+    history = budget.section("history", dialogue_text, weight=2, keep="tail")
+    prompt = budget.render(f"...{info}...{history}...")
+"""
+
+import os
+import re
+import math
+
+# 默认上下文上限（token），未在 CONTEXT_TOKEN_LIMITS 中配置的模型使用该值
+CONTEXT_TOKEN_LIMIT = int(os.getenv("CONTEXT_TOKEN_LIMIT", "16000"))
+# 按模型名称前缀配置上下文上限，格式: 模型前缀:token数,模型前缀:token数（例如 gpt-4o:128000,deepseek:64000）
+CONTEXT_TOKEN_LIMITS = os.getenv("CONTEXT_TOKEN_LIMITS", "")
+# 估算误差的安全余量（占上限的比例）
+CONTEXT_SAFETY_MARGIN = float(os.getenv("CONTEXT_SAFETY_MARGIN", "0.1"))
+
+TRUNCATED_MARK = "……（已截断）"
+
+_CJK = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+_SYMBOL = re.compile(r"[^\sA-Za-z0-9_　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+def estimate_tokens(text):
+    """估算文本的 token 数（中英文混合）"""
+    if not text:
+        return 0
+    cjk = len(_CJK.findall(text))
+    words = sum(math.ceil(len(word) / 4) for word in _WORD.findall(text))
+    symbols = len(_SYMBOL.findall(text))
+    return cjk + words + math.ceil(symbols / 2)
+
+def parse_context_limits(limits=None):
+    """解析按模型配置的上下文上限，返回 {模型前缀: token数}"""
+    limits = CONTEXT_TOKEN_LIMITS if limits is None else limits
+    parsed = {}
+    for item in limits.split(","):
+        # 模型名称本身可能包含冒号（如 anthropic/claude-3-haiku:20240307），以最后一个冒号分隔
+        model, _, tokens = item.strip().rpartition(":")
+        if not model:
+            continue
+        try:
+            parsed[model.strip()] = int(tokens)
+        except ValueError:
+            print(f"无效的上下文上限配置 {item}，已忽略")
+    return parsed
+
+_context_limits = parse_context_limits()
+
+def context_limit(model_name):
+    """模型的上下文上限：取最长匹配的模型前缀，没有匹配时使用默认值"""
+    matched = [prefix for prefix in _context_limits if model_name and model_name.startswith(prefix)]
+    if not matched:
+        return CONTEXT_TOKEN_LIMIT
+    return _context_limits[max(matched, key=len)]
+
+def trim_head(text, budget):
+    """保留开头不超过预算的内容，尽量在段落或句子边界截断"""
+    if estimate_tokens(text) <= budget:
+        return text
+    if budget <= estimate_tokens(TRUNCATED_MARK):
+        return ""
+
+    kept = []
+    used = estimate_tokens(TRUNCATED_MARK)
+    for paragraph in text.split("\n"):
+        cost = estimate_tokens(paragraph) + 1
+        if used + cost > budget:
+            if not kept:
+                # 第一段就超出预算时按比例截取
+                kept.append(_cut(paragraph, budget - used))
+            break
+        kept.append(paragraph)
+        used += cost
+    return "\n".join(kept).rstrip() + TRUNCATED_MARK
+
+def trim_tail(text, budget):
+    """保留末尾不超过预算的内容（用于对话历史，最近的发言优先）"""
+    if estimate_tokens(text) <= budget:
+        return text
+    if budget <= estimate_tokens(TRUNCATED_MARK):
+        return ""
+
+    kept = []
+    used = estimate_tokens(TRUNCATED_MARK)
+    for paragraph in reversed(text.split("\n")):
+        cost = estimate_tokens(paragraph) + 1
+        if used + cost > budget:
+            if not kept:
+                kept.append(_cut(paragraph[::-1], budget - used)[::-1])
+            break
+        kept.append(paragraph)
+        used += cost
+    return TRUNCATED_MARK + "\n".join(reversed(kept)).lstrip()
+
+def _cut(text, budget):
+    """按比例截取开头，使估算值不超过预算"""
+    if budget <= 0:
+        return ""
+    tokens = estimate_tokens(text)
+    length = max(1, int(len(text) * budget / tokens))
+    while length > 0 and estimate_tokens(text[:length]) > budget:
+        length = int(length * 0.9)
+    return text[:length]
+
+def allocate(total, demands, weights):
+    """
+    按权重把 total 个 token 分配给各部分；需求低于份额的部分只取所需，余量按权重分给其他部分
+    demands / weights 为 {名称: 数值}，返回 {名称: 预算}
+    """
+    allocation = {}
+    remaining = dict(demands)
+    budget = max(total, 0)
+    while remaining:
+        weight_sum = sum(weights[name] for name in remaining) or 1
+        satisfied = {name: demand for name, demand in remaining.items()
+                     if demand <= budget * weights[name] / weight_sum}
+        if not satisfied:
+            for name in remaining:
+                allocation[name] = int(budget * weights[name] / weight_sum)
+            break
+        for name, demand in satisfied.items():
+            allocation[name] = demand
+            budget -= demand
+            del remaining[name]
+    return allocation
+
+class PromptBudget:
+    """单个提示词的预算：先登记可变部分（返回占位符），渲染时按剩余预算裁剪后替换占位符"""
+
+    def __init__(self, model_name, reserve_tokens=0, limit=None):
+        self.model_name = model_name
+        self.limit = limit or context_limit(model_name)
+        # 输出 token 最多占用上限的一半，避免 MAX_TOKENS 配置过大时提示词没有空间
+        self.reserve_tokens = min(reserve_tokens or 0, self.limit // 2)
+        self._sections = {}
+
+    def section(self, name, text, weight=1, keep="head"):
+        """登记一个可变部分，keep 为 head（保留开头，如搜索信息）或 tail（保留末尾，如对话历史）"""
+        placeholder = f"\x00{name}\x00"
+        self._sections[name] = {"text": text or "", "weight": weight, "keep": keep, "placeholder": placeholder}
+        return placeholder
+
+    def available(self, fixed_text=""):
+        """可变部分可用的 token 数"""
+        usable = int(self.limit * (1 - CONTEXT_SAFETY_MARGIN)) - self.reserve_tokens
+        return usable - estimate_tokens(fixed_text)
+
+    def render(self, template):
+        """按预算裁剪各部分并替换模板中的占位符"""
+        fixed = template
+        for section in self._sections.values():
+            fixed = fixed.replace(section["placeholder"], "")
+
+        demands = {name: estimate_tokens(section["text"]) for name, section in self._sections.items()}
+        budgets = allocate(self.available(fixed), demands,
+                           {name: section["weight"] for name, section in self._sections.items()})
+
+        prompt = template
+        for name, section in self._sections.items():
+            text = section["text"]
+            if demands[name] > budgets[name]:
+                text = trim_tail(text, budgets[name]) if section["keep"] == "tail" else trim_head(text, budgets[name])
+                print(f"提示词上下文预算：{name} 部分约 {demands[name]} token，裁剪至 {budgets[name]} token（模型 {self.model_name}）")
+            prompt = prompt.replace(section["placeholder"], text)
+        return prompt
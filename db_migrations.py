@@ -4,55 +4,54 @@
 """
 
 import os
-import sqlite3
 import json
 from datetime import datetime
+from sqlalchemy import text, Table, Column, Integer, Text
+from sqlalchemy.exc import SQLAlchemyError
 from version import get_db_schema_version
+from storage import CONVERSATIONS, metadata, conversations_table, connect, ensure_tables, table_exists
 
 # 迁移历史表名
 MIGRATION_TABLE = "db_migrations"
 
+migration_table = Table(
+    MIGRATION_TABLE, metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("version", Text, nullable=False),
+    Column("applied_at", Text, nullable=False),
+    Column("description", Text),
+    sqlite_autoincrement=True,
+)
+
 def init_migration_table(conn):
     """初始化迁移历史表"""
-    cursor = conn.cursor()
-    cursor.execute(f'''
-        CREATE TABLE IF NOT EXISTS {MIGRATION_TABLE} (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            version TEXT NOT NULL,
-            applied_at TIMESTAMP NOT NULL,
-            description TEXT
-        )
-    ''')
-    conn.commit()
+    ensure_tables(conn, migration_table)
 
 def get_current_db_version(conn):
     """获取数据库当前版本"""
-    cursor = conn.cursor()
-    try:
-        cursor.execute(f"SELECT version FROM {MIGRATION_TABLE} ORDER BY id DESC LIMIT 1")
-        result = cursor.fetchone()
-        return result[0] if result else "0.0"
-    except sqlite3.OperationalError:
+    if not table_exists(conn, MIGRATION_TABLE):
         # 表不存在，返回初始版本
         return "0.0"
+    result = conn.execute(text(f"SELECT version FROM {MIGRATION_TABLE} ORDER BY id DESC LIMIT 1")).fetchone()
+    return result[0] if result else "0.0"
 
 def record_migration(conn, version, description):
     """记录迁移历史"""
-    cursor = conn.cursor()
-    cursor.execute(
-        f"INSERT INTO {MIGRATION_TABLE} (version, applied_at, description) VALUES (?, ?, ?)",
-        (version, datetime.now().isoformat(), description)
+    conn.execute(
+        text(f"INSERT INTO {MIGRATION_TABLE} (version, applied_at, description) VALUES (:version, :applied_at, :description)"),
+        {"version": version, "applied_at": datetime.now().isoformat(), "description": description}
     )
-    conn.commit()
 
 def get_all_migrations(conn):
     """获取所有迁移历史"""
-    cursor = conn.cursor()
-    try:
-        cursor.execute(f"SELECT id, version, applied_at, description FROM {MIGRATION_TABLE} ORDER BY id")
-        return cursor.fetchall()
-    except sqlite3.OperationalError:
+    if not table_exists(conn, MIGRATION_TABLE):
         return []
+    return conn.execute(text(f"SELECT id, version, applied_at, description FROM {MIGRATION_TABLE} ORDER BY id")).fetchall()
+
+def split_sql_script(sql):
+    """将迁移脚本拆分为单条语句（去掉注释行）"""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
 
 # 迁移脚本字典
 # 键是版本号，值是包含SQL语句和描述的元组
@@ -122,15 +121,15 @@ MIGRATIONS = {
     )
 }
 
-def run_migrations(db_path="conversations.db"):
+def run_migrations(db_name=CONVERSATIONS):
     """运行所有待执行的迁移"""
-    conn = sqlite3.connect(db_path)
-    
     # 确保迁移表存在
-    init_migration_table(conn)
+    with connect(db_name) as conn:
+        init_migration_table(conn)
     
     # 获取当前数据库版本
-    current_version = get_current_db_version(conn)
+    with connect(db_name) as conn:
+        current_version = get_current_db_version(conn)
     print(f"当前数据库版本: {current_version}")
     
     # 目标版本
@@ -140,7 +139,6 @@ def run_migrations(db_path="conversations.db"):
     # 如果当前版本已经是最新
     if current_version == target_version:
         print("数据库已是最新版本，无需迁移")
-        conn.close()
         return
     
     # 获取所有需要执行的迁移
@@ -151,31 +149,44 @@ def run_migrations(db_path="conversations.db"):
     
     if not versions_to_apply:
         print("没有需要执行的迁移")
-        conn.close()
         return
     
-    # 执行迁移
+    # 执行迁移（每个版本一个事务，失败时自动回滚）
     for version in versions_to_apply:
         sql, description = MIGRATIONS[version]
         print(f"正在应用迁移 {version}: {description}")
         try:
-            cursor = conn.cursor()
-            cursor.executescript(sql)
-            conn.commit()
-            record_migration(conn, version, description)
+            with connect(db_name) as conn:
+                if conn.dialect.name == "sqlite":
+                    for statement in split_sql_script(sql):
+                        conn.exec_driver_sql(statement)
+                else:
+                    # 迁移脚本使用 SQLite 语法；共享后端的表结构由 storage 模块的元数据创建，只记录版本
+                    print(f"{conn.dialect.name} 后端跳过 SQLite 迁移脚本，仅记录版本")
+                record_migration(conn, version, description)
             print(f"迁移 {version} 应用成功")
-        except Exception as e:
-            conn.rollback()
+        except SQLAlchemyError as e:
             print(f"迁移 {version} 失败: {str(e)}")
             raise
     
     print(f"所有迁移完成，当前数据库版本: {target_version}")
-    conn.close()
 
-def show_migration_history(db_path="conversations.db"):
+# 已被 storage 中新索引取代的旧索引
+LEGACY_INDEXES = ["idx_conversations_conference_phase"]
+
+def sync_indexes(db_name=CONVERSATIONS, tables=(conversations_table,)):
+    """为已存在的表补建 storage 中定义的索引，并删除被取代的旧索引（需在迁移脚本之后运行）"""
+    with connect(db_name) as conn:
+        for table in tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+        for index_name in LEGACY_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {index_name}"))
+
+def show_migration_history(db_name=CONVERSATIONS):
     """显示迁移历史"""
-    conn = sqlite3.connect(db_path)
-    migrations = get_all_migrations(conn)
+    with connect(db_name) as conn:
+        migrations = get_all_migrations(conn)
     
     if not migrations:
         print("没有迁移历史记录")
@@ -183,8 +194,6 @@ def show_migration_history(db_path="conversations.db"):
         print("迁移历史:")
         for migration in migrations:
             print(f"ID: {migration[0]}, 版本: {migration[1]}, 时间: {migration[2]}, 描述: {migration[3]}")
-    
-    conn.close()
 
 if __name__ == "__main__":
     # 当作为脚本执行时，运行迁移
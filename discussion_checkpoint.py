@@ -0,0 +1,238 @@
+"""
+讨论检查点
+start_phase_discussion 把讨论流程的状态（所处环节、步骤、轮次、本轮发言顺序、下一位发言者、
+主持人、搜索结果和本环节已生成的发言）在每次发言后写入 discussion_checkpoints 表。
+
+进程在讨论中途退出后，重新调用 start_phase_discussion（或应用启动时自动恢复）会从最后完成的发言继续，
+已完成的 LLM 调用不会重复执行；status 为 completed 的检查点表示该阶段讨论已完整结束。
+
+检查点记录写入者（主机名:进程号:实例标识）。同一主机上写入进程已退出的检查点可立即接管，
+其他主机写入的检查点在超过 DISCUSSION_CHECKPOINT_STALE_SECONDS 未更新后才会被接管。
+接管（acquire_checkpoint）和新建（create_checkpoint）都是数据库上的条件写入，多个进程或节点同时恢复同一场讨论时只有一个成功；
+之后的保存只更新写入者仍是本进程的检查点，检查点被其他进程接管时抛出 CheckpointLost，本进程停止续写。
+
+服务关闭前进入排空模式（begin_drain）：不再启动新的讨论，进行中的讨论完成当前发言后停止，
+并释放检查点的写入者，新进程无需等待即可接管。
+
+用户中断（request_stop）同样在两次发言之间生效：检查点标记为用户中断并释放写入者，
+应用启动时不会自动恢复，用户继续讨论时从中断处接着发言
+"""
+
+import os
+import json
+import uuid
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from storage import CONVERSATIONS, discussion_checkpoints_table, connect, ensure_tables, insert_or_ignore
+
+# 检查点状态
+RUNNING = "running"
+COMPLETED = "completed"
+
+# 其他主机写入的检查点多久未更新视为中断（秒）
+DISCUSSION_CHECKPOINT_STALE_SECONDS = float(os.getenv("DISCUSSION_CHECKPOINT_STALE_SECONDS", "300"))
+
+# 当前进程的写入者标识；进程号可能被重启后的新进程复用，附加随机实例标识加以区分
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 本进程中正在执行的讨论 (conference_id, phase_id)
+_active_discussions = set()
+_active_lock = threading.Lock()
+
+# 用户请求中断的讨论 (conference_id, phase_id)，与 _active_discussions 共用锁
+_stop_requests = set()
+
+# 排空模式标记
+_draining = threading.Event()
+
+class DiscussionDrained(Exception):
+    """服务正在关闭，讨论在发言之间停止（状态已保存在检查点中）"""
+
+class DiscussionInterrupted(Exception):
+    """用户中断了讨论，讨论在发言之间停止（状态已保存在检查点中）"""
+
+class CheckpointLost(Exception):
+    """检查点已被其他进程接管（或删除），本进程不能继续写入"""
+
+def init_discussion_checkpoints():
+    """创建检查点表"""
+    with connect(CONVERSATIONS) as conn:
+        ensure_tables(conn, discussion_checkpoints_table)
+
+def load_checkpoint(conference_id, phase_id):
+    """读取检查点，返回 {"status", "owner", "state", "updated_at"}，不存在时返回None"""
+    table = discussion_checkpoints_table
+    with connect(CONVERSATIONS) as conn:
+        row = conn.execute(
+            select(table.c.status, table.c.owner, table.c.state, table.c.updated_at)
+            .where(table.c.conference_id == conference_id, table.c.phase_id == phase_id)
+        ).fetchone()
+    if not row:
+        return None
+    return {"status": row[0], "owner": row[1], "state": json.loads(row[2]), "updated_at": row[3]}
+
+def create_checkpoint(conference_id, phase_id, state):
+    """为新讨论创建检查点并成为写入者；检查点已存在（其他进程已启动该讨论）时返回False"""
+    with connect(CONVERSATIONS) as conn:
+        return insert_or_ignore(conn, discussion_checkpoints_table, {
+            "conference_id": conference_id, "phase_id": phase_id, "status": RUNNING, "owner": WORKER_ID,
+            "state": json.dumps(state, ensure_ascii=False), "updated_at": datetime.now().isoformat()
+        }) == 1
+
+def acquire_checkpoint(conference_id, phase_id, checkpoint):
+    """
+    接管读取到的检查点：仅当写入者和更新时间仍与读取时一致时把写入者改为本进程，
+    其他进程已先接管或原写入者又写入过时返回False
+    """
+    table = discussion_checkpoints_table
+    observed_owner = table.c.owner.is_(None) if checkpoint["owner"] is None else table.c.owner == checkpoint["owner"]
+    with connect(CONVERSATIONS) as conn:
+        return conn.execute(
+            update(table)
+            .where(table.c.conference_id == conference_id, table.c.phase_id == phase_id, table.c.status == RUNNING,
+                   observed_owner, table.c.updated_at == checkpoint["updated_at"])
+            .values(owner=WORKER_ID, updated_at=datetime.now().isoformat())
+        ).rowcount == 1
+
+def save_checkpoint(conference_id, phase_id, state, status=RUNNING, conn=None):
+    """
+    更新本进程持有的检查点；传入 conn 时在该连接的事务中写入
+    检查点已被其他进程接管时抛出 CheckpointLost（同一事务中的其他写入随之回滚）
+    """
+    if conn is None:
+        with connect(CONVERSATIONS) as conn:
+            return save_checkpoint(conference_id, phase_id, state, status, conn)
+    table = discussion_checkpoints_table
+    updated = conn.execute(
+        update(table)
+        .where(table.c.conference_id == conference_id, table.c.phase_id == phase_id, table.c.owner == WORKER_ID)
+        .values(status=status, state=json.dumps(state, ensure_ascii=False), updated_at=datetime.now().isoformat())
+    ).rowcount
+    if updated != 1:
+        raise CheckpointLost(f"会议 {conference_id} 阶段 {phase_id} 的检查点已由其他进程接管")
+
+def complete_checkpoint(conference_id, phase_id, state, conn=None):
+    """标记讨论已完成；发言已在对话历史中，检查点只保留主持人和参与者，不再保存发言和搜索结果"""
+    save_checkpoint(conference_id, phase_id, {
+        "moderator_id": state.get("moderator_id"),
+        "other_agent_ids": state.get("other_agent_ids", [])
+    }, status=COMPLETED, conn=conn)
+
+def owner_alive(owner):
+    """判断写入者进程是否仍在运行：True / False，无法判断（其他主机）时返回None"""
+    try:
+        host, pid, _ = owner.split(":")
+        pid = int(pid)
+    except (AttributeError, ValueError):
+        return False
+    if owner == WORKER_ID:
+        return True
+    if host != socket.gethostname():
+        return None
+    if pid == os.getpid():
+        # 进程号已被当前进程复用，原进程必然已退出
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def is_resumable(checkpoint):
+    """检查点是否属于中断的讨论（写入者已退出，或其他主机写入且长时间未更新）"""
+    if checkpoint is None or checkpoint["status"] != RUNNING:
+        return False
+    alive = owner_alive(checkpoint["owner"])
+    if alive is None:
+        stale_before = (datetime.now() - timedelta(seconds=DISCUSSION_CHECKPOINT_STALE_SECONDS)).isoformat()
+        return checkpoint["updated_at"] < stale_before
+    return not alive
+
+def can_resume(checkpoint):
+    """
+    调用方已通过 claim_discussion 登记后判断能否续写检查点（续写前还需 acquire_checkpoint 成功）：
+    本进程写入的检查点此时没有线程在执行（上次执行因异常或超时中止），其余按 is_resumable 判断
+    """
+    if checkpoint is None or checkpoint["status"] != RUNNING:
+        return False
+    return checkpoint["owner"] == WORKER_ID or is_resumable(checkpoint)
+
+def list_interrupted_discussions():
+    """列出进程退出时中断、可自动恢复的讨论，返回 (conference_id, phase_id) 列表"""
+    table = discussion_checkpoints_table
+    with connect(CONVERSATIONS) as conn:
+        rows = conn.execute(
+            select(table.c.conference_id, table.c.phase_id, table.c.owner, table.c.updated_at, table.c.state)
+            .where(table.c.status == RUNNING)
+        ).fetchall()
+    # 用户中断的讨论不自动恢复，等待用户继续
+    return [
+        (row[0], row[1]) for row in rows
+        if is_resumable({"status": RUNNING, "owner": row[2], "updated_at": row[3]})
+        and not json.loads(row[4]).get("interrupted")
+    ]
+
+def claim_discussion(conference_id, phase_id):
+    """在本进程中登记正在执行的讨论，已在执行时返回False（跨进程的互斥由检查点的写入者保证）"""
+    with _active_lock:
+        key = (conference_id, phase_id)
+        if key in _active_discussions:
+            return False
+        _active_discussions.add(key)
+        return True
+
+def release_discussion(conference_id, phase_id):
+    with _active_lock:
+        _active_discussions.discard((conference_id, phase_id))
+        _stop_requests.discard((conference_id, phase_id))
+
+def request_stop(conference_id, phase_id):
+    """请求本进程中正在执行的讨论在下一次发言前停止，没有正在执行的讨论时返回False"""
+    with _active_lock:
+        key = (conference_id, phase_id)
+        if key not in _active_discussions:
+            return False
+        _stop_requests.add(key)
+        return True
+
+def active_discussions():
+    """本进程中正在执行的讨论 (conference_id, phase_id) 列表"""
+    with _active_lock:
+        return list(_active_discussions)
+
+def release_checkpoint(conference_id=None, phase_id=None):
+    """
+    清除本进程写入的进行中检查点的写入者，其他进程可立即接管；不指定会议时释放本进程的全部检查点
+    返回释放的检查点数
+    """
+    table = discussion_checkpoints_table
+    statement = update(table).where(table.c.status == RUNNING, table.c.owner == WORKER_ID)
+    if conference_id is not None:
+        statement = statement.where(table.c.conference_id == conference_id, table.c.phase_id == phase_id)
+    with connect(CONVERSATIONS) as conn:
+        return conn.execute(statement.values(owner=None)).rowcount
+
+# 排空模式
+
+def begin_drain():
+    _draining.set()
+
+def is_draining():
+    return _draining.is_set()
+
+def check_drain():
+    """在两次发言之间调用，排空模式下抛出 DiscussionDrained"""
+    if _draining.is_set():
+        raise DiscussionDrained()
+
+def check_stop(conference_id, phase_id):
+    """在两次发言之间调用：排空模式下抛出 DiscussionDrained，用户请求中断时抛出 DiscussionInterrupted"""
+    check_drain()
+    with _active_lock:
+        if (conference_id, phase_id) in _stop_requests:
+            _stop_requests.discard((conference_id, phase_id))
+            raise DiscussionInterrupted()
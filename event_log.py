@@ -0,0 +1,183 @@
+"""
+会议事件日志
+conference_events 表按单调递增的 seq 记录会议的全部变化：创建、开始、阶段切换、结束，
+以及发言、用户提问和系统提示。其余数据都是它的投影：
+
+- conversations 表：发言类事件在同一事务中写入，记录ID即事件 seq，WebSocket / SSE 回放和分页沿用该ID
+- 对话历史 JSON 文件：阶段讨论结束、用户提问处理完或讨论被中断时，由 conversations 投影导出的快照；
+  讨论流程读取对话历史时使用 load_phase_dialogue，不读取文件
+- conferences 表：会议当前状态的快照
+
+事件提交后依次调用已注册的监听器（应用用它向 WebSocket / SSE 观众广播），
+监听器在写入事件的线程中执行，需要自行切换到事件循环
+"""
+
+import json
+import logging
+from datetime import datetime
+from sqlalchemy import insert, text
+from storage import CONVERSATIONS, conference_events_table, conversations_table, connect, ensure_tables
+
+logger = logging.getLogger("roundtable.event_log")
+
+# 事件类型
+CONFERENCE_CREATED = "conference_created"
+CONFERENCE_STARTED = "conference_started"
+PHASE_CHANGED = "phase_changed"
+CONFERENCE_ENDED = "conference_ended"
+SPEECH = "speech"
+QUESTION = "question"
+SYSTEM = "system"
+
+# 投影到 conversations 表的事件类型
+DIALOGUE_EVENT_TYPES = (SPEECH, QUESTION, SYSTEM)
+
+_listeners = []
+
+def init_event_log():
+    """创建事件表"""
+    with connect(CONVERSATIONS) as conn:
+        ensure_tables(conn, conference_events_table)
+
+def add_listener(listener):
+    """注册事件监听器 listener(event)"""
+    _listeners.append(listener)
+
+def remove_listener(listener):
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+def _notify(events):
+    for event in events:
+        for listener in list(_listeners):
+            try:
+                listener(event)
+            except Exception as e:
+                logger.warning(f"事件监听器处理事件 {event['seq']} 时出错: {str(e)}")
+
+def dialogue_event_type(agent_id):
+    """根据发言者确定发言类事件的类型"""
+    if agent_id == "系统":
+        return SYSTEM
+    if agent_id == "用户":
+        return QUESTION
+    return SPEECH
+
+def _insert_event(conn, conference_id, event_type, phase_id=None, agent_id=None, payload=None):
+    """在给定连接中写入一个事件（发言类事件同时写入 conversations 投影），返回事件字典"""
+    created_at = datetime.now().isoformat()
+    seq = conn.execute(
+        insert(conference_events_table).values(
+            conference_id=conference_id, phase_id=phase_id, event_type=event_type, agent_id=agent_id,
+            payload=json.dumps(payload or {}, ensure_ascii=False), created_at=created_at
+        ).returning(conference_events_table.c.seq)
+    ).scalar_one()
+
+    if event_type in DIALOGUE_EVENT_TYPES:
+        conn.execute(insert(conversations_table).values(
+            id=seq, conference_id=conference_id, phase_id=phase_id, agent_id=agent_id,
+            speech=payload.get("speech"), timestamp=payload.get("timestamp") or created_at
+        ))
+
+    return {
+        "seq": seq,
+        "conference_id": conference_id,
+        "phase_id": phase_id,
+        "event_type": event_type,
+        "agent_id": agent_id,
+        "payload": payload or {},
+        "created_at": created_at
+    }
+
+def append_event(conference_id, event_type, phase_id=None, agent_id=None, payload=None):
+    """追加一个事件并通知监听器，返回事件字典"""
+    with connect(CONVERSATIONS) as conn:
+        event = _insert_event(conn, conference_id, event_type, phase_id, agent_id, payload)
+    _notify([event])
+    return event
+
+def append_dialogue_events(conference_id, phase_id, entries, also=None):
+    """
+    把新产生的对话条目（{"agent_id", "speech", "timestamp"}）追加为发言类事件，返回新增的事件列表
+
+    also(conn) 在同一事务中执行：讨论流程用它保存检查点（记录已写入事件的条数），
+    进程在两者之间退出时不会丢失或重复写入发言
+    """
+    events = []
+    with connect(CONVERSATIONS) as conn:
+        for entry in entries:
+            if "agent_id" not in entry or "speech" not in entry:
+                print(f"警告：对话记录缺少必要字段: {entry}")
+                continue
+            events.append(_insert_event(
+                conn, conference_id, dialogue_event_type(entry["agent_id"]), phase_id, entry["agent_id"],
+                {"speech": entry["speech"], "timestamp": entry.get("timestamp") or datetime.now().isoformat()}
+            ))
+        if also is not None:
+            also(conn)
+    _notify(events)
+    return events
+
+def load_phase_dialogue(conference_id, phase_id):
+    """按事件顺序读取会议某个阶段的对话条目（conversations 投影，记录ID即事件 seq）"""
+    with connect(CONVERSATIONS) as conn:
+        rows = conn.execute(
+            text('SELECT agent_id, speech, timestamp FROM conversations '
+                 'WHERE conference_id = :conference_id AND phase_id = :phase_id ORDER BY id'),
+            {"conference_id": conference_id, "phase_id": phase_id}
+        ).fetchall()
+    return [{"agent_id": row[0], "speech": row[1], "timestamp": row[2]} for row in rows]
+
+def row_to_event(row):
+    """把 conference_events 查询结果行转换为事件字典"""
+    return {
+        "seq": row[0],
+        "conference_id": row[1],
+        "phase_id": row[2],
+        "event_type": row[3],
+        "agent_id": row[4],
+        "payload": json.loads(row[5]) if row[5] else {},
+        "created_at": row[6]
+    }
+
+def backfill_events(batch_size=1000):
+    """
+    为升级前写入的 conversations 记录补建事件（事件表为空时执行一次），seq 沿用原记录ID
+    返回补建的事件数
+    """
+    with connect(CONVERSATIONS) as conn:
+        if conn.execute(text("SELECT 1 FROM conference_events LIMIT 1")).fetchone():
+            return 0
+
+    backfilled = 0
+    last_id = 0
+    while True:
+        with connect(CONVERSATIONS) as conn:
+            rows = conn.execute(
+                text("SELECT id, conference_id, phase_id, agent_id, speech, timestamp FROM conversations "
+                     "WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size}
+            ).fetchall()
+            if not rows:
+                break
+            conn.execute(insert(conference_events_table), [
+                {
+                    "seq": row[0], "conference_id": row[1], "phase_id": row[2],
+                    "event_type": dialogue_event_type(row[3]), "agent_id": row[3],
+                    "payload": json.dumps({"speech": row[4], "timestamp": row[5]}, ensure_ascii=False),
+                    "created_at": row[5] or datetime.now().isoformat()
+                } for row in rows
+            ])
+        backfilled += len(rows)
+        last_id = rows[-1][0]
+
+    if backfilled:
+        with connect(CONVERSATIONS) as conn:
+            if conn.dialect.name == "postgresql":
+                # 显式写入 seq 不会推进序列，补建后把序列移到最大值之后
+                conn.execute(text(
+                    "SELECT setval(pg_get_serial_sequence('conference_events', 'seq'), "
+                    "(SELECT MAX(seq) FROM conference_events))"
+                ))
+        print(f"已为 {backfilled} 条历史对话记录补建会议事件")
+    return backfilled
@@ -0,0 +1,146 @@
+"""
+抽取式上下文压缩
+在提示词发出前，把搜索摘要和历史发言切分为句子，用 TF-IDF 相关度和 TextRank 中心度（NumPy 向量化计算）给句子打分，
+每段文本只保留与当前主题和用户问题最相关的几句，按原文顺序拼接。不调用 LLM，也不需要分词器：
+中文按相邻两字（二元组）、英文按单词切分词项。
+
+同一批文本（一次搜索的全部摘要、一次总结的全部发言）一起计算 IDF 和句子相似度，
+因此各段之间重复的内容得分较低，只在一段中出现、且与问题相关的句子得分较高。
+"""
+
+import os
+import re
+import numpy as np
+
+# 是否启用抽取式压缩
+EXTRACTIVE_COMPRESSION = os.getenv("EXTRACTIVE_COMPRESSION", "true").lower() == "true"
+# 每条搜索摘要保留的句子数
+SEARCH_SNIPPET_SENTENCES = int(os.getenv("SEARCH_SNIPPET_SENTENCES", "3"))
+# 主持人总结时每条发言保留的句子数
+SUMMARY_SPEECH_SENTENCES = int(os.getenv("SUMMARY_SPEECH_SENTENCES", "3"))
+# 打分时相关度所占权重，其余为 TextRank 中心度
+EXTRACTIVE_QUERY_WEIGHT = float(os.getenv("EXTRACTIVE_QUERY_WEIGHT", "0.7"))
+
+# 句子之间省略内容的标记
+OMITTED_MARK = "……"
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[。！？；!?;])\s*|(?<=\.)\s+|\n+")
+_CJK_RUN = re.compile(r"[㐀-䶿一-鿿豈-﫿]+")
+_WORD = re.compile(r"[a-z0-9]+")
+_STOPWORDS = {
+    "the", "a", "an", "and", "or", "of", "to", "in", "on", "for", "is", "are", "was", "were", "be",
+    "with", "as", "by", "at", "it", "this", "that", "from", "its", "has", "have", "will", "can"
+}
+
+def split_sentences(text):
+    """把中英文混合文本切分为句子（保留句末标点）"""
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT.split(text or "") if sentence and sentence.strip()]
+
+def terms(text):
+    """提取词项：中文二元组（单字成段时取单字）和小写英文单词"""
+    lowered = (text or "").lower()
+    result = [word for word in _WORD.findall(lowered) if len(word) > 1 and word not in _STOPWORDS]
+    for run in _CJK_RUN.findall(lowered):
+        if len(run) == 1:
+            result.append(run)
+        else:
+            result.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return result
+
+def _tfidf(documents):
+    """返回行归一化的 TF-IDF 矩阵（文档数 × 词项数）"""
+    vocabulary = {}
+    rows, cols, counts = [], [], []
+    for row, document in enumerate(documents):
+        for term in document:
+            rows.append(row)
+            cols.append(vocabulary.setdefault(term, len(vocabulary)))
+            counts.append(1.0)
+    matrix = np.zeros((len(documents), max(len(vocabulary), 1)))
+    if counts:
+        np.add.at(matrix, (np.array(rows), np.array(cols)), np.array(counts))
+
+    document_frequency = np.count_nonzero(matrix, axis=0)
+    idf = np.log((1 + len(documents)) / (1 + document_frequency)) + 1
+    matrix = np.log1p(matrix) * idf
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def _textrank(similarity, damping=0.85, iterations=50, tolerance=1e-6):
+    """在句子相似度图上做幂迭代，返回各句的中心度"""
+    n = similarity.shape[0]
+    weights = similarity.copy()
+    np.fill_diagonal(weights, 0)
+    row_sums = weights.sum(axis=1, keepdims=True)
+    # 与其他句子都不相似的句子均匀分配权重
+    transition = np.where(row_sums > 0, weights / np.where(row_sums == 0, 1, row_sums), 1.0 / n)
+    rank = np.full(n, 1.0 / n)
+    for _ in range(iterations):
+        updated = (1 - damping) / n + damping * transition.T @ rank
+        if np.abs(updated - rank).sum() < tolerance:
+            return updated
+        rank = updated
+    return rank
+
+def _normalize(scores):
+    peak = scores.max() if scores.size else 0
+    return scores / peak if peak > 0 else scores
+
+def score_sentences(sentences, query=None):
+    """为句子打分：与查询的 TF-IDF 余弦相关度和 TextRank 中心度的加权和"""
+    if not sentences:
+        return np.zeros(0)
+    query_terms = terms(query) if query else []
+    matrix = _tfidf([terms(sentence) for sentence in sentences] + [query_terms])
+    sentence_vectors, query_vector = matrix[:-1], matrix[-1]
+
+    centrality = _normalize(_textrank(sentence_vectors @ sentence_vectors.T))
+    if not query_terms:
+        return centrality
+    relevance = _normalize(sentence_vectors @ query_vector)
+    return EXTRACTIVE_QUERY_WEIGHT * relevance + (1 - EXTRACTIVE_QUERY_WEIGHT) * centrality
+
+def _join(sentences):
+    joined = ""
+    for sentence in sentences:
+        if joined and joined[-1].isascii() and not joined.endswith(OMITTED_MARK):
+            joined += " "
+        joined += sentence
+    return joined
+
+def compress_texts(texts, query=None, max_sentences=3):
+    """
+    压缩一批文本：一起打分后每段只保留得分最高的 max_sentences 句，按原文顺序拼接，省略处用“……”标记
+    句子数不超过 max_sentences 的文本原样返回
+    """
+    if not EXTRACTIVE_COMPRESSION or max_sentences <= 0:
+        return list(texts)
+    split = [split_sentences(text) for text in texts]
+    if all(len(sentences) <= max_sentences for sentences in split):
+        return list(texts)
+
+    flat = [sentence for sentences in split for sentence in sentences]
+    scores = score_sentences(flat, query)
+
+    compressed = []
+    offset = 0
+    for text, sentences in zip(texts, split):
+        count = len(sentences)
+        if count <= max_sentences:
+            compressed.append(text)
+        else:
+            local = np.round(scores[offset:offset + count], 6)
+            # 得分相同时（如都与查询无关且不与其他句子相似）保留词项更多、信息量更大的句子，再按原文顺序
+            informative = np.array([len(set(terms(sentence))) for sentence in sentences])
+            order = np.lexsort((np.arange(count), -informative, -local))
+            keep = sorted(order[:max_sentences])
+            parts = []
+            for position, index in enumerate(keep):
+                if (index > 0 and position == 0) or (position > 0 and index != keep[position - 1] + 1):
+                    parts.append(OMITTED_MARK)
+                parts.append(sentences[index])
+            if keep[-1] < count - 1:
+                parts.append(OMITTED_MARK)
+            compressed.append(_join(parts))
+        offset += count
+    return compressed
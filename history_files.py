@@ -0,0 +1,233 @@
+"""
+对话历史文件读写
+进行中的阶段使用普通 JSON 文件（dialogue_history_[会议ID]_[阶段ID].json），
+会议结束后由后台任务压缩为 .jsonz 文件：
+
+    第一行   未压缩的 JSON 头部（格式版本、压缩算法、发言条数、原始大小等），列表和索引只需读取这一行
+    其余部分 压缩后的紧凑 JSON 发言列表
+
+读取方统一调用 load_dialogue_history / read_history_file，无需关心文件是否已压缩
+"""
+
+import os
+import json
+import gzip
+import uuid
+import logging
+import weakref
+import importlib
+import threading
+from storage import HISTORY_DIR
+
+logger = logging.getLogger("roundtable.history_files")
+
+HISTORY_PREFIX = "dialogue_history_"
+PLAIN_SUFFIX = ".json"
+COMPRESSED_SUFFIX = ".jsonz"
+HISTORY_SUFFIXES = (PLAIN_SUFFIX, COMPRESSED_SUFFIX)
+
+# 每个 (会议ID, 阶段ID) 一把锁，本进程内的写入与压缩互斥；锁不再被引用时自动移除
+_file_locks = weakref.WeakValueDictionary()
+_file_locks_guard = threading.Lock()
+
+def history_file_lock(conference_id, phase_id):
+    """返回会议阶段历史文件的锁"""
+    with _file_locks_guard:
+        lock = _file_locks.get((conference_id, phase_id))
+        if lock is None:
+            lock = _file_locks[(conference_id, phase_id)] = threading.Lock()
+        return lock
+
+# 压缩文件头部的格式标识
+HEADER_FORMAT = "roundtable-dialogue-history/1"
+
+# 压缩算法：gzip（默认）、zstd（需要 zstandard 库）或 none（不压缩）
+HISTORY_COMPRESSION = os.getenv("HISTORY_COMPRESSION", "gzip")
+HISTORY_COMPRESSION_LEVEL = os.getenv("HISTORY_COMPRESSION_LEVEL", "")
+
+# 历史文件压缩算法基类
+class HistoryCodec:
+    def __init__(self):
+        self.name = "Base History Codec"
+
+    def compress(self, data):
+        raise NotImplementedError("子类必须实现compress方法")
+
+    def decompress(self, data):
+        raise NotImplementedError("子类必须实现decompress方法")
+
+# gzip（标准库）
+class GzipCodec(HistoryCodec):
+    def __init__(self, level=9):
+        super().__init__()
+        self.name = "gzip"
+        self.level = level
+
+    def compress(self, data):
+        # mtime=0 使相同内容的压缩结果一致，便于备份去重
+        return gzip.compress(data, compresslevel=self.level, mtime=0)
+
+    def decompress(self, data):
+        return gzip.decompress(data)
+
+# zstd（zstandard 库）
+class ZstdCodec(HistoryCodec):
+    def __init__(self, zstandard, level=19):
+        super().__init__()
+        self.name = "zstd"
+        self._zstandard = zstandard
+        self.level = level
+
+    def compress(self, data):
+        return self._zstandard.ZstdCompressor(level=self.level).compress(data)
+
+    def decompress(self, data):
+        return self._zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+# 压缩算法工厂
+class HistoryCodecFactory:
+    @staticmethod
+    def get_codec(name=None, level=None):
+        """根据名称返回压缩算法；none 返回 None 表示不压缩，zstandard 未安装时回退到 gzip"""
+        name = (name or HISTORY_COMPRESSION or "none").lower()
+        level = level if level is not None else (int(HISTORY_COMPRESSION_LEVEL) if HISTORY_COMPRESSION_LEVEL else None)
+
+        if name == "none":
+            return None
+        elif name == "zstd":
+            try:
+                # 使用条件导入，因为可能没有安装 zstandard 库
+                zstandard = importlib.import_module("zstandard")
+            except (ImportError, ModuleNotFoundError):
+                logger.warning("zstandard 库未安装，对话历史使用 gzip 压缩")
+                return GzipCodec()
+            return ZstdCodec(zstandard) if level is None else ZstdCodec(zstandard, level)
+        elif name == "gzip":
+            return GzipCodec() if level is None else GzipCodec(level)
+        else:
+            logger.warning(f"不支持的压缩算法 {name}，对话历史使用 gzip 压缩")
+            return GzipCodec()
+
+def parse_history_filename(filename):
+    """从文件名 dialogue_history_[会议ID]_[阶段ID].json(z) 中解析会议ID和阶段ID，格式不符时返回None"""
+    suffix = next((s for s in HISTORY_SUFFIXES if filename.endswith(s)), None)
+    if not filename.startswith(HISTORY_PREFIX) or suffix is None:
+        return None
+    conference_id, _, phase_id = filename[len(HISTORY_PREFIX):-len(suffix)].rpartition("_")
+    if not conference_id or not phase_id.lstrip("-").isdigit():
+        return None
+    return conference_id, int(phase_id)
+
+def is_compressed(path):
+    return path.endswith(COMPRESSED_SUFFIX)
+
+def history_file_path(conference_id, phase_id, compressed=False):
+    """历史文件的路径（不检查是否存在）"""
+    suffix = COMPRESSED_SUFFIX if compressed else PLAIN_SUFFIX
+    return os.path.join(HISTORY_DIR, f"{HISTORY_PREFIX}{conference_id}_{phase_id}{suffix}")
+
+def find_history_file(conference_id, phase_id):
+    """返回已存在的历史文件路径（普通文件优先），都不存在时返回None"""
+    for compressed in (False, True):
+        path = history_file_path(conference_id, phase_id, compressed)
+        if os.path.exists(path):
+            return path
+    return None
+
+def read_history_header(path):
+    """读取压缩文件的头部；普通文件没有头部，返回None"""
+    if not is_compressed(path):
+        return None
+    with open(path, "rb") as f:
+        return json.loads(f.readline())
+
+def read_history_file(path):
+    """读取历史文件中的发言列表，压缩文件自动解压"""
+    if not is_compressed(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    with open(path, "rb") as f:
+        header = json.loads(f.readline())
+        payload = f.read()
+    codec = HistoryCodecFactory.get_codec(header.get("codec", "gzip"))
+    return json.loads(codec.decompress(payload))
+
+def load_dialogue_history(conference_id, phase_id):
+    """读取会议某个阶段的对话历史，文件不存在时返回空列表"""
+    path = find_history_file(conference_id, phase_id)
+    return read_history_file(path) if path else []
+
+def write_history_file(conference_id, phase_id, dialogue_history, indent=2):
+    """
+    以普通 JSON 写入会议某个阶段的对话历史，返回文件路径
+    已压缩的同名历史文件（会议结束后又继续讨论的情况）会被删除，避免两份内容不一致
+    """
+    if not os.path.exists(HISTORY_DIR):
+        os.makedirs(HISTORY_DIR)
+    path = history_file_path(conference_id, phase_id)
+    with history_file_lock(conference_id, phase_id):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(dialogue_history, f, ensure_ascii=False, indent=indent)
+        compressed_path = history_file_path(conference_id, phase_id, compressed=True)
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+    return path
+
+def compress_history_file(path, codec):
+    """
+    把普通历史文件压缩为 .jsonz 文件，返回压缩后的文件路径
+    先把原文件改名为本次压缩私有的文件名再读取：之后其他进程（多节点共享历史目录时）写入的是新的普通文件，
+    不会被本次压缩删除；此时新文件更新，丢弃刚生成的压缩文件并返回普通文件路径。
+    压缩失败时把私有文件改回原名（期间已有新文件时保留新文件），不会丢失数据
+    """
+    conference_id, phase_id = parse_history_filename(os.path.basename(path))
+    compressed_path = path[:-len(PLAIN_SUFFIX)] + COMPRESSED_SUFFIX
+    # 私有文件名不以 .json 结尾，不会被列表、索引和备份当作历史文件；多个进程同时压缩时只有一个能改名成功
+    private_path = f"{path}.{os.getpid()}.{uuid.uuid4().hex[:8]}.compressing"
+    tmp_path = private_path + ".tmp"
+
+    with history_file_lock(conference_id, phase_id):
+        os.replace(path, private_path)
+        try:
+            with open(private_path, "rb") as f:
+                raw = f.read()
+            dialogue_history = json.loads(raw)
+
+            # 压缩前改为紧凑格式（原文件带缩进）
+            payload = json.dumps(dialogue_history, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            header = {
+                "format": HEADER_FORMAT,
+                "codec": codec.name,
+                "conference_id": conference_id,
+                "phase_id": phase_id,
+                "entry_count": len(dialogue_history),
+                "original_size": len(raw)
+            }
+
+            with open(tmp_path, "wb") as f:
+                f.write(json.dumps(header, ensure_ascii=False).encode("utf-8") + b"\n")
+                f.write(codec.compress(payload))
+            os.replace(tmp_path, compressed_path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            _restore_private_file(private_path, path)
+            raise
+        os.remove(private_path)
+
+        # 压缩期间其他进程写入了新的普通文件（写入方会删除已存在的压缩文件，这里补删之后才生成的）
+        if os.path.exists(path):
+            try:
+                os.remove(compressed_path)
+            except FileNotFoundError:
+                pass
+            return path
+        return compressed_path
+
+def _restore_private_file(private_path, path):
+    """把私有文件改回原名；原名已有新文件时（os.link 不覆盖已存在的文件）保留新文件"""
+    try:
+        os.link(private_path, path)
+    except FileExistsError:
+        pass
+    os.remove(private_path)
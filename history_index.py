@@ -0,0 +1,152 @@
+"""
+对话历史文件索引
+每次保存或删除对话历史文件时同步更新 dialogue_history_index 表，
+历史列表接口只需一次带索引的分页查询，不再扫描目录和逐个读取会议
+"""
+
+import os
+import shutil
+from sqlalchemy import text
+from conference_organizer import get_conference
+from history_files import (
+    HistoryCodecFactory, compress_history_file, is_compressed, parse_history_filename, read_history_file,
+    read_history_header
+)
+from storage import (
+    CONFERENCES, CONVERSATIONS, HISTORY_DIR, dialogue_history_index_table, connect, ensure_tables, table_exists, upsert
+)
+
+def init_history_index():
+    """创建索引表"""
+    with connect(CONVERSATIONS) as conn:
+        ensure_tables(conn, dialogue_history_index_table)
+
+def count_entries(file_path):
+    """读取历史文件中的发言条数，压缩文件只读取头部"""
+    try:
+        if is_compressed(file_path):
+            return read_history_header(file_path).get("entry_count", 0)
+        return len(read_history_file(file_path))
+    except (OSError, ValueError, TypeError, AttributeError):
+        return 0
+
+def index_history_file(file_path, entry_count=None):
+    """更新单个历史文件的索引记录，entry_count 未提供时读取文件统计"""
+    filename = os.path.basename(file_path)
+    parsed = parse_history_filename(filename)
+    if not parsed or not os.path.exists(file_path):
+        return False
+    conference_id, phase_id = parsed
+
+    file_stats = os.stat(file_path)
+    if entry_count is None:
+        entry_count = count_entries(file_path)
+
+    conference_title = "未知会议"
+    conference_type = "未分类"
+    conference = get_conference(conference_id)
+    if conference:
+        conference_title = conference.title
+        conference_type = getattr(conference, "conference_type", "未分类")
+
+    with connect(CONVERSATIONS) as conn:
+        # 同一阶段的历史文件只保留一条索引（压缩前后文件名不同）
+        conn.execute(
+            text("DELETE FROM dialogue_history_index WHERE conference_id = :conference_id "
+                 "AND phase_id = :phase_id AND filename != :filename"),
+            {"conference_id": conference_id, "phase_id": phase_id, "filename": filename}
+        )
+        upsert(conn, dialogue_history_index_table, {
+            "filename": filename,
+            "conference_id": conference_id,
+            "phase_id": phase_id,
+            "conference_title": conference_title,
+            "conference_type": conference_type,
+            "size_bytes": file_stats.st_size,
+            "entry_count": entry_count,
+            "modified": file_stats.st_mtime
+        }, ["filename"])
+    return True
+
+def remove_history_index(filename):
+    """删除历史文件的索引记录"""
+    with connect(CONVERSATIONS) as conn:
+        conn.execute(text("DELETE FROM dialogue_history_index WHERE filename = :filename"), {"filename": filename})
+
+def sync_history_index():
+    """
+    让索引与历史目录保持一致（启动时运行）：
+    把旧版本遗留在当前目录的历史文件移动到历史目录，补建新增或已修改文件的索引，删除已不存在文件的索引
+    """
+    if not os.path.exists(HISTORY_DIR):
+        os.makedirs(HISTORY_DIR)
+
+    for filename in os.listdir("."):
+        if parse_history_filename(filename) and not os.path.exists(os.path.join(HISTORY_DIR, filename)):
+            try:
+                shutil.move(filename, os.path.join(HISTORY_DIR, filename))
+            except Exception as e:
+                print(f"移动文件 {filename} 时出错: {str(e)}")
+
+    files = {
+        filename: os.path.getmtime(os.path.join(HISTORY_DIR, filename))
+        for filename in os.listdir(HISTORY_DIR) if parse_history_filename(filename)
+    }
+    with connect(CONVERSATIONS) as conn:
+        indexed = dict(conn.execute(text("SELECT filename, modified FROM dialogue_history_index")).fetchall())
+        for filename in set(indexed) - set(files):
+            conn.execute(text("DELETE FROM dialogue_history_index WHERE filename = :filename"), {"filename": filename})
+
+    updated = 0
+    for filename, modified in files.items():
+        if indexed.get(filename) != modified:
+            if index_history_file(os.path.join(HISTORY_DIR, filename)):
+                updated += 1
+    if updated:
+        print(f"已更新 {updated} 个对话历史文件的索引")
+
+def compress_ended_histories(codec_name=None, conference_id=None):
+    """
+    把已结束会议的普通历史文件压缩为 .jsonz 并更新索引（后台定时任务），返回压缩的文件数
+    指定 conference_id 时只处理该会议
+    """
+    codec = HistoryCodecFactory.get_codec(codec_name)
+    if codec is None or not os.path.exists(HISTORY_DIR):
+        return 0
+
+    with connect(CONFERENCES) as conn:
+        ended = {row[0] for row in conn.execute(
+            text("SELECT conference_id FROM conferences WHERE end_time IS NOT NULL AND end_time != ''")
+        ).fetchall()}
+    # 会议结束后又继续讨论、检查点仍有写入者的阶段跳过，讨论结束后再压缩
+    with connect(CONVERSATIONS) as conn:
+        running = set()
+        if table_exists(conn, "discussion_checkpoints"):
+            running = {(row[0], row[1]) for row in conn.execute(
+                text("SELECT conference_id, phase_id FROM discussion_checkpoints "
+                     "WHERE status = 'running' AND owner IS NOT NULL")
+            ).fetchall()}
+
+    compressed = 0
+    saved_bytes = 0
+    for filename in os.listdir(HISTORY_DIR):
+        parsed = parse_history_filename(filename)
+        if not parsed or parsed[0] not in ended or is_compressed(filename) or parsed in running:
+            continue
+        if conference_id is not None and parsed[0] != conference_id:
+            continue
+        file_path = os.path.join(HISTORY_DIR, filename)
+        try:
+            original_size = os.path.getsize(file_path)
+            compressed_path = compress_history_file(file_path, codec)
+            if not is_compressed(compressed_path):
+                # 压缩期间其他进程写入了新的普通文件，保留新文件
+                continue
+            saved_bytes += original_size - os.path.getsize(compressed_path)
+            index_history_file(compressed_path)
+            compressed += 1
+        except Exception as e:
+            print(f"压缩对话历史文件 {filename} 时出错: {str(e)}")
+    if compressed:
+        print(f"已压缩 {compressed} 个对话历史文件（{codec.name}），节省 {saved_bytes / 1024:.1f} KB")
+    return compressed
@@ -1,11 +1,10 @@
-import sqlite3
 import json
+from sqlalchemy import text
+from storage import AGENTS, connect
 
 def print_agents():
-    conn = sqlite3.connect('C:\\WORK\\code\\RoundTable\\agents.db')
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM agents')
-    rows = cursor.fetchall()
+    with connect(AGENTS) as conn:
+        rows = conn.execute(text('SELECT * FROM agents')).fetchall()
     
     print("系统中的专家列表:")
     print("-" * 80)
@@ -30,8 +29,6 @@ def print_agents():
         for key, value in communication_style.items():
             print(f"  - {key}: {value}")
         print("-" * 80)
-    
-    conn.close()
 
 if __name__ == "__main__":
     print_agents() 
\ No newline at end of file
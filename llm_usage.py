@@ -0,0 +1,74 @@
+"""
+LLM 调用记录
+call_llm_api 每次调用后把提供商、模型、耗时、token 用量、结束原因和是否超出字数上限写入 llm_calls 表，
+供分析归档（analytics_archive.py）统计各提供商的延迟、用量和超长输出比例
+
+会议ID和阶段ID通过 llm_call_context（或 track_conference_calls 装饰器）设置在当前线程的上下文中，
+讨论流程内的所有调用自动归属到该会议，调用处无需逐层传参
+"""
+
+import functools
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import insert, text
+from storage import CONVERSATIONS, llm_calls_table, connect, ensure_tables, table_columns, table_exists
+
+_call_context = contextvars.ContextVar("llm_call_context", default={})
+_table_ready = False
+
+@contextmanager
+def llm_call_context(conference_id=None, phase_id=None):
+    """在 with 块内发起的 LLM 调用记录到指定会议和阶段"""
+    token = _call_context.set({"conference_id": conference_id, "phase_id": phase_id})
+    try:
+        yield
+    finally:
+        _call_context.reset(token)
+
+def track_conference_calls(func):
+    """装饰器：被装饰函数的前两个参数为 conference_id 和 phase_id，函数内的 LLM 调用记录到该会议阶段"""
+    @functools.wraps(func)
+    def wrapper(conference_id, phase_id, *args, **kwargs):
+        with llm_call_context(conference_id, phase_id):
+            return func(conference_id, phase_id, *args, **kwargs)
+    return wrapper
+
+def ensure_llm_calls_table(conn):
+    """创建调用记录表，为升级前创建的表补充结束原因和超长标记列"""
+    if not table_exists(conn, "llm_calls"):
+        ensure_tables(conn, llm_calls_table)
+        return
+    columns = table_columns(conn, "llm_calls")
+    if "finish_reason" not in columns:
+        conn.execute(text("ALTER TABLE llm_calls ADD COLUMN finish_reason TEXT"))
+    if "overshoot" not in columns:
+        conn.execute(text("ALTER TABLE llm_calls ADD COLUMN overshoot INTEGER"))
+
+def record_llm_call(provider, model, latency_ms, agent_id=None, prompt_tokens=None, completion_tokens=None,
+                    success=True, finish_reason=None, overshoot=None):
+    """写入一条调用记录；记录失败只打印日志，不影响讨论流程"""
+    global _table_ready
+    context = _call_context.get()
+    try:
+        with connect(CONVERSATIONS) as conn:
+            if not _table_ready:
+                # 独立脚本（如 test_api_connection）可能在应用启动建表之前调用
+                ensure_llm_calls_table(conn)
+                _table_ready = True
+            conn.execute(insert(llm_calls_table).values(
+                conference_id=context.get("conference_id"),
+                phase_id=context.get("phase_id"),
+                agent_id=agent_id,
+                provider=provider,
+                model=model,
+                latency_ms=latency_ms,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                success=1 if success else 0,
+                finish_reason=finish_reason,
+                overshoot=None if overshoot is None else int(bool(overshoot)),
+                created_at=datetime.now().isoformat()
+            ))
+    except Exception as e:
+        print(f"记录LLM调用时出错: {str(e)}")
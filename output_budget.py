@@ -0,0 +1,105 @@
+"""
+发言输出预算
+各阶段的提示词都要求发言控制在一定字数内（默认"200字以内"），max_tokens 按该字数换算，
+不再对每次发言都传入 MAX_TOKENS（4096），模型失控时不会多生成几千个 token。
+
+流式模式（LLM_STREAMING=true）下边接收边计数，发言超过字数上限后在第一个句子结尾处停止接收并关闭连接；
+超过上限 STREAM_OVERRUN_RATIO 倍仍没有句子结尾时，截断到最后一个句子结尾。
+
+超出字数上限的发言（流式提前停止、因 max_tokens 截断或返回内容超长）在 llm_calls 表中记为 overshoot。
+"""
+
+import os
+import math
+
+# 发言字数上限，与提示词中的要求一致
+SPEECH_CHAR_LIMIT = int(os.getenv("SPEECH_CHAR_LIMIT", "200"))
+# 按阶段设置字数上限，格式: 阶段:字数,阶段:字数（阶段为 主题讨论、专家分享、专家讨论、问答、主持人开场、主持人总结）
+PHASE_CHAR_LIMITS = os.getenv("PHASE_CHAR_LIMITS", "")
+# 是否按字数上限换算 max_tokens；使用推理模型（输出包含思考过程）时应关闭
+ADAPTIVE_MAX_TOKENS = os.getenv("ADAPTIVE_MAX_TOKENS", "true").lower() == "true"
+# 每个汉字的 token 数（不同模型的分词器差异较大，按偏多估计）和额外余量倍数
+OUTPUT_TOKENS_PER_CHAR = float(os.getenv("OUTPUT_TOKENS_PER_CHAR", "1.5"))
+OUTPUT_TOKEN_HEADROOM = float(os.getenv("OUTPUT_TOKEN_HEADROOM", "1.5"))
+OUTPUT_MIN_TOKENS = int(os.getenv("OUTPUT_MIN_TOKENS", "256"))
+# 是否以流式方式调用模型（OpenAI 兼容接口和 Anthropic），超出字数上限后提前停止
+LLM_STREAMING = os.getenv("LLM_STREAMING", "false").lower() == "true"
+# 流式模式下超过字数上限多少倍仍未遇到句子结尾时强制停止
+STREAM_OVERRUN_RATIO = float(os.getenv("STREAM_OVERRUN_RATIO", "1.3"))
+
+# 结束原因
+FINISH_STOP = "stop"
+FINISH_LENGTH = "length"
+FINISH_EARLY_STOP = "early_stop"
+
+SENTENCE_ENDINGS = "。！？!?…"
+
+def parse_phase_limits(limits=None):
+    """解析按阶段配置的字数上限，返回 {阶段: 字数}"""
+    limits = PHASE_CHAR_LIMITS if limits is None else limits
+    parsed = {}
+    for item in limits.split(","):
+        phase, _, chars = item.strip().rpartition(":")
+        if not phase:
+            continue
+        try:
+            parsed[phase.strip()] = int(chars)
+        except ValueError:
+            print(f"无效的阶段字数配置 {item}，已忽略")
+    return parsed
+
+_phase_limits = parse_phase_limits()
+
+def char_limit(phase_name):
+    """阶段发言的字数上限"""
+    return _phase_limits.get(phase_name, SPEECH_CHAR_LIMIT)
+
+def output_max_tokens(phase_name):
+    """阶段发言的 max_tokens：按字数上限换算，不超过 MAX_TOKENS"""
+    max_tokens = int(os.getenv("MAX_TOKENS", "4096"))
+    if not ADAPTIVE_MAX_TOKENS:
+        return max_tokens
+    derived = math.ceil(char_limit(phase_name) * OUTPUT_TOKENS_PER_CHAR * OUTPUT_TOKEN_HEADROOM)
+    return min(max_tokens, max(OUTPUT_MIN_TOKENS, derived))
+
+def sentence_end(text, start=0):
+    """text[start:] 中第一个句子结尾之后的位置，没有时返回-1"""
+    for index in range(start, len(text)):
+        if text[index] in SENTENCE_ENDINGS and (index + 1 == len(text) or text[index + 1] not in SENTENCE_ENDINGS):
+            # 句末标点后紧跟的右引号、括号一并保留
+            end = index + 1
+            while end < len(text) and text[end] in "”’」』）)":
+                end += 1
+            return end
+    return -1
+
+def normalize_finish_reason(reason):
+    """统一各提供商的结束原因：因 max_tokens 截断为 length，正常结束为 stop"""
+    if reason is None:
+        return None
+    return FINISH_LENGTH if reason in ("length", "max_tokens") else FINISH_STOP
+
+def read_until_limit(pieces, limit):
+    """
+    依次读取流式返回的文本片段，超过字数上限后在句子结尾处停止
+    返回 (文本, 是否提前停止)；调用方在提前停止时负责关闭连接
+    """
+    text = ""
+    for piece in pieces:
+        text += piece or ""
+        if len(text) <= limit:
+            continue
+        end = sentence_end(text, max(limit - 1, 0))
+        if end > 0:
+            return text[:end], True
+        if len(text) >= limit * STREAM_OVERRUN_RATIO:
+            last = text.rstrip()[:limit]
+            cut = max(last.rfind(mark) for mark in SENTENCE_ENDINGS)
+            return (text[:cut + 1] if cut > 0 else text[:limit]), True
+    return text, False
+
+def is_overshoot(text, limit, finish_reason):
+    """发言是否超出字数上限"""
+    if limit is None:
+        return False
+    return finish_reason in (FINISH_LENGTH, FINISH_EARLY_STOP) or len((text or "").strip()) > limit
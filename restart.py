@@ -41,13 +41,20 @@ def main():
                     os.kill(pid, signal.SIGTERM)
                 else:
                     os.kill(pid, signal.SIGTERM)
-                print(f"进程 {pid} 已终止")
+                print(f"已向进程 {pid} 发送终止信号")
             except Exception as e:
                 print(f"终止进程 {pid} 时出错: {str(e)}")
         
-        # 等待进程完全终止
-        print("等待进程完全终止...")
-        time.sleep(2)
+        # 等待进程完全终止：应用收到 SIGTERM 后会先排空进行中的讨论（最多 DRAIN_TIMEOUT 秒）
+        drain_timeout = float(os.getenv("DRAIN_TIMEOUT", "30"))
+        print(f"等待进程完全终止（最多 {drain_timeout + 15:.0f} 秒）...")
+        _, alive = psutil.wait_procs(app_processes, timeout=drain_timeout + 15)
+        for proc in alive:
+            print(f"进程 {proc.pid} 未在规定时间内退出，强制终止")
+            try:
+                proc.kill()
+            except psutil.NoSuchProcess:
+                pass
     else:
         print("未找到运行中的应用程序实例")
     
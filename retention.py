@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+数据保留策略
+按会议类型配置保留天数，定期删除过期会议的对话记录、事件日志、LLM 调用记录、历史文件索引和历史文件，
+删除会议时同样级联清理这些数据
+
+- 对话记录按批删除，每批一个短事务，批次之间短暂停顿，不会长时间锁住正在进行的会议写入
+- SQLite 库使用 auto_vacuum=INCREMENTAL，清理后分步执行 incremental_vacuum 归还空闲页，
+  避免一次性 VACUUM 重写整个文件；PostgreSQL 由其自身的 autovacuum 负责
+
+示例:
+    python retention.py purge --dry-run        # 查看将被清理的会议
+    python retention.py purge                  # 执行一次清理
+    python retention.py convert                # 把已有的 SQLite 库转换为增量 VACUUM 模式（需停机执行）
+"""
+
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+from sqlalchemy import text
+from conference_organizer import delete_conference
+from history_files import parse_history_filename
+from storage import (
+    CONFERENCES, CONVERSATIONS, HISTORY_DIR, SQLiteBackend, connect, get_storage_backend, table_exists
+)
+
+# 默认保留天数，0 表示永久保留
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "0"))
+# 按会议类型覆盖保留天数，格式: 类型:天数,类型:天数（例如 头脑风暴:30,战略讨论:365）
+RETENTION_DAYS_BY_TYPE = os.getenv("RETENTION_DAYS_BY_TYPE", "")
+# 每批删除的行数和批次之间的停顿（秒）
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "500"))
+RETENTION_BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", "0.05"))
+# 定时清理间隔（小时），0 表示只通过命令行手动执行
+RETENTION_INTERVAL_HOURS = float(os.getenv("RETENTION_INTERVAL_HOURS", "24"))
+# 每步 incremental_vacuum 释放的页数和最多执行的步数
+VACUUM_STEP_PAGES = int(os.getenv("VACUUM_STEP_PAGES", "2000"))
+VACUUM_MAX_STEPS = int(os.getenv("VACUUM_MAX_STEPS", "50"))
+
+# 需要增量 VACUUM 的 SQLite 逻辑库
+VACUUM_DATABASES = (CONVERSATIONS, CONFERENCES)
+
+# SQLite auto_vacuum 取值
+AUTO_VACUUM_INCREMENTAL = 2
+
+def parse_retention_policy(default_days=None, by_type=None):
+    """解析保留策略，返回 (默认天数, {会议类型: 天数})"""
+    default_days = RETENTION_DAYS if default_days is None else default_days
+    by_type = RETENTION_DAYS_BY_TYPE if by_type is None else by_type
+    policy = {}
+    for item in by_type.split(","):
+        conference_type, _, days = item.strip().rpartition(":")
+        if not conference_type:
+            continue
+        try:
+            policy[conference_type.strip()] = int(days)
+        except ValueError:
+            print(f"无效的保留策略配置 {item}，已忽略")
+    return default_days, policy
+
+def find_expired_conferences(now=None):
+    """
+    找出超过保留期的会议，返回 (conference_id, title, conference_type) 列表
+
+    已结束的会议按结束时间计算，未结束的按开始时间计算；保留天数为 0 的类型永久保留
+    """
+    default_days, policy = parse_retention_policy()
+    if not default_days and not any(policy.values()):
+        return []
+    now = now or datetime.now()
+
+    with connect(CONFERENCES) as conn:
+        rows = conn.execute(text(
+            "SELECT conference_id, title, conference_type, COALESCE(NULLIF(end_time, ''), start_time) "
+            "FROM conferences"
+        )).fetchall()
+
+    expired = []
+    for conference_id, title, conference_type, finished_at in rows:
+        days = policy.get(conference_type, default_days)
+        if not days or not finished_at:
+            continue
+        # 时间为 ISO 格式字符串，按字符串比较即可
+        if finished_at < (now - timedelta(days=days)).isoformat():
+            expired.append((conference_id, title, conference_type))
+    return expired
+
+def delete_in_batches(db_name, table_name, conference_id, key_column="id"):
+    """按批删除表中属于会议的行，每批一个独立事务，返回删除的总行数"""
+    deleted = 0
+    while True:
+        with connect(db_name) as conn:
+            if not table_exists(conn, table_name):
+                return deleted
+            result = conn.execute(
+                text(f"DELETE FROM {table_name} WHERE {key_column} IN ("
+                     f"SELECT {key_column} FROM {table_name} WHERE conference_id = :conference_id LIMIT :limit)"),
+                {"conference_id": conference_id, "limit": RETENTION_BATCH_SIZE}
+            )
+        deleted += result.rowcount
+        if result.rowcount < RETENTION_BATCH_SIZE:
+            return deleted
+        # 让出写锁，正在进行的会议可以在批次之间写入
+        time.sleep(RETENTION_BATCH_PAUSE)
+
+def remove_history_files(conference_id):
+    """删除会议的所有对话历史文件，返回删除的文件数"""
+    if not os.path.exists(HISTORY_DIR):
+        return 0
+    removed = 0
+    for filename in os.listdir(HISTORY_DIR):
+        parsed = parse_history_filename(filename)
+        # 按解析出的会议ID精确匹配，避免 C1 误删 C1_x 的文件
+        if parsed and parsed[0] == conference_id:
+            try:
+                os.remove(os.path.join(HISTORY_DIR, filename))
+                removed += 1
+            except OSError as e:
+                print(f"删除历史文件 {filename} 时出错: {str(e)}")
+    return removed
+
+def purge_conference_data(conference_id):
+    """级联清理会议的对话记录、事件日志、调用记录、讨论检查点、滚动纪要、历史文件索引和历史文件（不删除会议本身），返回各项删除数量"""
+    stats = {
+        "conversations": delete_in_batches(CONVERSATIONS, "conversations", conference_id),
+        "events": delete_in_batches(CONVERSATIONS, "conference_events", conference_id, key_column="seq"),
+        "llm_calls": delete_in_batches(CONVERSATIONS, "llm_calls", conference_id),
+        "history_index": delete_in_batches(CONVERSATIONS, "dialogue_history_index", conference_id, key_column="filename"),
+    }
+    # 检查点和滚动纪要每个阶段至多一条，直接删除
+    with connect(CONVERSATIONS) as conn:
+        for table_name in ("discussion_checkpoints", "rolling_summaries"):
+            if table_exists(conn, table_name):
+                conn.execute(text(f"DELETE FROM {table_name} WHERE conference_id = :conference_id"),
+                             {"conference_id": conference_id})
+    stats["history_files"] = remove_history_files(conference_id)
+    return stats
+
+def purge_expired_conferences(dry_run=False):
+    """清理所有过期会议，返回清理的会议数"""
+    expired = find_expired_conferences()
+    for conference_id, title, conference_type in expired:
+        if dry_run:
+            print(f"[dry-run] 将清理会议 {conference_id}（{title}，{conference_type}）")
+            continue
+        try:
+            stats = purge_conference_data(conference_id)
+            delete_conference(conference_id)
+            print(f"已清理过期会议 {conference_id}（{title}）: 对话 {stats['conversations']} 条，"
+                  f"调用记录 {stats['llm_calls']} 条，历史文件 {stats['history_files']} 个")
+        except Exception as e:
+            print(f"清理会议 {conference_id} 时出错: {str(e)}")
+    return len(expired)
+
+# 增量 VACUUM（仅 SQLite）
+
+def is_sqlite():
+    return isinstance(get_storage_backend(), SQLiteBackend)
+
+def autocommit_connection(db_name):
+    """VACUUM 和 auto_vacuum 设置不能在事务中执行，使用自动提交连接"""
+    return get_storage_backend().engine(db_name).connect().execution_options(isolation_level="AUTOCOMMIT")
+
+def prepare_auto_vacuum():
+    """
+    启动时调用（需在建表之前）：新建的空库直接启用 auto_vacuum=INCREMENTAL；
+    已有数据的库切换模式需要一次完整 VACUUM，只提示运行 convert 命令
+    """
+    if not is_sqlite():
+        return
+    for db_name in VACUUM_DATABASES:
+        with autocommit_connection(db_name) as conn:
+            mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+            if mode == AUTO_VACUUM_INCREMENTAL:
+                continue
+            if not conn.exec_driver_sql("SELECT COUNT(*) FROM sqlite_master").scalar():
+                conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            else:
+                print(f"数据库 {db_name} 未启用增量 VACUUM，清理后的空间不会归还，可停机运行 python retention.py convert")
+
+def convert_auto_vacuum():
+    """把已有的 SQLite 库切换为 auto_vacuum=INCREMENTAL（执行一次完整 VACUUM，期间会锁库）"""
+    if not is_sqlite():
+        print("当前存储后端不是 SQLite，无需转换")
+        return
+    for db_name in VACUUM_DATABASES:
+        with autocommit_connection(db_name) as conn:
+            if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() == AUTO_VACUUM_INCREMENTAL:
+                print(f"数据库 {db_name} 已启用增量 VACUUM")
+                continue
+            started = time.monotonic()
+            conn.exec_driver_sql("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.exec_driver_sql("VACUUM")
+            print(f"数据库 {db_name} 已切换为增量 VACUUM，耗时 {time.monotonic() - started:.1f}秒")
+
+def incremental_vacuum(db_name):
+    """分步归还空闲页，每步之间停顿以免长时间占用写锁，返回释放的页数"""
+    released = 0
+    with autocommit_connection(db_name) as conn:
+        if conn.exec_driver_sql("PRAGMA auto_vacuum").scalar() != AUTO_VACUUM_INCREMENTAL:
+            return 0
+        for _ in range(VACUUM_MAX_STEPS):
+            free_pages = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            if not free_pages:
+                break
+            # sqlite3 的 execute 对该语句只执行一次 step（只释放一页），executescript 会执行到结束
+            conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({VACUUM_STEP_PAGES});")
+            released += free_pages - conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            time.sleep(RETENTION_BATCH_PAUSE)
+    return released
+
+def run_retention(dry_run=False):
+    """执行一轮保留策略：清理过期会议，然后对 SQLite 库执行增量 VACUUM"""
+    purged = purge_expired_conferences(dry_run=dry_run)
+    if dry_run or not is_sqlite():
+        return purged
+    for db_name in VACUUM_DATABASES:
+        released = incremental_vacuum(db_name)
+        if released:
+            print(f"数据库 {db_name} 增量 VACUUM 释放 {released} 页")
+    return purged
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="RoundTable数据保留策略")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    purge_parser = subparsers.add_parser("purge", help="清理过期会议并执行增量 VACUUM")
+    purge_parser.add_argument("--dry-run", action="store_true", help="只列出将被清理的会议")
+    subparsers.add_parser("vacuum", help="只执行增量 VACUUM")
+    subparsers.add_parser("convert", help="把已有的 SQLite 库切换为增量 VACUUM 模式")
+
+    args = parser.parse_args()
+    if args.command == "purge":
+        count = run_retention(dry_run=args.dry_run)
+        print(f"共 {count} 个过期会议")
+    elif args.command == "vacuum":
+        for db_name in VACUUM_DATABASES:
+            print(f"数据库 {db_name} 释放 {incremental_vacuum(db_name) if is_sqlite() else 0} 页")
+    else:
+        convert_auto_vacuum()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+主持人滚动纪要
+每次专家发言后，在后台用一个小提示词把新发言折叠进该会议阶段的纪要（rolling_summaries 表），
+主持人总结时只需传入纪要和最近几条原始发言，提示词长度不再随讨论和提问次数增长。
+
+纪要记录已折叠的对话历史条数和最后一条的时间戳；对话历史被重写（条数减少或对应条目变化）时从头重建。
+折叠失败时不推进进度，未折叠的发言在下次更新或总结时补上。
+"""
+
+import os
+import weakref
+import threading
+import concurrent.futures
+from datetime import datetime
+from sqlalchemy import delete, insert, select
+from llm_usage import llm_call_context
+from storage import CONVERSATIONS, rolling_summaries_table, connect, ensure_tables
+
+# 纪要的最大字数
+ROLLING_SUMMARY_MAX_CHARS = int(os.getenv("ROLLING_SUMMARY_MAX_CHARS", "600"))
+# 总结时附带的最近原始发言条数（其余发言只以纪要形式出现）
+ROLLING_SUMMARY_TAIL = int(os.getenv("ROLLING_SUMMARY_TAIL", "3"))
+
+# 后台折叠线程；同一会议阶段的折叠通过锁串行执行
+# 折叠完成后从 _pending 中移除，锁不再被引用时自动从 _locks 中移除，会议数量增长不会使两者无限增长
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="rolling-summary")
+_pending = {}
+_locks = weakref.WeakValueDictionary()
+_locks_guard = threading.Lock()
+
+def init_rolling_summaries():
+    """创建纪要表"""
+    with connect(CONVERSATIONS) as conn:
+        ensure_tables(conn, rolling_summaries_table)
+
+def _lock_for(conference_id, phase_id):
+    with _locks_guard:
+        lock = _locks.get((conference_id, phase_id))
+        if lock is None:
+            lock = _locks[(conference_id, phase_id)] = threading.Lock()
+        return lock
+
+def load_summary(conference_id, phase_id):
+    """读取纪要，返回 {"summary", "covered_count", "last_timestamp"}，不存在时返回None"""
+    table = rolling_summaries_table
+    with connect(CONVERSATIONS) as conn:
+        row = conn.execute(
+            select(table.c.summary, table.c.covered_count, table.c.last_timestamp)
+            .where(table.c.conference_id == conference_id, table.c.phase_id == phase_id)
+        ).fetchone()
+    if not row:
+        return None
+    return {"summary": row[0], "covered_count": row[1], "last_timestamp": row[2]}
+
+def save_summary(conference_id, phase_id, summary, covered_count, last_timestamp):
+    table = rolling_summaries_table
+    with connect(CONVERSATIONS) as conn:
+        conn.execute(delete(table).where(table.c.conference_id == conference_id, table.c.phase_id == phase_id))
+        conn.execute(insert(table).values(
+            conference_id=conference_id, phase_id=phase_id, summary=summary, covered_count=covered_count,
+            last_timestamp=last_timestamp, updated_at=datetime.now().isoformat()
+        ))
+
+def covered_state(state, dialogue_history):
+    """校验纪要与对话历史是否一致，返回 (纪要, 已折叠条数)；不一致时从头开始"""
+    if not state:
+        return "", 0
+    covered = state["covered_count"]
+    if covered > len(dialogue_history):
+        return "", 0
+    if covered and dialogue_history[covered - 1].get("timestamp") != state["last_timestamp"]:
+        return "", 0
+    return state["summary"], covered
+
+def build_fold_prompt(topic, summary, new_lines):
+    """折叠提示词：只包含当前纪要和新增发言，长度与讨论总长度无关"""
+    current = summary or "（暂无）"
+    joined = "\n".join(new_lines)
+    return f"""你是关于"{topic}"讨论的记录员。请把新增发言合并进讨论纪要。
+
+当前纪要：
+{current}
+
+新增发言：
+{joined}
+
+要求：
+1. 保留每位专家的核心观点、论据、共识与分歧，注明发言人
+2. 删除重复和寒暄内容，不要编造发言中没有的信息
+3. 只输出更新后的纪要，不使用Markdown格式，不超过{ROLLING_SUMMARY_MAX_CHARS}字
+4. 必须使用中文"""
+
+def fold(conference_id, phase_id, dialogue_history, topic, summarize, format_entry, upto=None):
+    """
+    把 dialogue_history[已折叠条数:upto] 折叠进纪要并保存，返回 (纪要, 已折叠条数)
+
+    summarize(prompt) 返回新纪要，失败时返回None；format_entry(entry) 返回一行发言文本，
+    不需要进入纪要的条目（主持人自己、系统提示）返回None
+    """
+    upto = len(dialogue_history) if upto is None else max(0, min(upto, len(dialogue_history)))
+    with _lock_for(conference_id, phase_id):
+        summary, covered = covered_state(load_summary(conference_id, phase_id), dialogue_history)
+        if covered >= upto:
+            return summary, covered
+
+        new_lines = [line for line in (format_entry(entry) for entry in dialogue_history[covered:upto]) if line]
+        if new_lines:
+            updated = summarize(build_fold_prompt(topic, summary, new_lines))
+            if not updated:
+                return summary, covered
+            summary = updated.strip()[:ROLLING_SUMMARY_MAX_CHARS * 2]
+        save_summary(conference_id, phase_id, summary, upto, dialogue_history[upto - 1].get("timestamp"))
+        return summary, upto
+
+def schedule_update(conference_id, phase_id, dialogue_history, topic, summarize, format_entry):
+    """在后台折叠新发言（保留最后 ROLLING_SUMMARY_TAIL 条，总结时原样附带），不阻塞讨论流程"""
+    snapshot = list(dialogue_history)
+
+    def run():
+        # 后台线程不继承调用方的上下文，显式设置调用记录所属的会议阶段，折叠的 LLM 调用计入该会议的用量
+        try:
+            with llm_call_context(conference_id, phase_id):
+                fold(conference_id, phase_id, snapshot, topic, summarize, format_entry,
+                     upto=len(snapshot) - ROLLING_SUMMARY_TAIL)
+        except Exception as e:
+            print(f"更新滚动纪要时出错: {str(e)}")
+
+    key = (conference_id, phase_id)
+    future = _executor.submit(run)
+    with _locks_guard:
+        _pending[key] = future
+
+    def forget(done):
+        with _locks_guard:
+            if _pending.get(key) is done:
+                del _pending[key]
+
+    # 已完成的 future 会立即回调，因此必须在登记之后添加
+    future.add_done_callback(forget)
+
+def summary_context(conference_id, phase_id, dialogue_history, topic, summarize, format_entry):
+    """
+    总结用的上下文：等待后台折叠完成并补齐，返回 (纪要, 最近几条原始发言的文本行)
+    """
+    with _locks_guard:
+        future = _pending.pop((conference_id, phase_id), None)
+    if future is not None:
+        concurrent.futures.wait([future])
+    tail_start = max(0, len(dialogue_history) - ROLLING_SUMMARY_TAIL)
+    summary, covered = fold(conference_id, phase_id, dialogue_history, topic, summarize, format_entry, upto=tail_start)
+    tail = [line for line in (format_entry(entry) for entry in dialogue_history[covered:]) if line]
+    return summary, tail
@@ -1,5 +1,21 @@
 from agent_db import get_agent, list_agents, get_random_agents
 from conference_organizer import get_conference
+from history_index import index_history_file
+from discussion_checkpoint import (
+    RUNNING, CheckpointLost, DiscussionDrained, DiscussionInterrupted, acquire_checkpoint, can_resume, check_stop,
+    claim_discussion, complete_checkpoint, create_checkpoint, is_draining, load_checkpoint, release_checkpoint,
+    release_discussion, request_stop, save_checkpoint
+)
+from event_log import append_dialogue_events, load_phase_dialogue
+from rolling_summary import schedule_update as schedule_summary_update, summary_context
+from history_files import write_history_file
+from llm_usage import record_llm_call, track_conference_calls
+from context_budget import PromptBudget
+from extractive_compressor import SUMMARY_SPEECH_SENTENCES, compress_texts
+from output_budget import (
+    FINISH_EARLY_STOP, LLM_STREAMING, char_limit as speech_char_limit, is_overshoot, normalize_finish_reason,
+    output_max_tokens, read_until_limit
+)
 import random
 import json
 from openai import OpenAI  # 导入 OpenAI 库以进行 API 调用
@@ -198,8 +214,30 @@ def parse_model_string(model_string):
     return DEFAULT_PROVIDER, model_string
 
 # 调用 API 生成回复
-def call_llm_api(provider, model, prompt, max_tokens=None, temperature=None):
-    """根据提供商调用相应的 LLM API"""
+def call_llm_api(provider, model, prompt, max_tokens=None, temperature=None, agent_id=None, char_limit=None):
+    """
+    根据提供商调用相应的 LLM API，并记录耗时和 token 用量
+    char_limit 为发言的字数上限：流式模式下超过上限后在句子结尾处提前停止，超出上限的发言记为 overshoot
+    """
+    usage = {}
+    started = time.perf_counter()
+    result = _call_llm_api(provider, model, prompt, max_tokens, temperature, usage, char_limit)
+    success = isinstance(result, str) and bool(result) and not result.startswith(("错误：", "API 调用错误："))
+    finish_reason = usage.get("finish_reason")
+    overshoot = success and is_overshoot(result, char_limit, finish_reason)
+    if overshoot:
+        print(f"{provider}:{model} 的输出超出 {char_limit} 字的上限（结束原因: {finish_reason}，长度: {len(result)}）")
+    record_llm_call(
+        provider, model, (time.perf_counter() - started) * 1000, agent_id=agent_id,
+        prompt_tokens=usage.get("prompt_tokens"), completion_tokens=usage.get("completion_tokens"), success=success,
+        finish_reason=finish_reason, overshoot=overshoot if char_limit is not None else None
+    )
+    return result
+
+def _call_llm_api(provider, model, prompt, max_tokens, temperature, usage, char_limit=None):
+    """call_llm_api 的实际调用逻辑，返回的 token 用量和结束原因写入 usage"""
+    # 只有给定字数上限时才使用流式调用
+    streaming = LLM_STREAMING and char_limit is not None
     if max_tokens is None:
         max_tokens = int(os.getenv("MAX_TOKENS", "4096"))
     if temperature is None:
@@ -237,31 +275,29 @@ Your response MUST be in Chinese. Even if the question is in English, please res
                 enhanced_prompt = prompt
             
             try:
+                request = {
+                    "model": model,
+                    "messages": [{"role": "user", "content": enhanced_prompt}],
+                    "max_tokens": max_tokens,
+                    "temperature": temperature,
+                    "timeout": api_timeout
+                }
                 # 为OpenRouter添加特殊处理
                 if provider == "openrouter":
                     # OpenRouter需要额外的HTTP头信息
-                    headers = {
+                    request["extra_headers"] = {
                         "HTTP-Referer": os.getenv("OPENROUTER_REFERER", "https://github.com/yourusername/RoundTable"),
                         "X-Title": os.getenv("OPENROUTER_TITLE", "RoundTable AI Conference")
                     }
-                    
-                    response = client.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": enhanced_prompt}],
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        timeout=api_timeout,
-                        extra_headers=headers  # 添加OpenRouter所需的额外头信息
-                    )
-                else:
-                    # 其他OpenAI兼容接口
-                    response = client.chat.completions.create(
-                        model=model,
-                        messages=[{"role": "user", "content": enhanced_prompt}],
-                        max_tokens=max_tokens,
-                        temperature=temperature,
-                        timeout=api_timeout
-                    )
+                
+                if streaming:
+                    return stream_openai_compatible(client.chat.completions.create(stream=True, **request), char_limit, usage)
+                
+                response = client.chat.completions.create(**request)
+                if getattr(response, "usage", None):
+                    usage["prompt_tokens"] = response.usage.prompt_tokens
+                    usage["completion_tokens"] = response.usage.completion_tokens
+                usage["finish_reason"] = normalize_finish_reason(response.choices[0].finish_reason)
                 return response.choices[0].message.content.strip()
             except Exception as e:
                 error_msg = str(e)
@@ -280,13 +316,20 @@ Your response MUST be in Chinese. Even if the question is in English, please res
         
         elif client_type == "anthropic":
             # Anthropic Claude API
-            response = client.messages.create(
-                model=model,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=max_tokens,
-                temperature=temperature,
-                timeout=api_timeout  # 添加超时设置
-            )
+            request = {
+                "model": model,
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "timeout": api_timeout  # 添加超时设置
+            }
+            if streaming:
+                return stream_anthropic(client, request, char_limit, usage)
+            response = client.messages.create(**request)
+            if getattr(response, "usage", None):
+                usage["prompt_tokens"] = response.usage.input_tokens
+                usage["completion_tokens"] = response.usage.output_tokens
+            usage["finish_reason"] = normalize_finish_reason(response.stop_reason)
             return response.content[0].text
         
         elif client_type == "gemini":
@@ -343,6 +386,36 @@ Your response MUST be in Chinese. Even if the question is in English, please res
         print(f"API调用过程中出现异常: {error_msg}")
         return f"错误：API调用过程中出现异常 - {error_msg}"
 
+def stream_openai_compatible(stream, char_limit, usage):
+    """读取 OpenAI 兼容接口的流式响应，超过字数上限后在句子结尾处停止并关闭连接"""
+    def pieces():
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                usage["finish_reason"] = normalize_finish_reason(choice.finish_reason)
+            yield choice.delta.content or ""
+
+    text, stopped = read_until_limit(pieces(), char_limit)
+    if stopped:
+        stream.close()
+        usage["finish_reason"] = FINISH_EARLY_STOP
+    return text.strip()
+
+def stream_anthropic(client, request, char_limit, usage):
+    """读取 Anthropic 的流式响应，超过字数上限后在句子结尾处停止（退出上下文时关闭连接）"""
+    with client.messages.stream(**request) as stream:
+        text, stopped = read_until_limit(stream.text_stream, char_limit)
+        if stopped:
+            usage["finish_reason"] = FINISH_EARLY_STOP
+        else:
+            message = stream.get_final_message()
+            usage["prompt_tokens"] = message.usage.input_tokens
+            usage["completion_tokens"] = message.usage.output_tokens
+            usage["finish_reason"] = normalize_finish_reason(message.stop_reason)
+    return text
+
 # 通过ID获取代理名称的辅助函数
 def get_agent_name_by_id(agent_id):
     """通过代理ID获取代理名称"""
@@ -447,6 +520,17 @@ def generate_agent_speech(agent, phase_name, topic, previous_speech=None, search
     
     print(f"为 {agent.name} 使用的最新信息: {latest_info[:100]}..." if len(latest_info) > 100 else latest_info)
 
+    # 获取该代理的模型字符串
+    agent_model = os.getenv(f"MODEL_{agent.agent_id}", os.getenv("DEFAULT_MODEL", f"{DEFAULT_PROVIDER}:gpt-3.5-turbo"))
+    
+    # 解析模型字符串，获取提供商和模型名称
+    provider, model_name = parse_model_string(agent_model)
+    max_tokens = output_max_tokens(phase_name)
+
+    # 搜索信息和上一位发言按模型的上下文上限裁剪，提示词中先使用占位符
+    budget = PromptBudget(model_name, reserve_tokens=max_tokens)
+    latest_info = budget.section("search", latest_info, weight=3)
+
     # 根据阶段类型和上下文构建提示词
     if phase_name == "主题讨论":
         # 主题讨论阶段
@@ -454,6 +538,7 @@ def generate_agent_speech(agent, phase_name, topic, previous_speech=None, search
             # 获取上一位发言者的名字
             previous_agent_id = previous_speech.get('agent_id', '')
             previous_agent_name = get_agent_name_by_id(previous_agent_id) or previous_agent_id
+            previous_text = budget.section("previous", previous_speech.get("speech", ""), weight=2)
             
             prompt = f"""你是一个名为{agent.name}的AI代理，正在参加一个圆桌会议。
 你的MBTI类型是{mbti}，你的沟通风格是{style}，语气{tone}。
@@ -463,7 +548,7 @@ def generate_agent_speech(agent, phase_name, topic, previous_speech=None, search
 {latest_info}
 
 会议上一位发言者{previous_agent_name}说:
-{previous_speech}
+{previous_text}
 
 请你以{agent.name}的身份，根据你的MBTI类型、沟通风格和专业背景，对{previous_agent_name}的观点进行回应。
 在回应中，请引用最新的相关信息，并结合你的专业知识提供深入见解。
@@ -614,11 +699,7 @@ def generate_agent_speech(agent, phase_name, topic, previous_speech=None, search
 7. 语言必须简洁、精确且富有洞察力
 """
 
-    # 获取该代理的模型字符串
-    agent_model = os.getenv(f"MODEL_{agent.agent_id}", os.getenv("DEFAULT_MODEL", f"{DEFAULT_PROVIDER}:gpt-3.5-turbo"))
-    
-    # 解析模型字符串，获取提供商和模型名称
-    provider, model_name = parse_model_string(agent_model)
+    prompt = budget.render(prompt)
     
     # 调用 API，增加重试逻辑
     max_retries = int(os.getenv("MAX_RETRIES", "3"))
@@ -632,8 +713,10 @@ def generate_agent_speech(agent, phase_name, topic, previous_speech=None, search
                 provider, 
                 model_name, 
                 prompt, 
-                max_tokens=int(os.getenv("MAX_TOKENS", "4096")),
-                temperature=float(os.getenv("TEMPERATURE", "0.7"))
+                max_tokens=max_tokens,
+                temperature=float(os.getenv("TEMPERATURE", "0.7")),
+                agent_id=agent.agent_id,
+                char_limit=speech_char_limit(phase_name)
             )
             
             # 检查返回的结果是否包含错误信息
@@ -695,9 +778,18 @@ def test_api_connection(provider=None, model=None):
         print(f"API连接测试异常: {str(e)}")
         return False, str(e)
 
+# 每个讨论环节的专家发言轮数
+DISCUSSION_ROUNDS = int(os.getenv("DISCUSSION_ROUNDS", "2"))
+
 # 开始阶段讨论的函数
+@track_conference_calls
 def start_phase_discussion(conference_id, phase_id):
-    """为会议启动讨论。"""
+    """
+    为会议启动讨论。
+
+    讨论状态在每次发言后保存到检查点，进程中途退出后再次调用会从最后完成的发言继续；
+    检查点已完成（或升级前的会议已有对话历史）时直接返回已有对话历史
+    """
     try:
         conference = get_conference(conference_id)
         if not conference:
@@ -715,256 +807,323 @@ def start_phase_discussion(conference_id, phase_id):
         topics = current_phase["topics"]
         topic = topics[0]  # 为简单起见使用第一个话题
 
-        print(f"开始 {phase_name} 讨论，主题为 {topic}...")
         agents = [get_agent(agent_id) for agent_id in conference.participant_agent_ids]
         if not agents or any(agent is None for agent in agents):
             error_msg = "错误：未找到有效的讨论代理！"
             print(error_msg)
             return error_msg
 
-        # 尝试从文件加载现有对话历史
-        dialogue_history = []
-        history_dir = "dialogue_histories"
-        history_file = os.path.join(history_dir, f"dialogue_history_{conference_id}_{phase_id}.json")
-        
+        # 服务正在关闭时不启动（或恢复）讨论，由重启后的进程从检查点继续
+        if is_draining():
+            return "错误: 服务正在重启，暂不启动讨论，请稍后重试"
+
+        # 本进程中该阶段的讨论正在进行时不重复启动，返回目前的对话历史
+        if not claim_discussion(conference_id, phase_id):
+            print(f"{phase_name} 讨论正在进行中")
+            return load_phase_dialogue(conference_id, phase_id)
+
         try:
-            if os.path.exists(history_file):
-                with open(history_file, "r", encoding='utf-8') as f:
-                    existing_history = json.load(f)
-                    if existing_history:
-                        print(f"加载了 {len(existing_history)} 条已有对话记录")
-                        dialogue_history = existing_history
-                        # 如果已有对话记录，直接返回
-                        return dialogue_history
-        except (FileNotFoundError, json.JSONDecodeError):
-            print(f"未找到现有对话历史或文件格式错误，将创建新的对话历史")
-        
-        # 选择主持人和其他专家
-        moderator, other_agents = select_moderator(agents, conference_id)
-        if not moderator:
-            print("错误：无法选择主持人！")
+            checkpoint = load_checkpoint(conference_id, phase_id)
+            # 多个进程或节点同时恢复同一场讨论时，只有成功接管检查点的进程继续
+            resume = can_resume(checkpoint) and acquire_checkpoint(conference_id, phase_id, checkpoint)
+            if not resume:
+                # 从事件日志的 conversations 投影读取现有对话历史
+                existing_history = load_phase_dialogue(conference_id, phase_id)
+                if checkpoint and checkpoint["status"] == RUNNING:
+                    print(f"{phase_name} 讨论正由其他进程进行")
+                    return existing_history
+                # 讨论已完成，或是没有检查点的旧会议：直接返回已有对话历史
+                if checkpoint or existing_history:
+                    print(f"加载了 {len(existing_history)} 条已有对话记录")
+                    return existing_history
+
+            if resume:
+                state = checkpoint["state"]
+                print(f"从检查点恢复 {phase_name} 讨论：{state['stage']} 环节，{state['step']} 步骤，"
+                      f"已有 {len(state['dialogue_history'])} 条发言")
+                moderator = get_agent(state["moderator_id"])
+                other_agents = [agent for agent in (get_agent(agent_id) for agent_id in state["other_agent_ids"]) if agent]
+                # 发言和检查点在同一事务中写入，检查点中的发言都已在事件日志中
+                state.setdefault("recorded", len(state["dialogue_history"]))
+                state.pop("interrupted", None)
+            else:
+                print(f"开始 {phase_name} 讨论，主题为 {topic}...")
+                # 选择主持人和其他专家
+                moderator, other_agents = select_moderator(agents, conference_id)
+                if not moderator:
+                    print("错误：无法选择主持人！")
+                    return []
+
+                # 性能优化：限制参与讨论的代理数量
+                max_agents_per_round = int(os.getenv("MAX_AGENTS_PER_ROUND", "4"))
+                if len(other_agents) > max_agents_per_round - 1:  # 减1是因为已经有一个主持人
+                    print(f"性能优化：限制每轮讨论的代理数量为 {max_agents_per_round} (总共 {len(agents)} 个代理)")
+                    # 随机选择指定数量的代理参与讨论
+                    random.shuffle(other_agents)
+                    other_agents = other_agents[:max_agents_per_round - 1]
+
+                state = new_discussion_state(moderator, other_agents)
+                if not create_checkpoint(conference_id, phase_id, state):
+                    print(f"{phase_name} 讨论已由其他进程启动")
+                    return load_phase_dialogue(conference_id, phase_id)
+
+            if not moderator:
+                print("错误：无法选择主持人！")
+                return state["dialogue_history"]
+
+            # 统一处理流程：主持人开场 + 专家讨论
+            if state["stage"] == "opening":
+                print("第一步：主持人开场...")
+                # 主持人搜索信息并开场
+                dialogue_history = handle_moderator_opening(moderator, other_agents, topic, conference_id, phase_id, state)
+                start_discussion_stage(state, "discussion")
+                save_checkpoint(conference_id, phase_id, state)
+
+            if state["stage"] == "discussion":
+                print("第二步：专家讨论...")
+                # 专家讨论
+                dialogue_history = handle_expert_discussion(moderator, other_agents, topic, conference_id, phase_id, state)
+
+            print("第三步：添加系统提示...")
+            # 添加系统提示，告知用户可以提问
+            timestamp = datetime.now().isoformat()
+            system_prompt = f"讨论已开始，您可以随时向任何专家提问，或让他们继续讨论。"
+            dialogue_history.append({"agent_id": "系统", "speech": system_prompt, "timestamp": timestamp})
+            commit_discussion_turn(state, conference_id, phase_id, completed=True)
+            export_dialogue_history(conference_id, phase_id)
+
+            # 如果对话历史为空可能表示出错了
+            if not dialogue_history:
+                error_msg = "错误：讨论过程未生成有效对话，可能是API调用失败"
+                print(error_msg)
+                return error_msg
+
             return dialogue_history
-        
-        # 性能优化：限制参与讨论的代理数量
-        max_agents_per_round = int(os.getenv("MAX_AGENTS_PER_ROUND", "4"))
-        if len(other_agents) > max_agents_per_round - 1:  # 减1是因为已经有一个主持人
-            print(f"性能优化：限制每轮讨论的代理数量为 {max_agents_per_round} (总共 {len(agents)} 个代理)")
-            # 随机选择指定数量的代理参与讨论
-            random.shuffle(other_agents)
-            other_agents = other_agents[:max_agents_per_round - 1]
-        
-        # 统一处理流程：主持人开场 + 专家讨论
-        print("第一步：主持人开场...")
-        # 主持人搜索信息并开场
-        dialogue_history = handle_moderator_opening(moderator, other_agents, topic, conference_id, phase_id)
-        
-        print("第二步：专家讨论...")
-        # 专家讨论
-        dialogue_history = handle_expert_discussion(moderator, other_agents, topic, conference_id, phase_id)
-        
-        print("第三步：添加系统提示...")
-        # 添加系统提示，告知用户可以提问
-        timestamp = datetime.now().isoformat()
-        system_prompt = f"讨论已开始，您可以随时向任何专家提问，或让他们继续讨论。"
-        dialogue_history.append({"agent_id": "系统", "speech": system_prompt, "timestamp": timestamp})
-        save_dialogue_history(dialogue_history, conference_id, phase_id)
-        
-        # 如果对话历史为空可能表示出错了
-        if not dialogue_history:
-            error_msg = "错误：讨论过程未生成有效对话，可能是API调用失败"
-            print(error_msg)
-            return error_msg
-            
-        return dialogue_history
+        except DiscussionDrained:
+            # 已完成的发言都在检查点中，释放写入者，重启后的进程可立即继续
+            release_checkpoint(conference_id, phase_id)
+            print(f"服务正在关闭，{phase_name} 讨论已在发言之间停止，将从检查点继续")
+            return "错误: 服务正在重启，讨论已保存检查点，将在重启后自动继续"
+        except DiscussionInterrupted:
+            # 标记为用户中断并释放写入者：应用启动时不自动恢复，用户继续讨论时（可在任一进程）从检查点接着发言
+            state["interrupted"] = True
+            save_checkpoint(conference_id, phase_id, state)
+            release_checkpoint(conference_id, phase_id)
+            export_dialogue_history(conference_id, phase_id)
+            print(f"用户中断了 {phase_name} 讨论，将在继续时从检查点接着发言")
+            return state["dialogue_history"]
+        except CheckpointLost as e:
+            # 本进程停顿期间检查点被其他进程接管，最后一次发言未写入，由接管的进程继续
+            print(f"{phase_name} 讨论停止: {str(e)}")
+            return "错误: 讨论已由其他进程继续"
+        finally:
+            release_discussion(conference_id, phase_id)
     except Exception as e:
         error_msg = f"讨论过程出错: {str(e)}"
         print(error_msg)
         return error_msg
 
-# 处理主持人开场阶段
-def handle_moderator_opening(moderator, other_agents, topic, conference_id, phase_id):
-    """主持人搜索信息，总结并进行开场发言，然后自动触发专家讨论"""
-    dialogue_history = []
-    
+def new_discussion_state(moderator, other_agents):
+    """新讨论的检查点状态"""
+    state = {
+        "moderator_id": moderator.agent_id,
+        "other_agent_ids": [agent.agent_id for agent in other_agents],
+        # 轮数随检查点保存，恢复时不受配置变化影响
+        "rounds": DISCUSSION_ROUNDS
+    }
+    start_discussion_stage(state, "opening")
+    return state
+
+def start_discussion_stage(state, stage):
+    """
+    进入讨论环节（opening: 主持人开场及讨论，discussion: 专家讨论）并重置环节内的进度
+
+    step 依次为 search（搜索）、opening（开场发言）、rounds（专家发言）、summary（总结）、done；
+    rounds 步骤中 round 为当前轮次，speaker_order 为本轮发言顺序，next_speaker 为下一位发言者的位置；
+    recorded 为本环节 dialogue_history 中已写入事件日志的条数
+    """
+    state.update({
+        "stage": stage,
+        "step": "search",
+        "search_results": None,
+        "round": 0,
+        "speaker_order": None,
+        "next_speaker": 0,
+        "dialogue_history": [],
+        "recorded": 0
+    })
+
+def commit_discussion_turn(state, conference_id, phase_id, completed=False):
+    """
+    完成一次发言：新增发言写入事件日志，并在同一事务中保存检查点
+    completed 为 True 时把检查点标记为已完成
+    """
+    dialogue_history = state["dialogue_history"]
+    recorded = state.get("recorded", 0)
+    state["recorded"] = len(dialogue_history)
+    write_checkpoint = complete_checkpoint if completed else save_checkpoint
+    try:
+        append_dialogue_events(
+            conference_id, phase_id, dialogue_history[recorded:],
+            also=lambda conn: write_checkpoint(conference_id, phase_id, state, conn=conn)
+        )
+    except Exception:
+        state["recorded"] = recorded
+        raise
+
+def moderator_search(moderator, topic):
+    """主持人搜索主题的最新信息（搜索功能禁用时返回提示文本）"""
     # 从环境变量获取是否启用搜索
     enable_search = os.getenv("ENABLE_SEARCH", "true").lower() == "true"
-    search_results = None
-    
     if enable_search:
         # 从环境变量获取搜索引擎
         search_engine = os.getenv("SEARCH_ENGINE", "searxng")
         print(f"主持人 {moderator.name} 使用 {search_engine} 搜索关于 '{topic}' 的最新信息...")
-        search_results = search_latest_info(topic, ", ".join(moderator.background_info.get("skills", [])))
-    else:
-        search_results = f"搜索功能已禁用。请基于您的专业知识和理解来讨论主题：{topic}"
-    
-    # 主持人开场发言
-    moderator_speech = moderator_opening_speech(moderator, topic, search_results)
-    timestamp = datetime.now().isoformat()
-    dialogue_history.append({"agent_id": moderator.agent_id, "speech": moderator_speech, "timestamp": timestamp})
-    
-    # 将对话历史保存到文件，用于实时流式传输
-    save_dialogue_history(dialogue_history, conference_id, phase_id)
-    print(moderator_speech)
-    
-    # 自动开始专家讨论
-    print(f"主持人开场发言完成，自动开始专家讨论...")
-    
-    # 进行2轮专家讨论
-    discussion_rounds = 2
-    print(f"开始 {discussion_rounds} 轮讨论，每轮 {len(other_agents)} 个专家发言")
-    
-    for round_num in range(discussion_rounds):
-        print(f"开始第 {round_num + 1} 轮讨论")
-        random.shuffle(other_agents)  # 每轮重新洗牌
-        
-        for agent in other_agents:
-            # 获取上一条发言作为上下文
-            previous_speech = dialogue_history[-1] if dialogue_history else None
-            
-            # 如果previous_speech是用户提问，我们需要确保代理看到提问和回答的上下文
-            if previous_speech and previous_speech.get("agent_id") == "用户" and len(dialogue_history) >= 2:
-                # 使用倒数第二条记录，也就是代理的回答
-                previous_speech = dialogue_history[-2]
-            
-            # 生成专家发言，传递搜索结果避免重复搜索
-            speech = agent_speak(agent.agent_id, conference_id, "专家讨论", topic, previous_speech, search_results)
-            timestamp = datetime.now().isoformat()
-            dialogue_history.append({"agent_id": agent.agent_id, "speech": speech, "timestamp": timestamp})
-            
-            # 将对话历史保存到文件，用于实时流式传输
-            save_dialogue_history(dialogue_history, conference_id, phase_id)
-            print(speech)
-    
-    # 主持人总结发言
-    print(f"主持人 {moderator.name} 准备总结发言...")
-    summary_speech = moderator_summary_speech(moderator, topic, dialogue_history)
-    timestamp = datetime.now().isoformat()
-    dialogue_history.append({"agent_id": moderator.agent_id, "speech": summary_speech, "timestamp": timestamp})
-    
-    # 将对话历史保存到文件，用于实时流式传输
-    save_dialogue_history(dialogue_history, conference_id, phase_id)
-    print(summary_speech)
-    
-    # 添加系统提示，告知用户可以提问
-    timestamp = datetime.now().isoformat()
-    system_prompt = f"主持人已总结完毕，您现在可以向专家提问。请在下方选择\"提问\"并选择要提问的专家。"
-    dialogue_history.append({"agent_id": "系统", "speech": system_prompt, "timestamp": timestamp})
-    save_dialogue_history(dialogue_history, conference_id, phase_id)
-    
-    return dialogue_history
+        return search_latest_info(topic, ", ".join(moderator.background_info.get("skills", [])))
+    return f"搜索功能已禁用。请基于您的专业知识和理解来讨论主题：{topic}"
 
-# 处理专家讨论阶段
-def handle_expert_discussion(moderator, other_agents, topic, conference_id, phase_id):
-    """专家进行2轮讨论，主持人总结"""
-    # 尝试加载上一阶段的对话历史
-    dialogue_history = []
-    prev_history_file = os.path.join("dialogue_histories", f"dialogue_history_{conference_id}_{phase_id-1}.json")
-    
-    try:
-        if os.path.exists(prev_history_file):
-            with open(prev_history_file, "r", encoding='utf-8') as f:
-                prev_history = json.load(f)
-                if prev_history:
-                    # 获取主持人的搜索结果和开场白
-                    # 注意：我们使用传入的moderator参数，确保使用相同的主持人
-                    moderator_opening = next((item for item in prev_history if item.get("agent_id") == moderator.agent_id), None)
-                    if moderator_opening:
-                        dialogue_history.append(moderator_opening)
-    except Exception as e:
-        print(f"加载上一阶段对话历史时出错: {str(e)}")
-    
-    # 如果没有加载到上一阶段的对话历史，则重新生成主持人开场白
-    if not dialogue_history:
-        # 从环境变量获取是否启用搜索
-        enable_search = os.getenv("ENABLE_SEARCH", "true").lower() == "true"
-        search_results = None
-        
-        if enable_search:
-            search_engine = os.getenv("SEARCH_ENGINE", "searxng")
-            print(f"主持人 {moderator.name} 使用 {search_engine} 搜索关于 '{topic}' 的最新信息...")
-            search_results = search_latest_info(topic, ", ".join(moderator.background_info.get("skills", [])))
-        else:
-            search_results = f"搜索功能已禁用。请基于您的专业知识和理解来讨论主题：{topic}"
-        
+def run_discussion_stage(state, moderator, other_agents, topic, conference_id, phase_id, closing_prompt=None):
+    """
+    按检查点状态执行（或继续执行）当前讨论环节：搜索、主持人开场、多轮专家发言、主持人总结
+
+    每完成一步保存检查点；每次搜索或发言前检查排空模式和用户中断，服务关闭或用户中断时在发言之间停止。
+    closing_prompt 为总结后追加的系统提示
+    """
+    dialogue_history = state["dialogue_history"]
+    discussion_rounds = state.get("rounds", DISCUSSION_ROUNDS)
+    agents_by_id = {agent.agent_id: agent for agent in other_agents}
+
+    if state["step"] == "search":
+        check_stop(conference_id, phase_id)
+        state["search_results"] = moderator_search(moderator, topic)
+        state["step"] = "opening"
+        save_checkpoint(conference_id, phase_id, state)
+
+    if state["step"] == "opening":
+        check_stop(conference_id, phase_id)
         # 主持人开场发言
-        moderator_speech = moderator_opening_speech(moderator, topic, search_results)
+        moderator_speech = moderator_opening_speech(moderator, topic, state["search_results"])
         timestamp = datetime.now().isoformat()
         dialogue_history.append({"agent_id": moderator.agent_id, "speech": moderator_speech, "timestamp": timestamp})
-        
-        # 将对话历史保存到文件
-        save_dialogue_history(dialogue_history, conference_id, phase_id)
+        state["step"] = "rounds"
+        commit_discussion_turn(state, conference_id, phase_id)
         print(moderator_speech)
-    
-    # 进行2轮专家讨论
-    discussion_rounds = 2
-    print(f"开始 {discussion_rounds} 轮讨论，每轮 {len(other_agents)} 个专家发言")
-    
-    for round_num in range(discussion_rounds):
-        print(f"开始第 {round_num + 1} 轮讨论")
-        random.shuffle(other_agents)  # 每轮重新洗牌
-        
-        for agent in other_agents:
+        print(f"开始 {discussion_rounds} 轮讨论，每轮 {len(other_agents)} 个专家发言")
+
+    while state["step"] == "rounds":
+        if state["round"] >= discussion_rounds:
+            state["step"] = "summary"
+            break
+
+        if state["speaker_order"] is None:
+            print(f"开始第 {state['round'] + 1} 轮讨论")
+            # 每轮重新洗牌，发言顺序随检查点保存，恢复后保持不变
+            speaker_order = list(agents_by_id)
+            random.shuffle(speaker_order)
+            state["speaker_order"] = speaker_order
+            state["next_speaker"] = 0
+
+        if state["next_speaker"] >= len(state["speaker_order"]):
+            state["round"] += 1
+            state["speaker_order"] = None
+            continue
+
+        agent_id = state["speaker_order"][state["next_speaker"]]
+        check_stop(conference_id, phase_id)
+        if agent_id in agents_by_id:
             # 获取上一条发言作为上下文
             previous_speech = dialogue_history[-1] if dialogue_history else None
-            
+
             # 如果previous_speech是用户提问，我们需要确保代理看到提问和回答的上下文
             if previous_speech and previous_speech.get("agent_id") == "用户" and len(dialogue_history) >= 2:
                 # 使用倒数第二条记录，也就是代理的回答
                 previous_speech = dialogue_history[-2]
-            
+
             # 生成专家发言，传递搜索结果避免重复搜索
-            speech = agent_speak(agent.agent_id, conference_id, "专家讨论", topic, previous_speech, search_results)
+            speech = agent_speak(agent_id, conference_id, "专家讨论", topic, previous_speech, state["search_results"])
             timestamp = datetime.now().isoformat()
-            dialogue_history.append({"agent_id": agent.agent_id, "speech": speech, "timestamp": timestamp})
-            
-            # 将对话历史保存到文件，用于实时流式传输
-            save_dialogue_history(dialogue_history, conference_id, phase_id)
+            dialogue_history.append({"agent_id": agent_id, "speech": speech, "timestamp": timestamp})
             print(speech)
-    
-    # 主持人总结发言
-    print(f"主持人 {moderator.name} 准备总结发言...")
-    summary_speech = moderator_summary_speech(moderator, topic, dialogue_history)
-    timestamp = datetime.now().isoformat()
-    dialogue_history.append({"agent_id": moderator.agent_id, "speech": summary_speech, "timestamp": timestamp})
-    
-    # 将对话历史保存到文件，用于实时流式传输
-    save_dialogue_history(dialogue_history, conference_id, phase_id)
-    print(summary_speech)
-    
+        state["next_speaker"] += 1
+
+        commit_discussion_turn(state, conference_id, phase_id)
+        update_rolling_summary(moderator, topic, conference_id, phase_id, dialogue_history)
+
+    if state["step"] == "summary":
+        check_stop(conference_id, phase_id)
+        # 主持人总结发言
+        print(f"主持人 {moderator.name} 准备总结发言...")
+        summary_speech = moderator_summary_speech(moderator, topic, dialogue_history, conference_id, phase_id)
+        timestamp = datetime.now().isoformat()
+        dialogue_history.append({"agent_id": moderator.agent_id, "speech": summary_speech, "timestamp": timestamp})
+        print(summary_speech)
+
+        if closing_prompt:
+            timestamp = datetime.now().isoformat()
+            dialogue_history.append({"agent_id": "系统", "speech": closing_prompt, "timestamp": timestamp})
+        state["step"] = "done"
+        commit_discussion_turn(state, conference_id, phase_id)
+
     return dialogue_history
 
+# 处理主持人开场阶段
+def handle_moderator_opening(moderator, other_agents, topic, conference_id, phase_id, state=None):
+    """主持人搜索信息，总结并进行开场发言，然后自动触发专家讨论"""
+    if state is None:
+        state = new_discussion_state(moderator, other_agents)
+
+    # 主持人开场后自动开始专家讨论，总结后添加系统提示，告知用户可以提问
+    return run_discussion_stage(
+        state, moderator, other_agents, topic, conference_id, phase_id,
+        closing_prompt=f"主持人已总结完毕，您现在可以向专家提问。请在下方选择\"提问\"并选择要提问的专家。"
+    )
+
+# 处理专家讨论阶段
+def handle_expert_discussion(moderator, other_agents, topic, conference_id, phase_id, state=None):
+    """专家进行2轮讨论，主持人总结"""
+    if state is None:
+        state = new_discussion_state(moderator, other_agents)
+        start_discussion_stage(state, "discussion")
+
+    # 环节开始时尝试沿用上一阶段主持人的开场白，省去搜索和开场
+    if state["step"] == "search":
+        try:
+            prev_history = load_phase_dialogue(conference_id, phase_id - 1)
+            # 注意：我们使用传入的moderator参数，确保使用相同的主持人
+            moderator_opening = next((item for item in prev_history if item.get("agent_id") == moderator.agent_id), None)
+            if moderator_opening:
+                state["dialogue_history"].append(moderator_opening)
+                state["step"] = "rounds"
+                commit_discussion_turn(state, conference_id, phase_id)
+        except Exception as e:
+            print(f"加载上一阶段对话历史时出错: {str(e)}")
+
+    return run_discussion_stage(state, moderator, other_agents, topic, conference_id, phase_id)
+
 # 初始化用户提问阶段
 def initialize_user_question_phase(moderator, other_agents, topic, conference_id, phase_id):
     """初始化用户提问阶段"""
     dialogue_history = []
     
     # 尝试加载上一阶段的对话历史
-    prev_history_file = os.path.join("dialogue_histories", f"dialogue_history_{conference_id}_{phase_id-1}.json")
-    
     try:
-        if os.path.exists(prev_history_file):
-            with open(prev_history_file, "r", encoding='utf-8') as f:
-                prev_history = json.load(f)
-                if prev_history:
-                    # 获取主持人的总结发言
-                    # 注意：我们使用传入的moderator参数，确保使用相同的主持人
-                    moderator_entries = [item for item in prev_history if item.get("agent_id") == moderator.agent_id]
-                    if moderator_entries and len(moderator_entries) > 0:
-                        # 获取最后一条主持人发言（应该是总结）
-                        moderator_summary = moderator_entries[-1]
-                        dialogue_history.append(moderator_summary)
+        prev_history = load_phase_dialogue(conference_id, phase_id - 1)
+        if prev_history:
+            # 获取主持人的总结发言
+            # 注意：我们使用传入的moderator参数，确保使用相同的主持人
+            moderator_entries = [item for item in prev_history if item.get("agent_id") == moderator.agent_id]
+            if moderator_entries and len(moderator_entries) > 0:
+                # 获取最后一条主持人发言（应该是总结）
+                moderator_summary = moderator_entries[-1]
+                dialogue_history.append(moderator_summary)
     except Exception as e:
         print(f"加载上一阶段对话历史时出错: {str(e)}")
     
-    # 如果没有加载到上一阶段的对话历史，则添加一条提示信息
+    # 如果没有加载到上一阶段的对话历史，则添加一条提示信息（复制自上一阶段的条目不重复写入事件日志）
     if not dialogue_history:
-        timestamp = datetime.now().isoformat()
         prompt_message = f"现在进入用户提问环节。请向专家提出关于'{topic}'的问题。"
-        dialogue_history.append({"agent_id": "系统", "speech": prompt_message, "timestamp": timestamp})
-    
-    # 将对话历史保存到文件，用于实时流式传输
-    save_dialogue_history(dialogue_history, conference_id, phase_id)
+        append_dialogue_entry(dialogue_history, conference_id, phase_id, "系统", prompt_message)
+        export_dialogue_history(conference_id, phase_id)
     
     return dialogue_history
 
@@ -974,32 +1133,25 @@ def initialize_meeting_end_phase(moderator, other_agents, topic, conference_id,
     dialogue_history = []
     
     # 尝试加载上一阶段的对话历史
-    prev_history_file = os.path.join("dialogue_histories", f"dialogue_history_{conference_id}_{phase_id-1}.json")
-    
     try:
-        if os.path.exists(prev_history_file):
-            with open(prev_history_file, "r", encoding='utf-8') as f:
-                prev_history = json.load(f)
-                if prev_history:
-                    # 获取最后几条对话记录
-                    # 注意：我们确保包含主持人的发言，以保持主持人的一致性
-                    last_entries = prev_history[-3:] if len(prev_history) >= 3 else prev_history
-                    dialogue_history.extend(last_entries)
-                    
-                    # 确保主持人信息一致
-                    moderator_entry = next((item for item in prev_history if item.get("agent_id") == moderator.agent_id), None)
-                    if moderator_entry and not any(item.get("agent_id") == moderator.agent_id for item in dialogue_history):
-                        dialogue_history.append(moderator_entry)
+        prev_history = load_phase_dialogue(conference_id, phase_id - 1)
+        if prev_history:
+            # 获取最后几条对话记录
+            # 注意：我们确保包含主持人的发言，以保持主持人的一致性
+            last_entries = prev_history[-3:] if len(prev_history) >= 3 else prev_history
+            dialogue_history.extend(last_entries)
+            
+            # 确保主持人信息一致
+            moderator_entry = next((item for item in prev_history if item.get("agent_id") == moderator.agent_id), None)
+            if moderator_entry and not any(item.get("agent_id") == moderator.agent_id for item in dialogue_history):
+                dialogue_history.append(moderator_entry)
     except Exception as e:
         print(f"加载上一阶段对话历史时出错: {str(e)}")
     
-    # 添加一条提示信息
-    timestamp = datetime.now().isoformat()
+    # 添加一条提示信息（复制自上一阶段的条目不重复写入事件日志）
     prompt_message = f"会议即将结束。您可以再次提问，发表意见，或选择结束会议。"
-    dialogue_history.append({"agent_id": "系统", "speech": prompt_message, "timestamp": timestamp})
-    
-    # 将对话历史保存到文件，用于实时流式传输
-    save_dialogue_history(dialogue_history, conference_id, phase_id)
+    append_dialogue_entry(dialogue_history, conference_id, phase_id, "系统", prompt_message)
+    export_dialogue_history(conference_id, phase_id)
     
     return dialogue_history
 
@@ -1017,6 +1169,7 @@ def agent_speak(agent_id, conference_id, phase_name, topic, previous_speech=None
     return generate_agent_speech(agent, phase_name, topic, previous_speech, search_results)
 
 # 用户干预的函数
+@track_conference_calls
 def user_intervene(conference_id, phase_id, user_action, target_agent_id=None, user_input=None):
     """允许用户中断或提问。"""
     conference = get_conference(conference_id)
@@ -1033,6 +1186,10 @@ def user_intervene(conference_id, phase_id, user_action, target_agent_id=None, u
     phase_name = current_phase["phase_name"]
 
     if user_action == "interrupt":
+        # 讨论在当前发言完成后停止；本进程中没有正在执行的讨论时返回False
+        if not request_stop(conference_id, phase_id):
+            print(f"关于 {topic} 的讨论未在本进程中进行，无法中断")
+            return False
         print(f"用户中断了关于 {topic} 的讨论。")
         return True
     elif user_action == "question" and target_agent_id and user_input:
@@ -1071,31 +1228,26 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
     # 注意：search_latest_info 只接受两个参数，移除第三个参数 search_engine
     search_info = search_latest_info(f"{topic} {user_input}", ", ".join(agent.background_info.get("skills", [])))
     
-    # 加载当前对话历史
+    # 从事件日志的 conversations 投影加载当前对话历史
     dialogue_history = []
-    history_dir = "dialogue_histories"
-    history_file = os.path.join(history_dir, f"dialogue_history_{conference_id}_{phase_id}.json")
     
     try:
-        if os.path.exists(history_file):
-            with open(history_file, "r", encoding='utf-8') as f:
-                dialogue_history = json.load(f)
+        dialogue_history = load_phase_dialogue(conference_id, phase_id)
     except Exception as e:
         print(f"加载对话历史时出错: {str(e)}")
     
-    # 添加用户提问
-    timestamp = datetime.now().isoformat()
+    # 添加用户提问并保存对话历史
     user_question = f"提问给 {agent.name}: {user_input}"
-    dialogue_history.append({"agent_id": "用户", "speech": user_question, "timestamp": timestamp})
-    
-    # 保存对话历史
-    save_dialogue_history(dialogue_history, conference_id, phase_id)
+    append_dialogue_entry(dialogue_history, conference_id, phase_id, "用户", user_question)
     
-    # 生成专家回答
+    # 生成专家回答（搜索信息按模型的上下文上限裁剪）
+    max_tokens = output_max_tokens("问答")
+    budget = PromptBudget(model_name, reserve_tokens=max_tokens)
+    search_section = budget.section("search", search_info, weight=3)
     prompt = f"""作为 {agent.name}，请回答用户关于 {topic} 的问题："{user_input}"
 
 以下是主持人搜索到的关于该问题的最新信息，请在回答中适当参考：
-{search_info}
+{search_section}
 
 你的回答需要：
 1. 直接切入问题核心，避免不必要的铺垫
@@ -1107,6 +1259,7 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
 请以 {agent.communication_style.get('tone', '中立')} 的语调回答，保持专业性的同时确保内容通俗易懂。
 请用中文回答，引用其他代理时请使用他们的名字而不是代号。
 限制在200字以内，保持内容简洁但有深度。"""
+    prompt = budget.render(prompt)
     
     try:
         print(f"正在使用 {provider} 的 {model_name} 模型生成 {agent.name} 的回应...")
@@ -1114,8 +1267,10 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
             provider, 
             model_name, 
             prompt, 
-            max_tokens=int(os.getenv("MAX_TOKENS", "4000")),
-            temperature=float(os.getenv("TEMPERATURE", "0.7"))
+            max_tokens=max_tokens,
+            temperature=float(os.getenv("TEMPERATURE", "0.7")),
+            agent_id=agent.agent_id,
+            char_limit=speech_char_limit("问答")
         )
         
         # 检查返回的结果是否包含错误信息
@@ -1126,12 +1281,9 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
         conference_agents = [a.agent_id for a in list_agents()]
         answer = get_referenced_agent_name(answer, conference_agents)
         
-        # 添加专家回答到对话历史
-        timestamp = datetime.now().isoformat()
-        dialogue_history.append({"agent_id": agent.agent_id, "speech": answer, "timestamp": timestamp})
-        
-        # 保存对话历史
-        save_dialogue_history(dialogue_history, conference_id, phase_id)
+        # 添加专家回答到对话历史并保存
+        append_dialogue_entry(dialogue_history, conference_id, phase_id, agent.agent_id, answer)
+        update_rolling_summary(moderator, topic, conference_id, phase_id, dialogue_history)
         print(f"专家 {agent.name} 已回答用户问题")
         
         # 其他专家讨论1轮
@@ -1155,15 +1307,18 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
                 expert_answer_entry = dialogue_history[-1] if dialogue_history else None
                 
                 # 为其他专家创建特定的提示，确保他们参考用户问题和专家回答
+                expert_budget = PromptBudget(model_name, reserve_tokens=max_tokens)
+                answer_section = expert_budget.section("answer", answer, weight=2)
+                search_section = expert_budget.section("search", search_info, weight=3)
                 expert_prompt = f"""作为 {other_agent.name}，请针对以下用户问题和专家回答发表您的看法：
 
 用户问题: {user_input}
 
 {agent.name} 的回答:
-{answer}
+{answer_section}
 
 以下是关于该问题的最新信息，请在回答中适当参考：
-{search_info}
+{search_section}
 
 请基于您的 {', '.join(other_agent.background_info.get('skills', []))} 专业背景，对 {agent.name} 的回答进行补充、扩展或提供不同角度的见解。
 您可以：
@@ -1175,6 +1330,7 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
 请以 {other_agent.communication_style.get('tone', '中立')} 的语调回答，保持专业性的同时确保内容通俗易懂。
 请用中文回答，引用其他专家时请使用他们的名字而不是代号。
 限制在200字以内，保持内容简洁但有深度。"""
+                expert_prompt = expert_budget.render(expert_prompt)
 
                 # 使用与主要专家相同的提供商和模型
                 print(f"正在使用 {provider} 的 {model_name} 模型生成 {other_agent.name} 的回应...")
@@ -1183,8 +1339,10 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
                         provider, 
                         model_name, 
                         expert_prompt, 
-                        max_tokens=int(os.getenv("MAX_TOKENS", "4000")),
-                        temperature=float(os.getenv("TEMPERATURE", "0.7"))
+                        max_tokens=max_tokens,
+                        temperature=float(os.getenv("TEMPERATURE", "0.7")),
+                        agent_id=other_agent.agent_id,
+                        char_limit=speech_char_limit("问答")
                     )
                     
                     # 检查返回的结果是否包含错误信息
@@ -1196,59 +1354,59 @@ def handle_user_question_phase(conference_id, phase_id, agent, provider, model_n
                 except Exception as e:
                     speech = f"很抱歉，由于技术原因，{other_agent.name} 暂时无法参与讨论。({str(e)})"
                 
-                timestamp = datetime.now().isoformat()
-                dialogue_history.append({"agent_id": other_agent.agent_id, "speech": speech, "timestamp": timestamp})
-                
-                # 保存对话历史
-                save_dialogue_history(dialogue_history, conference_id, phase_id)
+                # 添加发言到对话历史并保存
+                append_dialogue_entry(dialogue_history, conference_id, phase_id, other_agent.agent_id, speech)
+                update_rolling_summary(moderator, topic, conference_id, phase_id, dialogue_history)
                 print(f"专家 {other_agent.name} 已完成发言")
         else:
             print("没有其他专家可以参与讨论")
         
         # 主持人总结讨论
         print(f"主持人 {moderator.name} 准备总结讨论...")
-        summary_speech = moderator_summary_speech(moderator, topic, dialogue_history)
-        timestamp = datetime.now().isoformat()
-        dialogue_history.append({"agent_id": moderator.agent_id, "speech": summary_speech, "timestamp": timestamp})
-        
-        # 保存对话历史
-        save_dialogue_history(dialogue_history, conference_id, phase_id)
+        summary_speech = moderator_summary_speech(moderator, topic, dialogue_history, conference_id, phase_id)
+        append_dialogue_entry(dialogue_history, conference_id, phase_id, moderator.agent_id, summary_speech)
         print(f"主持人 {moderator.name} 已完成总结")
         
         # 添加系统提示，告知用户可以继续提问或结束会议
-        timestamp = datetime.now().isoformat()
         system_prompt = f"主持人已总结完毕，您可以继续向专家提问，或选择结束会议。"
-        dialogue_history.append({"agent_id": "系统", "speech": system_prompt, "timestamp": timestamp})
-        save_dialogue_history(dialogue_history, conference_id, phase_id)
+        append_dialogue_entry(dialogue_history, conference_id, phase_id, "系统", system_prompt)
         print("系统提示已添加，用户可以继续提问或结束会议")
         
     except Exception as e:
         print(f"处理用户提问时出错: {str(e)}")
         answer = f"错误：无法生成回应 ({str(e)})"
-        
+
+    # 本次提问处理完后导出对话历史文件
+    export_dialogue_history(conference_id, phase_id)
     return answer
 
-def save_dialogue_history(dialogue_history, conference_id, phase_id):
-    """保存对话历史到JSON文件"""
-    # 确保dialogue_histories目录存在
-    history_dir = "dialogue_histories"
-    if not os.path.exists(history_dir):
-        os.makedirs(history_dir)
-        print(f"创建对话历史目录: {history_dir}")
-        
-    # 构建文件名
-    filename = f"dialogue_history_{conference_id}_{phase_id}.json"
-    file_path = os.path.join(history_dir, filename)
-    
-    # 保存对话历史
+def append_dialogue_entry(dialogue_history, conference_id, phase_id, agent_id, speech):
+    """追加一条新发言：写入会议事件日志（同时写入 conversations 表并通知观众）"""
+    entry = {"agent_id": agent_id, "speech": speech, "timestamp": datetime.now().isoformat()}
+    dialogue_history.append(entry)
     try:
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(dialogue_history, f, ensure_ascii=False, indent=2)
-        print(f"对话历史已保存到 {file_path} (共 {len(dialogue_history)} 条记录)")
+        append_dialogue_events(conference_id, phase_id, [entry])
     except Exception as e:
-        print(f"保存对话历史时出错: {str(e)}")
-    
-    return filename
+        print(f"写入会议事件日志时出错: {str(e)}")
+    return entry
+
+def export_dialogue_history(conference_id, phase_id):
+    """把会议阶段的对话历史从 conversations 投影导出为 JSON 文件并更新索引，返回文件名（失败时返回None）"""
+    try:
+        dialogue_history = load_phase_dialogue(conference_id, phase_id)
+        file_path = write_history_file(conference_id, phase_id, dialogue_history)
+        print(f"对话历史已导出到 {file_path} (共 {len(dialogue_history)} 条记录)")
+    except Exception as e:
+        print(f"导出对话历史时出错: {str(e)}")
+        return None
+
+    # 更新历史文件索引
+    try:
+        index_history_file(file_path, entry_count=len(dialogue_history))
+    except Exception as e:
+        print(f"更新对话历史索引时出错: {str(e)}")
+
+    return os.path.basename(file_path)
 
 # 选择主持人的函数
 def select_moderator(agents, conference_id=None, phase_id=None):
@@ -1323,6 +1481,14 @@ def moderator_opening_speech(moderator, topic, search_results=None):
     
     print(f"主持人 {moderator.name} 搜索到的最新信息: {search_results[:100]}..." if len(search_results) > 100 else search_results)
     
+    # 获取该代理的模型字符串
+    agent_model = os.getenv(f"MODEL_{moderator.agent_id}", os.getenv("DEFAULT_MODEL", f"{DEFAULT_PROVIDER}:gpt-3.5-turbo"))
+    
+    # 解析模型字符串，获取提供商和模型名称
+    provider, model_name = parse_model_string(agent_model)
+    max_tokens = output_max_tokens("主持人开场")
+    budget = PromptBudget(model_name, reserve_tokens=max_tokens)
+    
     # 构建主持人开场白的提示词
     prompt = f"""作为 {moderator.name}，你是{moderator.background_info["field"]}领域的顶尖专家，同时也是本次关于"{topic}"讨论的主持人。
 
@@ -1330,7 +1496,7 @@ def moderator_opening_speech(moderator, topic, search_results=None):
 你的专业技能包括: {skills}
 
 以下是关于该主题的最新信息，请在开场白中适当参考：
-{search_results}
+{budget.section("search", search_results, weight=3)}
 
 作为主持人，请提供一个简洁、专业且引人入胜的开场白，包括：
 
@@ -1349,12 +1515,7 @@ def moderator_opening_speech(moderator, topic, search_results=None):
 6. 必须使用中文回答
 7. 语言必须简洁、精确且富有洞察力
 """
-
-    # 获取该代理的模型字符串
-    agent_model = os.getenv(f"MODEL_{moderator.agent_id}", os.getenv("DEFAULT_MODEL", f"{DEFAULT_PROVIDER}:gpt-3.5-turbo"))
-    
-    # 解析模型字符串，获取提供商和模型名称
-    provider, model_name = parse_model_string(agent_model)
+    prompt = budget.render(prompt)
     
     # 调用 API
     print(f"正在使用 {provider} 的 {model_name} 模型生成 {moderator.name} 的主持人开场白...")
@@ -1362,8 +1523,10 @@ def moderator_opening_speech(moderator, topic, search_results=None):
         provider, 
         model_name, 
         prompt, 
-        max_tokens=int(os.getenv("MAX_TOKENS", "4096")),
-        temperature=float(os.getenv("TEMPERATURE", "0.7"))
+        max_tokens=max_tokens,
+        temperature=float(os.getenv("TEMPERATURE", "0.7")),
+        agent_id=moderator.agent_id,
+        char_limit=speech_char_limit("主持人开场")
     )
     
     # 检查返回的结果是否包含错误信息
@@ -1381,7 +1544,45 @@ def moderator_opening_speech(moderator, topic, search_results=None):
 """
 
 # 主持人总结发言函数
-def moderator_summary_speech(moderator, topic, dialogue_history):
+def summary_entry_line(moderator):
+    """返回把对话条目格式化为纪要输入行的函数，排除主持人自己的发言和系统提示"""
+    def format_entry(entry):
+        agent_id = entry.get("agent_id", "未知")
+        if agent_id in (moderator.agent_id, "系统"):
+            return None
+        agent_name = get_agent_name_by_id(agent_id) or agent_id
+        return f"{agent_name}: {entry.get('speech', '')}"
+    return format_entry
+
+def rolling_summarizer(moderator):
+    """返回用主持人的模型更新滚动纪要的函数，失败时返回None"""
+    agent_model = os.getenv(f"MODEL_{moderator.agent_id}", os.getenv("DEFAULT_MODEL", f"{DEFAULT_PROVIDER}:gpt-3.5-turbo"))
+    provider, model_name = parse_model_string(agent_model)
+
+    def summarize(prompt):
+        result = call_llm_api(provider, model_name, prompt, max_tokens=1024, temperature=0.3, agent_id=moderator.agent_id)
+        if not result or result.startswith("错误：") or result.startswith("API 调用错误："):
+            return None
+        return result
+    return summarize
+
+def update_rolling_summary(moderator, topic, conference_id, phase_id, dialogue_history):
+    """专家发言后在后台把新发言折叠进主持人的滚动纪要"""
+    schedule_summary_update(
+        conference_id, phase_id, dialogue_history, topic, rolling_summarizer(moderator), summary_entry_line(moderator)
+    )
+
+def compress_speech_lines(lines, topic, dialogue_history):
+    """对"发言人: 发言"格式的行做抽取式压缩，只保留与主题和最近一次用户提问最相关的句子"""
+    query = topic
+    questions = [entry.get("speech", "") for entry in dialogue_history if entry.get("agent_id") == "用户"]
+    if questions:
+        query += " " + questions[-1]
+    names, speeches = zip(*(line.partition(": ")[::2] for line in lines)) if lines else ((), ())
+    compressed = compress_texts(list(speeches), query, SUMMARY_SPEECH_SENTENCES)
+    return [f"{name}: {speech}" for name, speech in zip(names, compressed)]
+
+def moderator_summary_speech(moderator, topic, dialogue_history, conference_id=None, phase_id=None):
     """
     生成主持人的总结发言，基于之前的对话
     
@@ -1389,6 +1590,8 @@ def moderator_summary_speech(moderator, topic, dialogue_history):
         moderator: 主持人对象
         topic: 讨论主题
         dialogue_history: 之前的对话历史
+        conference_id, phase_id: 提供时使用该阶段的滚动纪要加最近几条发言，提示词长度基本恒定；
+            否则拼接全部发言
         
     返回:
         主持人的总结发言
@@ -1401,14 +1604,37 @@ def moderator_summary_speech(moderator, topic, dialogue_history):
     style = moderator.communication_style.get("style", "中立")
     tone = moderator.communication_style.get("tone", "中立")
     
+    # 获取该代理的模型字符串
+    agent_model = os.getenv(f"MODEL_{moderator.agent_id}", os.getenv("DEFAULT_MODEL", f"{DEFAULT_PROVIDER}:gpt-3.5-turbo"))
+    
+    # 解析模型字符串，获取提供商和模型名称
+    provider, model_name = parse_model_string(agent_model)
+    max_tokens = output_max_tokens("主持人总结")
+    # 纪要保留开头，发言记录超出预算时保留最近的部分
+    budget = PromptBudget(model_name, reserve_tokens=max_tokens)
+    
     # 提取对话内容
     dialogue_content = ""
-    for entry in dialogue_history:
-        agent_id = entry.get("agent_id", "未知")
-        if agent_id != moderator.agent_id:  # 排除主持人自己的发言
-            agent_name = get_agent_name_by_id(agent_id) or agent_id
-            speech = entry.get("speech", "")
-            dialogue_content += f"{agent_name}: {speech}\n\n"
+    if conference_id is not None:
+        summary, recent_lines = summary_context(
+            conference_id, phase_id, dialogue_history, topic, rolling_summarizer(moderator), summary_entry_line(moderator)
+        )
+        if summary:
+            dialogue_content += f"（此前讨论的纪要）\n{budget.section('summary', summary, weight=1)}\n\n"
+        if recent_lines:
+            recent_lines = compress_speech_lines(recent_lines, topic, dialogue_history)
+            recent = "".join(f"{line}\n\n" for line in recent_lines)
+            dialogue_content += "（最近的发言）\n" + budget.section("recent", recent, weight=2, keep="tail")
+    else:
+        lines = []
+        for entry in dialogue_history:
+            agent_id = entry.get("agent_id", "未知")
+            if agent_id != moderator.agent_id:  # 排除主持人自己的发言
+                agent_name = get_agent_name_by_id(agent_id) or agent_id
+                speech = entry.get("speech", "")
+                lines.append(f"{agent_name}: {speech}")
+        history = "".join(f"{line}\n\n" for line in compress_speech_lines(lines, topic, dialogue_history))
+        dialogue_content = budget.section("history", history, keep="tail")
     
     # 构建主持人总结发言的提示词
     prompt = f"""作为 {moderator.name}，你是{moderator.background_info["field"]}领域的顶尖专家，同时也是本次关于"{topic}"讨论的主持人。
@@ -1436,12 +1662,7 @@ def moderator_summary_speech(moderator, topic, dialogue_history):
 6. 必须使用中文回答
 7. 语言必须简洁、精确且富有洞察力
 """
-
-    # 获取该代理的模型字符串
-    agent_model = os.getenv(f"MODEL_{moderator.agent_id}", os.getenv("DEFAULT_MODEL", f"{DEFAULT_PROVIDER}:gpt-3.5-turbo"))
-    
-    # 解析模型字符串，获取提供商和模型名称
-    provider, model_name = parse_model_string(agent_model)
+    prompt = budget.render(prompt)
     
     # 调用 API
     print(f"正在使用 {provider} 的 {model_name} 模型生成 {moderator.name} 的总结发言...")
@@ -1449,8 +1670,10 @@ def moderator_summary_speech(moderator, topic, dialogue_history):
         provider, 
         model_name, 
         prompt, 
-        max_tokens=int(os.getenv("MAX_TOKENS", "4096")),
-        temperature=float(os.getenv("TEMPERATURE", "0.7"))
+        max_tokens=max_tokens,
+        temperature=float(os.getenv("TEMPERATURE", "0.7")),
+        agent_id=moderator.agent_id,
+        char_limit=speech_char_limit("主持人总结")
     )
     
     # 检查返回的结果是否包含错误信息
@@ -3,6 +3,7 @@ import json
 import requests
 from datetime import datetime
 from typing import List, Dict, Any, Optional, Union
+from extractive_compressor import SEARCH_SNIPPET_SENTENCES, compress_texts
 
 # 搜索结果接口
 class SearchResult:
@@ -371,13 +372,15 @@ def get_mock_search_results(query: str) -> List[SearchResult]:
 
 # 格式化搜索结果为字符串
 def format_search_results(results: List[SearchResult], 
-                          include_source: bool = True) -> str:
+                          include_source: bool = True,
+                          query: Optional[str] = None) -> str:
     """
     将搜索结果格式化为字符串
     
     参数:
         results: SearchResult对象列表
         include_source: 是否包含来源信息
+        query: 搜索查询，提供时每条摘要只保留与查询最相关的几句（抽取式压缩）
     
     返回:
         格式化后的字符串
@@ -388,10 +391,14 @@ def format_search_results(results: List[SearchResult],
     current_date = datetime.now().strftime("%Y年%m月%d日")
     formatted = f"搜索时间: {current_date}\n\n"
     
-    for i, result in enumerate(results, 1):
+    snippets = [result.snippet or "" for result in results]
+    if query:
+        snippets = compress_texts(snippets, query, SEARCH_SNIPPET_SENTENCES)
+    
+    for i, (result, snippet) in enumerate(zip(results, snippets), 1):
         formatted += f"{i}. {result.title}\n"
         formatted += f"   URL: {result.url}\n"
-        formatted += f"   摘要: {result.snippet}\n"
+        formatted += f"   摘要: {snippet}\n"
         if include_source and result.source:
             formatted += f"   来源: {result.source}\n"
         formatted += "\n"
@@ -428,8 +435,8 @@ def search_latest_info_with_engine(topic: str, skills: List[str] = None,
         max_results=max_results
     )
     
-    # 格式化结果
-    return format_search_results(results)
+    # 格式化结果，摘要按主题（含用户问题）压缩
+    return format_search_results(results, query=topic)
 
 # 测试代码
 if __name__ == "__main__":
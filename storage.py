@@ -0,0 +1,319 @@
+"""
+存储后端模块
+基于 SQLAlchemy 为代理、会议和对话记录提供统一的数据库访问入口
+
+默认使用本地 SQLite 文件（agents.db / conferences.db / conversations.db）；
+将 STORAGE_URL 设置为 PostgreSQL 地址后，三个逻辑库共享同一个数据库，
+多个应用节点即可在负载均衡后服务同一批会议
+"""
+
+import os
+from contextlib import contextmanager, asynccontextmanager
+from dotenv import load_dotenv
+from sqlalchemy import (
+    create_engine, inspect, text, MetaData, Table, Column, Index, Integer, Float, Text
+)
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# 加载环境变量
+load_dotenv()
+
+# 逻辑数据库名，SQLite 后端下对应同名 .db 文件
+AGENTS = "agents"
+CONFERENCES = "conferences"
+CONVERSATIONS = "conversations"
+
+# 存储配置
+STORAGE_URL = os.getenv("STORAGE_URL", "")
+SQLITE_DATA_DIR = os.getenv("SQLITE_DATA_DIR", ".")
+POOL_SIZE = int(os.getenv("STORAGE_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("STORAGE_MAX_OVERFLOW", "10"))
+
+# 对话历史文件目录，多节点部署时应指向共享卷
+HISTORY_DIR = os.getenv("DIALOGUE_HISTORY_DIR", "dialogue_histories")
+
+# 表结构定义
+metadata = MetaData()
+
+agents_table = Table(
+    "agents", metadata,
+    Column("agent_id", Text, primary_key=True, nullable=False),
+    Column("name", Text, nullable=False),
+    Column("background_info", Text, nullable=False),
+    Column("personality_traits", Text, nullable=False),
+    Column("knowledge_base_links", Text, nullable=False),
+    Column("communication_style", Text, nullable=False),
+)
+
+conferences_table = Table(
+    "conferences", metadata,
+    Column("conference_id", Text, primary_key=True, nullable=False),
+    Column("title", Text, nullable=False),
+    Column("agenda", Text, nullable=False),
+    Column("participant_agent_ids", Text, nullable=False),
+    Column("start_time", Text),
+    Column("end_time", Text),
+    Column("summary", Text),
+    Column("current_phase_index", Integer, nullable=False, server_default=text("-1")),
+    Column("conference_type", Text, nullable=False, server_default="战略讨论"),
+    # start_time 为 ISO 格式字符串，按前缀比较即可做日期范围查询
+    Index("idx_conferences_start_time", "start_time"),
+)
+
+conversations_table = Table(
+    "conversations", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("conference_id", Text),
+    Column("phase_id", Integer),
+    Column("agent_id", Text),
+    Column("speech", Text),
+    Column("timestamp", Text),
+    # 键集分页按 (conference_id, phase_id, id) 定位和排序，索引包含 id 保证各后端都无需额外排序
+    Index("idx_conversations_conference_phase_id", "conference_id", "phase_id", "id"),
+    sqlite_autoincrement=True,
+)
+
+# 会议事件日志：只追加，seq 单调递增，是会议对话和状态变化的唯一来源
+# conversations 表是其中发言类事件的投影（conversations.id 与事件 seq 相同）
+conference_events_table = Table(
+    "conference_events", metadata,
+    Column("seq", Integer, primary_key=True, autoincrement=True),
+    Column("conference_id", Text, nullable=False),
+    Column("phase_id", Integer),
+    Column("event_type", Text, nullable=False),
+    Column("agent_id", Text),
+    Column("payload", Text),  # JSON
+    Column("created_at", Text, nullable=False),
+    Index("idx_conference_events_conference_seq", "conference_id", "seq"),
+    Index("idx_conference_events_conference_phase", "conference_id", "phase_id", "seq"),
+    sqlite_autoincrement=True,
+)
+
+# LLM 调用记录（提供商、模型、耗时和 token 用量），供分析归档使用
+llm_calls_table = Table(
+    "llm_calls", metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("conference_id", Text),
+    Column("phase_id", Integer),
+    Column("agent_id", Text),
+    Column("provider", Text, nullable=False),
+    Column("model", Text, nullable=False),
+    Column("latency_ms", Float, nullable=False),
+    Column("prompt_tokens", Integer),
+    Column("completion_tokens", Integer),
+    Column("success", Integer, nullable=False, server_default=text("1")),
+    # 结束原因：stop / length（达到 max_tokens）/ early_stop（流式模式超出字数上限后提前停止）
+    Column("finish_reason", Text),
+    # 发言是否超出字数上限（未指定字数上限的调用为空）
+    Column("overshoot", Integer),
+    Column("created_at", Text, nullable=False),
+    Index("idx_llm_calls_conference", "conference_id"),
+)
+
+# 进行中讨论的检查点：每完成一次发言保存一次，进程重启后从最后完成的发言继续
+discussion_checkpoints_table = Table(
+    "discussion_checkpoints", metadata,
+    Column("conference_id", Text, primary_key=True),
+    Column("phase_id", Integer, primary_key=True),
+    Column("status", Text, nullable=False),
+    Column("owner", Text),
+    Column("state", Text, nullable=False),  # JSON
+    Column("updated_at", Text, nullable=False),
+    Index("idx_discussion_checkpoints_status", "status"),
+)
+
+# 主持人滚动纪要：每次发言后把新发言折叠进纪要，总结时不必再拼接全部发言
+rolling_summaries_table = Table(
+    "rolling_summaries", metadata,
+    Column("conference_id", Text, primary_key=True),
+    Column("phase_id", Integer, primary_key=True),
+    Column("summary", Text, nullable=False),
+    Column("covered_count", Integer, nullable=False),  # 已折叠进纪要的对话历史条数
+    Column("last_timestamp", Text),  # 最后一条已折叠发言的时间戳，用于识别对话历史被重写
+    Column("updated_at", Text, nullable=False),
+)
+
+# 对话历史文件索引，列表接口直接查询该表而不是扫描目录
+dialogue_history_index_table = Table(
+    "dialogue_history_index", metadata,
+    Column("filename", Text, primary_key=True, nullable=False),
+    Column("conference_id", Text, nullable=False),
+    Column("phase_id", Integer, nullable=False),
+    Column("conference_title", Text),
+    Column("conference_type", Text),
+    Column("size_bytes", Integer, nullable=False, server_default=text("0")),
+    Column("entry_count", Integer, nullable=False, server_default=text("0")),
+    Column("modified", Float, nullable=False),  # 文件修改时间（Unix 时间戳）
+    Index("idx_history_index_modified", "modified"),
+    Index("idx_history_index_type_modified", "conference_type", "modified"),
+    Index("idx_history_index_conference", "conference_id", "phase_id"),
+)
+
+# 存储后端基类
+class StorageBackend:
+    def __init__(self):
+        self.name = "Base Storage Backend"
+        # 是否由多个应用节点共享；共享后端上的数据可能被其他节点修改，进程内缓存不可靠
+        self.shared = False
+        self._engines = {}
+        self._async_engines = {}
+
+    def _create_engine(self, db_name):
+        """为逻辑库创建同步引擎"""
+        raise NotImplementedError("子类必须实现_create_engine方法")
+
+    def _create_async_engine(self, db_name):
+        """为逻辑库创建异步引擎"""
+        raise NotImplementedError("子类必须实现_create_async_engine方法")
+
+    def _engine_key(self, db_name):
+        """引擎缓存键，共享数据库的后端可让所有逻辑库共用一个引擎"""
+        return db_name
+
+    def engine(self, db_name):
+        """获取（并缓存）逻辑库的同步引擎"""
+        key = self._engine_key(db_name)
+        if key not in self._engines:
+            self._engines[key] = self._create_engine(db_name)
+        return self._engines[key]
+
+    def async_engine(self, db_name):
+        """获取（并缓存）逻辑库的异步引擎"""
+        key = self._engine_key(db_name)
+        if key not in self._async_engines:
+            self._async_engines[key] = self._create_async_engine(db_name)
+        return self._async_engines[key]
+
+    def dispose(self):
+        """释放所有同步引擎的连接池"""
+        for engine in self._engines.values():
+            engine.dispose()
+        self._engines.clear()
+
+    async def dispose_async(self):
+        """释放所有异步引擎的连接池"""
+        for engine in self._async_engines.values():
+            await engine.dispose()
+        self._async_engines.clear()
+
+# SQLite 本地文件后端（默认）
+class SQLiteBackend(StorageBackend):
+    def __init__(self, data_dir="."):
+        super().__init__()
+        self.name = "SQLite"
+        self.data_dir = data_dir
+
+    def db_path(self, db_name):
+        """逻辑库对应的 SQLite 文件路径"""
+        return os.path.join(self.data_dir, f"{db_name}.db")
+
+    def _create_engine(self, db_name):
+        return create_engine(f"sqlite:///{self.db_path(db_name)}")
+
+    def _create_async_engine(self, db_name):
+        return create_async_engine(f"sqlite+aiosqlite:///{self.db_path(db_name)}")
+
+# PostgreSQL 共享后端
+class PostgreSQLBackend(StorageBackend):
+    def __init__(self, url):
+        super().__init__()
+        self.name = "PostgreSQL"
+        self.shared = True
+        self.url = url
+
+    def _engine_key(self, db_name):
+        # 所有逻辑库位于同一个数据库中，共用一个连接池
+        return "shared"
+
+    def _driver_url(self, driver):
+        """未显式指定驱动时补全驱动名"""
+        if self.url.startswith("postgresql://"):
+            return self.url.replace("postgresql://", f"postgresql+{driver}://", 1)
+        return self.url
+
+    def _create_engine(self, db_name):
+        return create_engine(
+            self._driver_url("psycopg2"),
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+
+    def _create_async_engine(self, db_name):
+        return create_async_engine(
+            self._driver_url("asyncpg"),
+            pool_size=POOL_SIZE,
+            max_overflow=MAX_OVERFLOW,
+            pool_pre_ping=True
+        )
+
+# 存储后端工厂
+class StorageBackendFactory:
+    @staticmethod
+    def get_storage_backend(storage_url=None):
+        """根据存储地址返回存储后端实例"""
+        storage_url = storage_url if storage_url is not None else STORAGE_URL
+
+        if not storage_url or storage_url.startswith("sqlite"):
+            return SQLiteBackend(SQLITE_DATA_DIR)
+        elif storage_url.startswith("postgresql"):
+            return PostgreSQLBackend(storage_url)
+        else:
+            print(f"不支持的存储地址 {storage_url}，使用默认的 SQLite 后端")
+            return SQLiteBackend(SQLITE_DATA_DIR)
+
+_backend = None
+
+def get_storage_backend():
+    """返回当前进程使用的存储后端"""
+    global _backend
+    if _backend is None:
+        _backend = StorageBackendFactory.get_storage_backend()
+        print(f"使用 {_backend.name} 存储后端")
+    return _backend
+
+@contextmanager
+def connect(db_name):
+    """打开逻辑库连接，正常退出时提交事务，出现异常时回滚"""
+    with get_storage_backend().engine(db_name).begin() as conn:
+        yield conn
+
+@asynccontextmanager
+async def connect_async(db_name):
+    """异步版本的 connect"""
+    async with get_storage_backend().async_engine(db_name).begin() as conn:
+        yield conn
+
+def ensure_tables(conn, *tables):
+    """创建缺失的表及其索引（已存在的表保持不变）"""
+    metadata.create_all(conn, tables=list(tables), checkfirst=True)
+
+def table_exists(conn, table_name):
+    """检查表是否存在"""
+    return inspect(conn).has_table(table_name)
+
+def table_columns(conn, table_name):
+    """获取表的列名列表"""
+    return [column["name"] for column in inspect(conn).get_columns(table_name)]
+
+def table_names(conn):
+    """获取逻辑库中的所有表名"""
+    return inspect(conn).get_table_names()
+
+def insert_or_ignore(conn, table, values):
+    """插入一行，主键冲突时忽略（兼容 SQLite 与 PostgreSQL），返回插入的行数"""
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return conn.execute(insert(table).values(**values).on_conflict_do_nothing()).rowcount
+
+def upsert(conn, table, values, key_columns):
+    """插入一行，key_columns 冲突时更新其余列（兼容 SQLite 与 PostgreSQL）"""
+    if conn.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    statement = insert(table).values(**values)
+    update_values = {key: statement.excluded[key] for key in values if key not in key_columns}
+    conn.execute(statement.on_conflict_do_update(index_elements=list(key_columns), set_=update_values))
@@ -0,0 +1,198 @@
+"""
+会议记录导出模块
+从 conversations 表按键集游标分批读取全部阶段的发言，边读边编码为文本块，
+配合 StreamingResponse 输出，内存占用与会议记录长度无关
+
+- ndjson:   每行一个 JSON 对象
+- csv:      带表头的 CSV（UTF-8 BOM，便于 Excel 直接打开）
+- markdown: 按阶段分节的 Markdown 文稿
+"""
+
+import io
+import os
+import csv
+import json
+import zipfile
+import async_db
+
+# 每批读取并编码的对话记录条数
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+
+# 导出格式基类
+class TranscriptExporter:
+    def __init__(self):
+        self.name = "Base Transcript Exporter"
+        self.media_type = "text/plain; charset=utf-8"
+        self.extension = "txt"
+
+    def begin(self, conference):
+        """导出开始时输出的文本（表头、标题等）"""
+        return ""
+
+    def format_rows(self, conference, rows, names):
+        """把一批 (id, phase_id, agent_id, speech, timestamp) 记录编码为文本"""
+        raise NotImplementedError("子类必须实现format_rows方法")
+
+    def end(self, conference):
+        """导出结束时输出的文本"""
+        return ""
+
+    async def stream(self, conference):
+        """逐批产出编码后的文本块"""
+        header = self.begin(conference)
+        if header:
+            yield header
+        async for rows in async_db.iter_conference_dialogue(conference.conference_id, EXPORT_BATCH_SIZE):
+            # 每批重新取名称缓存，导出过程中缓存过期刷新时也能拿到最新映射
+            names = await async_db.get_agent_names()
+            yield self.format_rows(conference, rows, names)
+        footer = self.end(conference)
+        if footer:
+            yield footer
+
+    def filename(self, conference):
+        return f"transcript_{conference.conference_id}.{self.extension}"
+
+def phase_name(conference, phase_id):
+    """获取阶段名称，阶段不在议程中时返回 阶段N（从1开始编号）"""
+    if phase_id is None:
+        return "未知阶段"
+    if 0 <= phase_id < len(conference.agenda or []):
+        return conference.agenda[phase_id].get("phase_name", f"阶段{phase_id + 1}")
+    return f"阶段{phase_id + 1}"
+
+# NDJSON 导出
+class NDJSONExporter(TranscriptExporter):
+    def __init__(self):
+        super().__init__()
+        self.name = "ndjson"
+        self.media_type = "application/x-ndjson"
+        self.extension = "ndjson"
+
+    def format_rows(self, conference, rows, names):
+        return "".join(
+            json.dumps({
+                "id": row[0],
+                "conference_id": conference.conference_id,
+                "phase_id": row[1],
+                "phase_name": phase_name(conference, row[1]),
+                "agent_id": row[2],
+                "agent_name": names.get(row[2], row[2]),
+                "speech": row[3],
+                "timestamp": row[4]
+            }, ensure_ascii=False) + "\n"
+            for row in rows
+        )
+
+# CSV 导出
+class CSVExporter(TranscriptExporter):
+    COLUMNS = ["id", "conference_id", "phase_id", "phase_name", "agent_id", "agent_name", "speech", "timestamp"]
+
+    def __init__(self):
+        super().__init__()
+        self.name = "csv"
+        self.media_type = "text/csv; charset=utf-8"
+        self.extension = "csv"
+
+    def _encode(self, records):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(records)
+        return buffer.getvalue()
+
+    def begin(self, conference):
+        return "\ufeff" + self._encode([self.COLUMNS])
+
+    def format_rows(self, conference, rows, names):
+        return self._encode(
+            [row[0], conference.conference_id, row[1], phase_name(conference, row[1]),
+             row[2], names.get(row[2], row[2]), row[3], row[4]]
+            for row in rows
+        )
+
+# Markdown 导出
+class MarkdownExporter(TranscriptExporter):
+    def __init__(self):
+        super().__init__()
+        self.name = "markdown"
+        self.media_type = "text/markdown; charset=utf-8"
+        self.extension = "md"
+        self._current_phase = object()
+
+    def begin(self, conference):
+        lines = [f"# {conference.title}", "", f"- 会议ID: {conference.conference_id}"]
+        if getattr(conference, "start_time", None):
+            lines.append(f"- 开始时间: {conference.start_time}")
+        if getattr(conference, "end_time", None):
+            lines.append(f"- 结束时间: {conference.end_time}")
+        return "\n".join(lines) + "\n"
+
+    def format_rows(self, conference, rows, names):
+        parts = []
+        for row in rows:
+            # 阶段变化时输出新的小节标题（跨批次保持状态）
+            if row[1] != self._current_phase:
+                self._current_phase = row[1]
+                parts.append(f"\n## {phase_name(conference, row[1])}\n")
+            parts.append(f"\n**{names.get(row[2], row[2])}**（{row[4]}）\n\n{row[3]}\n")
+        return "".join(parts)
+
+    def end(self, conference):
+        summary = getattr(conference, "summary", None)
+        return f"\n## 会议总结\n\n{summary}\n" if summary else ""
+
+# 导出格式工厂
+class TranscriptExporterFactory:
+    FORMATS = ("ndjson", "csv", "markdown")
+
+    @staticmethod
+    def get_exporter(export_format="ndjson"):
+        """根据格式名称创建导出器（导出器带有逐次导出的状态，每次导出创建新实例）"""
+        export_format = (export_format or "ndjson").lower()
+        if export_format in ("ndjson", "jsonl"):
+            return NDJSONExporter()
+        elif export_format == "csv":
+            return CSVExporter()
+        elif export_format in ("markdown", "md"):
+            return MarkdownExporter()
+        else:
+            raise ValueError(f"不支持的导出格式: {export_format}，可选 {', '.join(TranscriptExporterFactory.FORMATS)}")
+
+class _ZipStreamBuffer:
+    """只追加的写缓冲区，供 zipfile 写入不可寻址的流，写入的数据随后被取走发送"""
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+async def stream_archive(conference_ids, export_format="ndjson"):
+    """
+    把多个会议逐个导出到一个 ZIP 归档中并流式产出字节块，不存在的会议ID跳过
+
+    zipfile 在不可寻址的输出上使用数据描述符记录大小和校验值，
+    因此无需预先知道每个文件的长度，也无需在内存或磁盘上暂存整个归档
+    """
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for conference_id in conference_ids:
+            conference = await async_db.get_conference(conference_id)
+            if not conference:
+                continue
+            exporter = TranscriptExporterFactory.get_exporter(export_format)
+            with archive.open(exporter.filename(conference), "w") as entry:
+                async for chunk in exporter.stream(conference):
+                    entry.write(chunk.encode("utf-8"))
+                    data = buffer.take()
+                    if data:
+                        yield data
+    # 剩余的压缩数据、数据描述符和中央目录
+    yield buffer.take()
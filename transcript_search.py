@@ -0,0 +1,137 @@
+"""
+对话记录全文检索
+SQLite 后端使用 FTS5 trigram 分词建立外部内容索引（conversations_fts），
+由 conversations 表上的触发器在插入、更新、删除时自动维护，三字及以上的中文关键词可直接走索引；
+少于三个字的关键词和 PostgreSQL 后端回退为 LIKE 子串匹配
+"""
+
+import html
+from datetime import date, timedelta
+from sqlalchemy import text
+from storage import CONVERSATIONS, connect, connect_async, table_exists
+
+FTS_TABLE = "conversations_fts"
+
+# trigram 分词每个词元为三个字符，短于三个字符的关键词无法使用索引
+MIN_FTS_QUERY_LENGTH = 3
+
+# 高亮标记先用控制字符占位，HTML 转义后再替换为 <mark>，避免发言内容中的 HTML 被执行
+_MARK_START = "\x02"
+_MARK_END = "\x03"
+
+FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        speech, content='conversations', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS conversations_fts_insert AFTER INSERT ON conversations BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, speech) VALUES (new.id, new.speech);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS conversations_fts_delete AFTER DELETE ON conversations BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, speech) VALUES ('delete', old.id, old.speech);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS conversations_fts_update AFTER UPDATE OF speech ON conversations BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, speech) VALUES ('delete', old.id, old.speech);
+        INSERT INTO {FTS_TABLE}(rowid, speech) VALUES (new.id, new.speech);
+    END""",
+]
+
+_fts_enabled = None
+
+def init_search_index():
+    """创建全文索引和维护触发器；首次创建时为已有对话记录建立索引。返回是否启用了 FTS5"""
+    global _fts_enabled
+    with connect(CONVERSATIONS) as conn:
+        if conn.dialect.name != "sqlite":
+            _fts_enabled = False
+            return False
+        created = not table_exists(conn, FTS_TABLE)
+        try:
+            for statement in FTS_SCHEMA:
+                conn.exec_driver_sql(statement)
+        except Exception as e:
+            # SQLite 3.34 之前没有 trigram 分词
+            print(f"当前 SQLite 不支持 FTS5 trigram 分词，全文检索回退为 LIKE 匹配: {str(e)}")
+            _fts_enabled = False
+            return False
+        if created:
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+            print("已为现有对话记录建立全文索引")
+    _fts_enabled = True
+    return True
+
+def render_snippet(snippet):
+    """转义片段中的 HTML，并把占位标记替换为 <mark> 高亮"""
+    return html.escape(snippet).replace(_MARK_START, "<mark>").replace(_MARK_END, "</mark>")
+
+def make_like_snippet(speech, query, width=40):
+    """LIKE 回退模式下在 Python 中截取关键词附近的片段"""
+    position = speech.find(query)
+    if position < 0:
+        return html.escape(speech[:width * 2])
+    start = max(0, position - width)
+    end = min(len(speech), position + len(query) + width)
+    snippet = (
+        ("…" if start > 0 else "") + speech[start:position] + _MARK_START + query + _MARK_END +
+        speech[position + len(query):end] + ("…" if end < len(speech) else "")
+    )
+    return render_snippet(snippet)
+
+async def search_conversations(query, conference_id=None, agent_id=None, date_from=None, date_to=None,
+                               order="relevance", limit=20, offset=0):
+    """
+    检索对话记录，返回 (items, mode)
+
+    - conference_id / agent_id: 精确过滤
+    - date_from / date_to: 按 ISO 格式的 timestamp 前缀过滤（如 2024-05-01）
+    - order: relevance 按 bm25 相关度，recent 按记录ID倒序
+    - mode: fts 表示使用了全文索引，like 表示回退为子串匹配
+    """
+    conditions = []
+    params = {"limit": limit, "offset": offset}
+    if conference_id:
+        conditions.append("c.conference_id = :conference_id")
+        params["conference_id"] = conference_id
+    if agent_id:
+        conditions.append("c.agent_id = :agent_id")
+        params["agent_id"] = agent_id
+    if date_from:
+        conditions.append("c.timestamp >= :date_from")
+        params["date_from"] = date_from
+    if date_to:
+        # 日期上限包含当天
+        conditions.append("c.timestamp < :date_to")
+        params["date_to"] = (date.fromisoformat(date_to) + timedelta(days=1)).isoformat() if len(date_to) == 10 else date_to
+
+    use_fts = bool(_fts_enabled) and len(query) >= MIN_FTS_QUERY_LENGTH
+    if use_fts:
+        params["match"] = '"' + query.replace('"', '""') + '"'
+        where = " AND ".join([f"{FTS_TABLE} MATCH :match"] + conditions)
+        order_by = f"{FTS_TABLE}.rank" if order == "relevance" else "c.id DESC"
+        sql = (
+            "SELECT c.id, c.conference_id, c.phase_id, c.agent_id, c.timestamp, "
+            f"snippet({FTS_TABLE}, 0, '{_MARK_START}', '{_MARK_END}', '…', 24) "
+            f"FROM {FTS_TABLE} JOIN conversations c ON c.id = {FTS_TABLE}.rowid "
+            f"WHERE {where} ORDER BY {order_by} LIMIT :limit OFFSET :offset"
+        )
+    else:
+        params["pattern"] = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        where = " AND ".join(["c.speech LIKE :pattern ESCAPE '\\'"] + conditions)
+        sql = (
+            "SELECT c.id, c.conference_id, c.phase_id, c.agent_id, c.timestamp, c.speech "
+            f"FROM conversations c WHERE {where} ORDER BY c.id DESC LIMIT :limit OFFSET :offset"
+        )
+
+    async with connect_async(CONVERSATIONS) as conn:
+        rows = (await conn.execute(text(sql), params)).fetchall()
+
+    items = [
+        {
+            "id": row[0],
+            "conference_id": row[1],
+            "phase_id": row[2],
+            "agent_id": row[3],
+            "timestamp": row[4],
+            "snippet": render_snippet(row[5]) if use_fts else make_like_snippet(row[5] or "", query)
+        } for row in rows
+    ]
+    return items, "fts" if use_fts else "like"
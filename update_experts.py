@@ -1,14 +1,8 @@
-import sqlite3
 import json
+from sqlalchemy import text
+from storage import AGENTS, connect
 
 def update_experts():
-    # 连接数据库
-    conn = sqlite3.connect('C:\\WORK\\code\\RoundTable\\agents.db')
-    cursor = conn.cursor()
-    
-    # 清除旧的专家数据
-    cursor.execute('DELETE FROM agents')
-    
     # 定义专家列表
     experts = [
         {
@@ -273,24 +267,23 @@ def update_experts():
         }
     ]
     
-    # 插入新的专家数据
-    for expert in experts:
-        cursor.execute('''
-            INSERT INTO agents 
-            (agent_id, name, background_info, personality_traits, knowledge_base_links, communication_style)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            expert["agent_id"],
-            expert["name"],
-            json.dumps(expert["background_info"], ensure_ascii=False),
-            json.dumps(expert["personality_traits"], ensure_ascii=False),
-            json.dumps(expert["knowledge_base_links"], ensure_ascii=False),
-            json.dumps(expert["communication_style"], ensure_ascii=False)
-        ))
-    
-    # 提交并关闭连接
-    conn.commit()
-    conn.close()
+    # 在同一个事务中清除旧数据并插入新的专家数据
+    with connect(AGENTS) as conn:
+        conn.execute(text('DELETE FROM agents'))
+        
+        for expert in experts:
+            conn.execute(text('''
+                INSERT INTO agents 
+                (agent_id, name, background_info, personality_traits, knowledge_base_links, communication_style)
+                VALUES (:agent_id, :name, :background_info, :personality_traits, :knowledge_base_links, :communication_style)
+            '''), {
+                "agent_id": expert["agent_id"],
+                "name": expert["name"],
+                "background_info": json.dumps(expert["background_info"], ensure_ascii=False),
+                "personality_traits": json.dumps(expert["personality_traits"], ensure_ascii=False),
+                "knowledge_base_links": json.dumps(expert["knowledge_base_links"], ensure_ascii=False),
+                "communication_style": json.dumps(expert["communication_style"], ensure_ascii=False)
+            })
     
     print("专家数据已更新!")
 
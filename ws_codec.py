@@ -0,0 +1,84 @@
+"""
+WebSocket 帧编码模块
+客户端连接时通过 ?encoding= 参数选择帧编码，未指定时使用 JSON 文本帧
+
+- json:    标准库 json，文本帧（默认，浏览器页面使用）
+- orjson:  orjson 序列化，文本帧，编码更快
+- msgpack: MessagePack 二进制帧，体积更小，适合非浏览器客户端
+"""
+
+import json
+import importlib
+import logging
+from starlette.websockets import WebSocket
+
+logger = logging.getLogger("roundtable.ws_codec")
+
+# 帧编码基类
+class FrameCodec:
+    def __init__(self):
+        self.name = "Base Frame Codec"
+
+    def encode(self, message):
+        """把消息（dict 或 list）编码为可直接发送的 str / bytes"""
+        raise NotImplementedError("子类必须实现encode方法")
+
+    async def send(self, websocket: WebSocket, data):
+        """发送 encode 的结果，str 为文本帧，bytes 为二进制帧"""
+        if isinstance(data, bytes):
+            await websocket.send_bytes(data)
+        else:
+            await websocket.send_text(data)
+
+# 标准库 JSON 文本帧（默认）
+class JSONCodec(FrameCodec):
+    def __init__(self):
+        super().__init__()
+        self.name = "json"
+
+    def encode(self, message):
+        # 紧凑分隔符，中文不转义为 \uXXXX，减小帧体积
+        return json.dumps(message, ensure_ascii=False, separators=(",", ":"))
+
+# orjson 文本帧
+class OrjsonCodec(FrameCodec):
+    def __init__(self, orjson):
+        super().__init__()
+        self.name = "orjson"
+        self._orjson = orjson
+
+    def encode(self, message):
+        return self._orjson.dumps(message).decode("utf-8")
+
+# MessagePack 二进制帧
+class MsgpackCodec(FrameCodec):
+    def __init__(self, msgpack):
+        super().__init__()
+        self.name = "msgpack"
+        self._msgpack = msgpack
+
+    def encode(self, message):
+        return self._msgpack.packb(message, use_bin_type=True)
+
+# 帧编码工厂
+class FrameCodecFactory:
+    _default = JSONCodec()
+
+    @staticmethod
+    def get_codec(encoding=None):
+        """根据名称返回帧编码器，依赖库未安装或名称无效时回退到 JSON"""
+        encoding = (encoding or "json").lower()
+
+        if encoding == "json":
+            return FrameCodecFactory._default
+        elif encoding in ("orjson", "msgpack"):
+            try:
+                # 使用条件导入，因为可能没有安装 orjson / msgpack 库
+                module = importlib.import_module(encoding)
+            except (ImportError, ModuleNotFoundError):
+                logger.warning(f"{encoding} 库未安装，WebSocket帧使用 JSON 编码")
+                return FrameCodecFactory._default
+            return OrjsonCodec(module) if encoding == "orjson" else MsgpackCodec(module)
+        else:
+            logger.warning(f"不支持的WebSocket帧编码 {encoding}，使用 JSON 编码")
+            return FrameCodecFactory._default